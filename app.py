@@ -1,5 +1,5 @@
 #!../.venv/bin/python3
-import sys
+import os, sys, time
 import streamlit as st
 
 from streamlit import runtime
@@ -7,20 +7,65 @@ from streamlit.web.cli import main as strunner
 from streamlit.delta_generator import DeltaGenerator
 
 from resources import *
+from resources.prerender import PrerenderedPrompts
+from resources.llm import LLMClient, LLMConfig
+from resources.responses import ResponseCache
+from resources.telemetry import UsageTelemetry, has_custom_inputs
+
+SHARED_CACHE_ENV = "MEDICAL_LLM_SHARED_CACHE" # SQLite file shared by the workers of a host (optional)
+LLM_RUN_KEY = "llm_run_requested"
 
 @st.cache_resource
-def load_participant(target: PublicTarget) -> MedicalEndUser:
+def load_shared_library() -> SharedLibrary|None:
+    path = os.environ.get(SHARED_CACHE_ENV)
+    return SharedLibrary(path) if path else None
+
+def served_generation() -> int: # cached loads below are kept per library generation
+    library = load_shared_library()
+    return library.generation() if library is not None else library_generation()
+
+@st.cache_resource(max_entries=2 * len(PublicTarget))
+def load_participant(target: PublicTarget, generation: int) -> MedicalEndUser:
+    library = load_shared_library()
     return MedicalEndUser(
         type=target,
-        tasks=Loader().load_tasks_from_fs(target=target)
+        tasks=library.load_tasks(target) if library is not None else Loader().load_tasks_from_fs(target=target)
     )
 
-@st.cache_resource(hash_funcs={MedicalTask: MedicalTask.__hash__})
-def load_template(target: PublicTarget, task: MedicalTask) -> MedicalTemplate|None:
-    if (task_templates := Loader.load_templates_from_fs(target, task)) is None:
+@st.cache_resource(hash_funcs={MedicalTask: MedicalTask.__hash__}, max_entries=1024)
+def load_templates(target: PublicTarget, task: MedicalTask, generation: int) -> MedicalTemplate|set[MedicalTemplate]|None:
+    library = load_shared_library()
+    return library.load_templates(target, task) if library is not None else Loader.load_templates_from_fs(target, task)
+
+@st.cache_resource(max_entries=2)
+def load_prerendered(generation: int) -> PrerenderedPrompts|None: # only if built from this library generation
+    prerendered = PrerenderedPrompts.open()
+    return prerendered if prerendered is not None and prerendered.generation == generation else None
+
+@st.cache_resource
+def load_llm_client() -> LLMClient|None: # one connection pool per process, if an endpoint is configured
+    config = LLMConfig.from_env()
+    return LLMClient(config) if config is not None else None
+
+@st.cache_resource
+def load_response_cache() -> ResponseCache:
+    return ResponseCache.from_env()
+
+@st.cache_resource
+def load_telemetry() -> UsageTelemetry: # one buffer (and flushing thread) per process
+    return UsageTelemetry.from_env()
+
+@st.cache_resource
+def load_score_log() -> ScoreLog:
+    return ScoreLog()
+
+def load_template(target: PublicTarget, task: MedicalTask, generation: int) -> MedicalTemplate|None:
+    if (task_templates := load_templates(target, task, generation)) is None:
         return None
     
-    return max(task_templates, key=lambda t: (t.score, t.iteration)) # (higher) score >> (last) iteration 
+    scores = load_score_log()
+    scores.refresh() # only the reviews appended meanwhile
+    return max(settization(task_templates), key=scores.rank) # (higher) score >> (last) iteration 
 
 
 def configuration_form(task: MedicalTask, template: MedicalTemplate) -> bool:
@@ -33,7 +78,8 @@ def configuration_form(task: MedicalTask, template: MedicalTemplate) -> bool:
                 task[prop] = draw_user_input_for_type(
                     value_type=task.prop_type(prop),
                     label=from_canonical_prop(prop),
-                    value=task.prop_value(prop, default=True)
+                    value=task.prop_value(prop, default=True),
+                    **({ "selected": task[prop] } if task.prop_type(prop) is list else {})
                 )
 
     properties = sorted(template.get_required_variables())
@@ -48,12 +94,43 @@ def configuration_form(task: MedicalTask, template: MedicalTemplate) -> bool:
     return False
 
 
-def draw_template(template: MedicalTemplate|None):
+def request_llm_run():
+    st.session_state[LLM_RUN_KEY] = True # survives the rerun of the click, unlike the submit button
+
+
+def draw_llm_response(client: LLMClient, prompt: str, run: bool):
+    st.button("▶️ Run", on_click=request_llm_run, help=f"Send the prompt to {client.config.model}")
+    if not run:
+        return
+
+    with st.chat_message("assistant"):
+        try:
+            st.write_stream(load_response_cache().stream(client, prompt)) # replayed if already answered
+        except (ConnectionError, TimeoutError) as e:
+            st.error(f"The model could not answer: {e}")
+
+
+def draw_llm_metrics(client: LLMClient):
+    stats = load_response_cache().stats()
+    with st.expander("⚡ Model Responses (process-wide)"):
+        ratio_col, saved_col = st.columns(2)
+        ratio_col.metric("Cache Hit Ratio", f"{stats['hit_ratio']:.0%}")
+        saved_col.metric("Saved Latency", f"{stats['saved_seconds']:.1f} s")
+        st.caption(
+            f"{stats['memory_hits']} memory / {stats['disk_hits']} disk hits, {stats['misses']} misses; "
+            f"{client.stats()['requests']} requests sent to {client.config.model}"
+        )
+
+
+def draw_template(template: MedicalTemplate|None, prompt: str|None=None, run: bool=False):
     st.subheader("III. Template Result 📩")
     
-    prompt = template.build()
+    if prompt is None: # not pre-rendered for these inputs
+        prompt = template.build()
 
-    st.write(f"**Obtained Prompt:** {template.iteration} | {template.name} ({template.score} ⭐ ; *{len(prompt)} characters*)")
+    st.write(f"**Obtained Prompt:** {template.iteration} | {template.name} ({load_score_log().score(template):.1f} ⭐ ; *{len(prompt)} characters*)")
+    tokens, status = template.token_budget_status() # only the filled-in values are counted
+    within_budget = draw_token_budget(tokens, status, template.token_budget)
 
     # if "template" not in st.session_state:
     #     st.session_state["template"] = {}
@@ -72,6 +149,9 @@ def draw_template(template: MedicalTemplate|None):
     with copy_col:
         text_copy_button(text=prompt)        
     
+    if (client := load_llm_client()) is not None and within_budget: # over it, the prompt is not sent
+        draw_llm_response(client, prompt, run)
+
     st.image("resources/storage/img/chatgptlogo.png", width=45)
     st.info("Please copy the template! 👉 Move to **[ChatGPT](%s)** to prompt it!" \
             %("https://chat.openai.com"))
@@ -94,7 +174,8 @@ def streamlit_app():
         options=list(PublicTarget)
     )
 
-    participant = load_participant(target_profile)
+    generation = served_generation()
+    participant = load_participant(target_profile, generation)
 
     task_name = st.selectbox(
         label=f"📝 Idealize a task tailored to **{target_profile}s**", 
@@ -108,17 +189,32 @@ def streamlit_app():
     st.subheader("II. Fill out the Template ✍🏻")
 
     task = participant.get_task(name=task_name)
-    template = load_template(target_profile, task)
+    template = load_template(target_profile, task, generation)
     if template is None:
         st.write("No available templates for this task")
 
     form_submitted = configuration_form(task, template)
-    if form_submitted:
+    run_requested = st.session_state.pop(LLM_RUN_KEY, False)
+    if form_submitted or run_requested:
         st.divider()
-        draw_template(template)
+        prerendered = load_prerendered(generation)
+        start = time.perf_counter()
+        prompt = prerendered.lookup(target_profile, task, template) if prerendered else None
+        was_prerendered = prompt is not None
+        if prompt is None: # not pre-rendered for these inputs
+            prompt = template.build()
+        load_telemetry().record( # buffered, written by a thread of its own
+            target_profile, task, template,
+            render_seconds=time.perf_counter() - start,
+            custom_inputs=has_custom_inputs(task), # required or optional, used by the template or not
+            prerendered=was_prerendered
+        )
+        draw_template(template, prompt=prompt, run=run_requested)
     
 
     with st.sidebar:
+        if (client := load_llm_client()) is not None:
+            draw_llm_metrics(client)
         st.json(task.to_json())
              
 
@@ -0,0 +1,34 @@
+#!../.venv/bin/python3
+import time, json, argparse
+from pathlib import Path
+
+from resources import *
+
+def main():
+    parser = argparse.ArgumentParser(description="Move the template files of every task into its delta-compressed history")
+    parser.add_argument("--storage", type=Path, default=None, help="Library root with tasks/ and templates/ (default: resources/storage)")
+    parser.add_argument("--target", action="append", default=None, help="Public target to archive (repeatable)")
+    args = parser.parse_args()
+
+    if args.storage is not None:
+        use_storage(args.storage)
+    targets = [PublicTarget[t.strip().upper().replace(" ", "_")] for t in args.target] if args.target else list(PublicTarget)
+
+    start = time.perf_counter()
+    archived = file_bytes = history_bytes = 0
+    for target in targets:
+        counts = Loader.archive_templates(target)
+        archived += counts["archived"]
+        file_bytes += counts["file_bytes"]
+        history_bytes += sum(path.stat().st_size for history in Loader.template_histories(target) for path in history.paths if path.exists())
+
+    print(json.dumps({
+        "archived": archived,
+        "file_bytes": file_bytes,
+        "history_bytes": history_bytes, # of the whole histories (earlier saves included)
+        "seconds": round(time.perf_counter() - start, 3)
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#################################################
+# Offline stand-in for an OpenAI-compatible LLM #
+#################################################
+
+# From the project root:
+#   python -m benchmarks.llm_stub_server [--port 8503] [--token-delay 0.01] [--tokens 64]
+#   MEDICAL_LLM_BASE_URL=http://127.0.0.1:8503/v1 python app.py
+# - POST /v1/chat/completions streams a canned answer (server-sent events), one word per token-delay
+# | Non-streamed requests get the whole answer at once, as a chat.completion
+
+import argparse, json, sys, time
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER_WORDS = (
+    "As your medical assistant I have read the prompt carefully and here is a structured answer "
+    "covering the requested topics with clear language adapted to the target audience"
+).split()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive connections
+    disable_nagle_algorithm = True # every event is written apart
+    token_delay: float = 0.01
+    num_tokens: int = 64
+    verbose: bool = False
+
+    def _send_json(self, status: HTTPStatus, data: dict) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(HTTPStatus.NOT_FOUND, { "error": { "message": f"Unknown resource '{self.path}'" } })
+            return
+
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        model = request.get("model", "stub")
+        tokens = [f"{ANSWER_WORDS[i % len(ANSWER_WORDS)]} " for i in range(self.num_tokens)]
+
+        if not request.get("stream"):
+            time.sleep(self.token_delay * len(tokens))
+            self._send_json(HTTPStatus.OK, {
+                "object": "chat.completion", "model": model,
+                "choices": [{ "index": 0, "message": { "role": "assistant", "content": "".join(tokens) }, "finish_reason": "stop" }]
+            })
+            return
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for token in tokens:
+            time.sleep(self.token_delay)
+            event = { "object": "chat.completion.chunk", "model": model, "choices": [{ "index": 0, "delta": { "content": token } }] }
+            self._write_chunk(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+        self._write_chunk(b"data: [DONE]\n\n")
+        self._write_chunk(b"") # end of the chunked body
+
+    def log_message(self, format: str, *args) -> None:
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def serve(host: str, port: int, token_delay: float, num_tokens: int, verbose: bool=False) -> ThreadingHTTPServer:
+    StubHandler.token_delay = token_delay
+    StubHandler.num_tokens = num_tokens
+    StubHandler.verbose = verbose
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible stub that streams canned answers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8503)
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between streamed tokens")
+    parser.add_argument("--tokens", type=int, default=64, help="Tokens per answer")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    server = serve(args.host, args.port, args.token_delay, args.tokens, args.verbose)
+    print(f"Stub LLM on http://{args.host}:{args.port}/v1", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+###########################################
+# How fast are stored tasks deserialized? #
+###########################################
+
+# Run from the project root: python -m benchmarks.load_tasks [--tasks 10000] [--properties 12]
+# - "legacy" mimics the former path: type_from_str and get_typed_value (strptime) per property, a throwaway
+# | Property re-inserted through __setitem__, and properties kept in a set found by a linear scan
+# - "compiled" is MedicalTask.from_json: one converter per type, properties indexed by name in one pass
+# - "fs" loads the same tasks from their files, through the Loader
+
+import argparse, json, random, tempfile, time
+from pathlib import Path
+
+from resources.domain.target import PublicTarget
+from resources.domain.task import MedicalTask, Property
+from resources.domain.vocabulary import Vocabulary
+from resources.storage.load import Loader, use_storage
+from resources.utils import get_typed_value, settization, type_from_str
+from benchmarks.synthetic import synthetic_task, write_synthetic_storage
+
+
+class _LegacyTask:
+
+    def __init__(self, name: str, target: PublicTarget):
+        self._name = name
+        self._target = target
+        self._req = False
+        self._properties: set[Property] = set()
+
+    def _find_property(self, name: str) -> Property|None:
+        return next((p for p in self._properties if p.info[0] == name), None)
+
+    def __getitem__(self, key: str):
+        return self._find_property(key).value
+
+    def __setitem__(self, key: str, value) -> None:
+        if (prop := self._find_property(key)):
+            prop.set_value(value, required=self._req)
+            return
+        new_prop = Property(name=key, type=list if isinstance(value, Vocabulary) else type(value), required=self._req)
+        new_prop.set_value(value)
+        self._properties.add(new_prop)
+
+    @classmethod
+    def from_json(cls, target: PublicTarget, json_data: dict) -> '_LegacyTask':
+        dummy = cls(json_data["name"], target)
+        for prop_data in json_data["properties"]:
+            if prop_data["required"]:
+                dummy._req = True
+            prop = _legacy_property(prop_data)
+            dummy[prop.info[0]] = prop.default_value if prop.info[1] is list else prop.value
+            if prop.info[1] is list and prop_data.get("selected") is not None:
+                dummy[prop.info[0]] = prop.value
+            dummy._req = False
+        return dummy
+
+
+def _legacy_property(prop_data: dict) -> Property:
+    prop = Property(name=prop_data["name"], type=type_from_str(prop_data["type"]), required=prop_data["required"])
+    if prop.info[1] is list:
+        prop.set_value(Vocabulary.from_json(prop_data["value"]))
+        if prop_data.get("selected") is not None:
+            prop.set_value(prop_data["selected"])
+        return prop
+    prop.set_value(get_typed_value(prop_data["value"], prop.info[1]))
+    return prop
+
+
+def measure(from_json, corpus: list[tuple[PublicTarget, str, list[str]]]) -> tuple[float, list]:
+    # Decoded and deserialized, then every property read once (as a form does)
+    start = time.perf_counter()
+    loaded = []
+    for target, data, names in corpus:
+        task = from_json(target, json.loads(data))
+        loaded.append([task[name] for name in names])
+    return time.perf_counter() - start, loaded
+
+
+def measure_fs(num_tasks: int, num_properties: int, seed: int) -> float:
+    with tempfile.TemporaryDirectory(prefix="load_tasks_") as tmp:
+        write_synthetic_storage(Path(tmp), num_tasks, 0, seed=seed, num_properties=num_properties)
+        use_storage(Path(tmp))
+        start = time.perf_counter()
+        loaded = sum(len(settization(Loader.load_tasks_from_fs(target) or set())) for target in PublicTarget)
+        elapsed = time.perf_counter() - start
+    assert loaded == num_tasks
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deserialization time of stored tasks")
+    parser.add_argument("--tasks", type=int, default=10_000)
+    parser.add_argument("--properties", type=int, default=12, help="Properties per task")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    targets = list(PublicTarget)
+    corpus = []
+    for i in range(args.tasks):
+        data = synthetic_task(i, rnd, num_properties=args.properties)
+        corpus.append((targets[i % len(targets)], json.dumps(data), [p["name"] for p in data["properties"]]))
+
+    legacy_seconds, legacy_values = measure(_LegacyTask.from_json, corpus)
+    compiled_seconds, compiled_values = measure(MedicalTask.from_json, corpus)
+    assert legacy_values == compiled_values, "Both paths must yield the same typed values"
+
+    results = {
+        "legacy": legacy_seconds,
+        "compiled": compiled_seconds,
+        "fs": measure_fs(args.tasks, args.properties, args.seed),
+    }
+    for path, seconds in results.items():
+        print(f"{path:>8}: {seconds:7.3f} s ({seconds / args.tasks * 1e6:7.1f} us/task)")
+    print(f"speedup: {legacy_seconds / compiled_seconds:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+#######################################################
+# How do both apps behave with many sessions at once? #
+#######################################################
+
+# From the project root:
+#   python -m benchmarks.load_test_apps [--app both|app|create_task] [--sessions 8] [--tasks 200] [--storage DIR]
+# - Every session is an AppTest of the real script, all of them in one process (sharing its cached resources)
+# | app.py: select a target, pick a task, fill the configuration form and submit it
+# | create_task.py: select a target, pick a task, open a template, apply edits (text, then score) and reset it
+# - Each interaction is timed, and so are the script runs it caused (st.rerun included)
+# | Without --storage, the sessions run against a synthetic library written to a temporary folder
+# - With --app both, each app runs in a process of its own, so peak RSS is not shared between them
+
+import argparse, datetime, json, resource, subprocess, sys, tempfile, threading, time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Optional
+
+from unittest.mock import MagicMock
+
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1 import element_tree
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+
+from benchmarks.load_test_llm import summary
+from benchmarks.synthetic import write_synthetic_storage
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+APPS = ("app", "create_task")
+RUNS_KEY = "_load_test_runs" # script runs of the session, counted by the entry script
+
+ENTRY_SCRIPT = """\
+import sys
+sys.path.insert(0, {project!r})
+
+import streamlit as st
+st.session_state[{runs_key!r}] = st.session_state.get({runs_key!r}, 0) + 1
+
+from resources import use_storage
+use_storage({storage!r})
+
+import {app}
+{app}.streamlit_app()
+"""
+
+
+# APPTEST WORKAROUNDS ---------------------------------------------------------------------------------------------- #
+
+def _selectbox_index(self) -> Optional[int]:
+    # AppTest looks the selected value up among the formatted options, which fails for selectboxes with a
+    # | format_func (e.g., the property selector of create_task.py); those keep the index they were drawn with
+    if self.value is None:
+        return None
+    if not self.options:
+        return 0
+    try:
+        return self.options.index(str(self.value))
+    except ValueError:
+        return self.proto.default
+
+element_tree.Selectbox.index = property(_selectbox_index)
+
+# Every AppTest run installs a runtime of its own and removes it when done, which breaks the runs of the other
+# | sessions; they all share one instead, as the sessions of a Streamlit server do
+_shared_runtime = MagicMock(spec=Runtime)
+_shared_runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+_shared_runtime.cache_storage_manager = MemoryCacheStorageManager()
+Runtime.instance = classmethod(lambda cls: _shared_runtime)
+Runtime.exists = classmethod(lambda cls: True)
+
+# AppTest keeps button triggers set after a run (to expose them), so a click followed by st.rerun() clicks again
+# | on every rerun (e.g., Reset of create_task.py never stops); they are reset as a Streamlit server does
+_on_script_finished = LocalScriptRunner._on_script_finished
+
+def _on_script_finished_resetting_triggers(self, ctx, event, premature_stop):
+    _on_script_finished(self, ctx, event, premature_stop)
+    self._session_state._state._reset_triggers()
+
+LocalScriptRunner._on_script_finished = _on_script_finished_resetting_triggers
+
+
+# SESSIONS --------------------------------------------------------------------------------------------------------- #
+
+class Session:
+
+    def __init__(self, script: Path, number: int, timeout: float):
+        self.number = number
+        self.at = AppTest.from_file(str(script), default_timeout=timeout)
+        self.latencies: dict[str, list[float]] = defaultdict(list)
+        self.reruns: dict[str, list[int]] = defaultdict(list)
+        self.errors: list[str] = []
+
+    def _runs(self) -> int:
+        return self.at.session_state[RUNS_KEY] if RUNS_KEY in self.at.session_state else 0
+
+    def step(self, name: str, interact: Callable[[AppTest], object]=lambda at: None) -> bool:
+        runs = self._runs()
+        start = time.perf_counter()
+        try:
+            interact(self.at)
+            self.at.run()
+        except Exception as e: # e.g., a script run timing out
+            self.errors.append(f"{name}: {type(e).__name__}: {e}")
+            return False
+        self.latencies[name].append(time.perf_counter() - start)
+        self.reruns[name].append(self._runs() - runs)
+
+        if self.at.exception:
+            self.errors.extend(f"{name}: {exception.message}" for exception in self.at.exception)
+            return False
+        return True
+
+    def widget(self, kind: str, key_prefix: str):
+        return next((w for w in getattr(self.at, kind) if w.key and w.key.startswith(key_prefix)), None)
+
+    def button(self, label: str): # form submit buttons have no key
+        return next((b for b in self.at.button if b.label == label), None)
+
+
+def pick_task(session: Session, selectbox) -> bool:
+    # A target and one of its tasks, spread over the sessions
+    if not session.step("select_target", lambda at: at.selectbox[0].select_index(session.number % len(at.selectbox[0].options))):
+        return False
+    tasks = selectbox(session.at)
+    if tasks is None or not tasks.options:
+        return False
+    return session.step("select_task", lambda at: selectbox(at).select_index((session.number // 2) % len(tasks.options)))
+
+
+def fill_inputs(session: Session) -> None:
+    # One interaction per form input, as the browser reruns the script whenever one of them changes
+    at, n = session.at, session.number
+    fills = [
+        *(("number_input", i, lambda w: w.set_value(w.value + 1)) for i in range(len(at.number_input))),
+        *(("text_input", i, lambda w: w.set_value(f"load test {n}")) for i in range(len(at.text_input))),
+        *(("date_input", i, lambda w: w.set_value(datetime.date(2024, 1, 1 + n % 28))) for i in range(len(at.date_input))),
+        *(("selectbox", i, lambda w: w.select_index((n + 1) % len(w.options))) for i in range(2, len(at.selectbox))),
+    ]
+    for kind, i, fill in fills:
+        if i < len(getattr(session.at, kind)) and not session.step("fill_input", lambda at: fill(getattr(at, kind)[i])):
+            return
+
+
+def app_session(session: Session, edits: int) -> None:
+    if not session.step("load") or not pick_task(session, lambda at: at.selectbox[1]):
+        return
+    fill_inputs(session)
+    if any(button.label == "Submit" for button in session.at.button):
+        session.step("submit", lambda at: next(button for button in at.button if button.label == "Submit").click())
+
+
+def create_task_session(session: Session, edits: int) -> None:
+    if not session.step("load") or not pick_task(session, lambda at: at.selectbox(key="selected_task")):
+        return
+    if session.widget("toggle", "open_") is None:
+        return
+    if not session.step("open_template", lambda at: session.widget("toggle", "open_").set_value(True)):
+        return
+
+    # Edits are applied by submitting the edit form, each with a single script run
+    for edit in range(edits):
+        editor = session.widget("text_area", "template_")
+        if editor is None or session.button("Apply") is None:
+            return
+        text = f"{editor.value}\nEdited by load test session {session.number} ({edit})."
+        if not session.step("edit_template", lambda at: (session.widget("text_area", "template_").set_value(text), session.button("Apply").click())):
+            return
+
+    if (score := session.widget("number_input", "score_")) is not None:
+        new_score = (score.value % 5) + 1
+        if not session.step("score_template", lambda at: (session.widget("number_input", "score_").set_value(new_score), session.button("Apply").click())):
+            return
+
+    if session.button("Reset") is not None:
+        session.step("reset_template", lambda at: session.button("Reset").click())
+
+
+SCENARIOS = { "app": app_session, "create_task": create_task_session }
+
+
+# RUN -------------------------------------------------------------------------------------------------------------- #
+
+def peak_rss_mib() -> float:
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) # KiB on Linux
+
+def run_app(app: str, storage: Path, scripts: Path, num_sessions: int, edits: int, timeout: float) -> dict:
+    script = scripts.joinpath(f"load_test_{app}.py")
+    script.write_text(ENTRY_SCRIPT.format(project=str(PROJECT_ROOT), runs_key=RUNS_KEY, storage=str(storage), app=app))
+
+    rss_before = peak_rss_mib()
+    sessions = [Session(script, number, timeout) for number in range(num_sessions)]
+    barrier = threading.Barrier(num_sessions) # every session starts together
+
+    def simulate(session: Session):
+        barrier.wait()
+        SCENARIOS[app](session, edits)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=num_sessions) as pool:
+        list(pool.map(simulate, sessions))
+    elapsed = time.perf_counter() - start
+
+    steps = {}
+    for name in dict.fromkeys(name for session in sessions for name in session.latencies): # in first seen order
+        latencies = [l for session in sessions for l in session.latencies[name]]
+        reruns = [r for session in sessions for r in session.reruns[name]]
+        steps[name] = {
+            "count": len(latencies),
+            "latency_ms": summary(latencies),
+            "runs_per_interaction": { "mean": round(sum(reruns) / len(reruns), 2), "max": max(reruns) }
+        }
+    errors = [error for session in sessions for error in session.errors]
+    return {
+        "app": app,
+        "sessions": num_sessions,
+        "elapsed_s": round(elapsed, 2),
+        "interactions": sum(step["count"] for step in steps.values()),
+        "steps": steps,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "peak_rss_mib": peak_rss_mib(),
+        "rss_before_sessions_mib": rss_before,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent-session load test of the Streamlit apps (AppTest)")
+    parser.add_argument("--app", choices=(*APPS, "both"), default="both")
+    parser.add_argument("--sessions", type=int, default=8, help="Concurrent simulated sessions")
+    parser.add_argument("--edits", type=int, default=3, help="Template edits per create_task.py session")
+    parser.add_argument("--storage", type=Path, default=None, help="Library to run against (default: synthetic)")
+    parser.add_argument("--tasks", type=int, default=200, help="Synthetic tasks")
+    parser.add_argument("--per-task", type=int, default=10, help="Synthetic templates per task")
+    parser.add_argument("--timeout", type=float, default=60., help="Seconds allowed per script run")
+    parser.add_argument("--output", type=Path, default=None, help="JSON report file (default: stdout)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="load_test_apps_") as tmp:
+        corpus = { "storage": str(args.storage) } if args.storage else { "tasks": args.tasks, "templates_per_task": args.per_task }
+        if args.storage is None: # the apps may write to it (e.g., scores), so never the real library
+            args.storage = Path(tmp).joinpath("storage")
+            write_synthetic_storage(args.storage, args.tasks, args.per_task)
+        else:
+            args.storage = args.storage.resolve()
+
+        if args.app == "both":
+            reports = []
+            for app in APPS:
+                command = [
+                    sys.executable, "-m", "benchmarks.load_test_apps", "--app", app, "--storage", str(args.storage),
+                    "--sessions", str(args.sessions), "--edits", str(args.edits), "--timeout", str(args.timeout)
+                ]
+                output = subprocess.run(command, cwd=PROJECT_ROOT, check=True, capture_output=True, text=True).stdout
+                reports.append({ **json.loads(output), "corpus": corpus })
+        else:
+            reports = [{ **run_app(args.app, args.storage, Path(tmp), args.sessions, args.edits, args.timeout), "corpus": corpus }]
+
+    report = json.dumps(reports if len(reports) > 1 else reports[0], indent=4)
+    if args.output is None:
+        print(report)
+    else:
+        args.output.write_text(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#######################################################
+# How fast are streamed answers through the LLM pool? #
+#######################################################
+
+# From the project root:
+#   python -m benchmarks.load_test_llm [--url http://127.0.0.1:8503/v1] [--clients 16] [--requests 256]
+# - Without --url, the stub server is started in-process (offline)
+# | Every client thread shares one LLMClient, as the sessions of a Streamlit process do
+
+import argparse, json, statistics, threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.llm_stub_server import serve
+from benchmarks.load_test_service import percentile
+from resources.llm import LLMClient, LLMConfig
+
+
+def summary(values: list[float]) -> dict[str, float]:
+    values = sorted(values)
+    return {
+        "mean": round(statistics.fmean(values) * 1e3, 2),
+        "p50": round(percentile(values, 50) * 1e3, 2),
+        "p90": round(percentile(values, 90) * 1e3, 2),
+        "p99": round(percentile(values, 99) * 1e3, 2),
+        "max": round(values[-1] * 1e3, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of streamed LLM requests through the pooled client")
+    parser.add_argument("--url", default=None, help="OpenAI-compatible base URL (default: in-process stub)")
+    parser.add_argument("--clients", type=int, default=16, help="Concurrent sessions")
+    parser.add_argument("--requests", type=int, default=256, help="Total number of prompts")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="Requests in flight per process")
+    parser.add_argument("--token-delay", type=float, default=0.005, help="Stub seconds between tokens")
+    parser.add_argument("--tokens", type=int, default=64, help="Stub tokens per answer")
+    args = parser.parse_args()
+
+    server = None
+    if args.url is None:
+        server = serve("127.0.0.1", 0, args.token_delay, args.tokens)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        args.url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    client = LLMClient(LLMConfig(base_url=args.url, model="stub", max_concurrency=args.max_concurrency, timeout=120.))
+    prompt = "Explain the prescribed treatment to the patient in plain words."
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        results = list(pool.map(lambda _: client.timed_complete(prompt), range(args.requests)))
+    elapsed = time.perf_counter() - start
+
+    stats = client.stats()
+    print(json.dumps({
+        "url": args.url,
+        "requests": len(results),
+        "clients": args.clients,
+        "max_concurrency": args.max_concurrency,
+        "connections_opened": stats["connections"],
+        "failures": stats["failures"],
+        "requests_per_second": round(len(results) / elapsed, 1),
+        "tokens_per_second": round(stats["tokens"] / elapsed, 1),
+        "first_token_ms": summary([first for _, first, _ in results]),
+        "total_ms": summary([total for _, _, total in results])
+    }, indent=4))
+
+    client.close()
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+###################################################
+# How many prompts can the render service serve? #
+###################################################
+
+# Start the service first (python render_service.py), then from the project root:
+#   python -m benchmarks.load_test_service [--url http://127.0.0.1:8502] [--clients 8] [--requests 2000]
+# - Every client keeps one connection alive and cycles through the tasks of the service
+
+import argparse, json, statistics, time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import quote, urlparse
+
+
+def request(conn: HTTPConnection, method: str, path: str, body: dict|None=None) -> tuple[int, dict]:
+    payload = json.dumps(body).encode("utf-8") if body is not None else None
+    headers = { "Content-Type": "application/json" } if payload is not None else {}
+    conn.request(method, path, body=payload, headers=headers)
+    response = conn.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def discover_renders(host: str, port: int) -> list[str]:
+    conn = HTTPConnection(host, port, timeout=30)
+    paths = []
+    _, targets = request(conn, "GET", "/targets")
+    for target in targets:
+        _, tasks = request(conn, "GET", f"/targets/{target['id']}/tasks")
+        for task in tasks:
+            task_path = f"/targets/{target['id']}/tasks/{quote(task['name'])}"
+            if request(conn, "GET", f"{task_path}/template")[0] == 200:
+                paths.append(f"{task_path}/render")
+    conn.close()
+    return paths
+
+
+def client(host: str, port: int, paths: list[str], num_requests: int, offset: int) -> tuple[list[float], int]:
+    conn = HTTPConnection(host, port, timeout=30)
+    latencies, failures = [], 0
+    for i in range(num_requests):
+        start = time.perf_counter()
+        status, _ = request(conn, "POST", paths[(offset + i) % len(paths)], body={})
+        latencies.append(time.perf_counter() - start)
+        failures += status != 200
+    conn.close()
+    return latencies, failures
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(p / 100 * len(sorted_values)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of a local render service")
+    parser.add_argument("--url", default="http://127.0.0.1:8502")
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent keep-alive connections")
+    parser.add_argument("--requests", type=int, default=2000, help="Total number of render requests")
+    args = parser.parse_args()
+
+    url = urlparse(args.url)
+    paths = discover_renders(url.hostname, url.port)
+    assert paths, "The service has no task with templates to render"
+
+    per_client = max(1, args.requests // args.clients)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.clients) as pool:
+        results = list(pool.map(
+            lambda c: client(url.hostname, url.port, paths, per_client, offset=c),
+            range(args.clients)
+        ))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(l for client_latencies, _ in results for l in client_latencies)
+    failures = sum(f for _, f in results)
+    print(json.dumps({
+        "requests": len(latencies),
+        "failures": failures,
+        "clients": args.clients,
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "latency_ms": {
+            "mean": round(statistics.fmean(latencies) * 1e3, 2),
+            "p50": round(percentile(latencies, 50) * 1e3, 2),
+            "p90": round(percentile(latencies, 90) * 1e3, 2),
+            "p99": round(percentile(latencies, 99) * 1e3, 2),
+            "max": round(latencies[-1] * 1e3, 2),
+        }
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
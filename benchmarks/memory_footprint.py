@@ -0,0 +1,89 @@
+##########################################################
+# How much memory does a loaded template corpus take up? #
+##########################################################
+
+# Run from the project root: python -m benchmarks.memory_footprint [--templates 10000]
+# - "legacy" mimics the former layout: per-instance dicts, non-interned names and
+# | a private copy of the template content even when it equals the original prompt
+
+import argparse, gc, json, tracemalloc
+
+from resources.domain.task import MedicalTask
+from resources.domain.template import MedicalTemplate, MedicalPrompt
+from benchmarks.synthetic import synthetic_corpus
+
+
+class _LegacyPrompt(str):
+    def __new__(cls, content: str, **_):
+        return super().__new__(cls, content)
+
+    def __init__(self, _, score: int, name: str, iteration: int):
+        self.score = score
+        self.name = name
+        self.iteration = iteration
+
+
+class _LegacyTemplate:
+    def __init__(self, prompt: _LegacyPrompt, task: MedicalTask, content: str|None):
+        self._prompt = prompt
+        self._task = task
+        self._content = str(content if content else prompt)
+
+
+def load_compact(corpus) -> list:
+    loaded = []
+    for target, task_data, templates_data in corpus:
+        task = MedicalTask.from_json(target, json.loads(task_data))
+        loaded.extend(MedicalTemplate.from_json(task, json.loads(data)) for data in templates_data)
+    return loaded
+
+
+def load_legacy(corpus) -> list:
+    loaded = []
+    for target, task_data, templates_data in corpus:
+        task = MedicalTask.from_json(target, json.loads(task_data))
+        templates_data = map(json.loads, templates_data)
+        loaded.extend(
+            _LegacyTemplate(
+                prompt=_LegacyPrompt(data["prompt"], score=data["score"], name=data["name"], iteration=data["iteration"]),
+                task=task,
+                content=data.get("template")
+            ) for data in templates_data
+        )
+    return loaded
+
+
+def measure(loader, num_templates: int, per_task: int, edited_ratio: float) -> int:
+    corpus = [ # serialized as on disk, so the decoded strings are traced as well
+        (target, json.dumps(task), list(map(json.dumps, templates)))
+        for target, task, templates in synthetic_corpus(num_templates // per_task, per_task, edited_ratio=edited_ratio)
+    ]
+    gc.collect()
+    tracemalloc.start()
+    loaded = loader(corpus)
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    assert loaded
+    return current
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Memory footprint of a synthetic template corpus")
+    parser.add_argument("--templates", type=int, default=10_000)
+    parser.add_argument("--per-task", type=int, default=40)
+    parser.add_argument("--edited-ratio", type=float, default=0.1, help="Share of templates whose content differs from the prompt")
+    args = parser.parse_args()
+
+    results = {
+        "legacy": measure(load_legacy, args.templates, args.per_task, args.edited_ratio),
+        "compact": measure(load_compact, args.templates, args.per_task, args.edited_ratio),
+    }
+
+    for layout, size in results.items():
+        print(f"{layout:>8}: {size / 2**20:8.2f} MiB ({size / args.templates:8.1f} B/template)")
+    print(f"reduction: {1 - results['compact'] / results['legacy']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
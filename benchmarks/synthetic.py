@@ -0,0 +1,105 @@
+######################################
+# Synthetic corpora for benchmarking #
+######################################
+
+# - Mirrors the JSON layout of resources/storage so the real loading paths are exercised
+# | Every document goes through a json round-trip, as if it was read from its own file
+# - Can also be written down as a whole storage (tasks/ and templates/) for the Loader
+
+import json, random, datetime
+from collections import Counter
+from pathlib import Path
+
+from resources.domain.target import PublicTarget
+
+PROMPT_NAMES = [
+    "Zero-shot",
+    "Clinical Persona",
+    "Chain of Thought",
+    "Few-shot Examples",
+    "Structured Output",
+    "Self-consistency"
+]
+
+WORDS = (
+    "patient heart valve infection fever symptom treatment guideline dose risk "
+    "flyer page topic language complexity lifestyle nutrition prevention physician "
+    "student exam case report evidence diagnosis"
+).split()
+
+PROPERTY_VALUES = [
+    ("int", lambda rnd: rnd.randint(1, 10)),
+    ("float", lambda rnd: round(rnd.uniform(0, 100), 2)),
+    ("str", lambda rnd: " ".join(rnd.choices(WORDS, k=8))),
+    ("date", lambda rnd: datetime.date(2024, rnd.randint(1, 12), rnd.randint(1, 28)).strftime("%d-%m-%Y")),
+    ("list", lambda rnd: rnd.sample(WORDS, k=3)),
+]
+
+
+def _roundtrip(data: dict) -> dict:
+    return json.loads(json.dumps(data))
+
+
+def synthetic_task(index: int, rnd: random.Random, num_properties: int=6) -> dict:
+    properties = []
+    for i in range(num_properties):
+        type_name, value_gen = PROPERTY_VALUES[i % len(PROPERTY_VALUES)]
+        properties.append({
+            "name": f"property_{i}_{type_name}",
+            "value": value_gen(rnd),
+            "type": type_name,
+            "required": i % 2 == 0
+        })
+    return _roundtrip({ "name": f"Synthetic Task {index}", "properties": properties })
+
+
+def synthetic_prompt(task: dict, rnd: random.Random, words: int=300) -> str:
+    variables = [p["name"] for p in task["properties"]]
+    body = [rnd.choice(WORDS) for _ in range(words)]
+    for variable in variables:
+        body.insert(rnd.randrange(len(body)), "{" + variable + "}")
+    return " ".join(body)
+
+
+def synthetic_template(task: dict, iteration: int, rnd: random.Random, edited: bool=False, words: int=300) -> dict:
+    prompt = synthetic_prompt(task, rnd, words)
+    return _roundtrip({
+        "task": task["name"],
+        "iteration": iteration,
+        "name": rnd.choice(PROMPT_NAMES),
+        "score": rnd.randint(0, 5),
+        "prompt": prompt,
+        "template": prompt + "\nAnswer in a concise manner." if edited else prompt
+    })
+
+
+def synthetic_corpus(num_tasks: int, templates_per_task: int, edited_ratio: float=0.1, seed: int=0, words: int=300, num_properties: int=6):
+    rnd = random.Random(seed)
+    for t in range(num_tasks):
+        target = list(PublicTarget)[t % PublicTarget.count()]
+        task = synthetic_task(t, rnd, num_properties)
+        templates = [
+            synthetic_template(task, i, rnd, edited=rnd.random() < edited_ratio, words=words)
+            for i in range(templates_per_task)
+        ]
+        yield target, task, templates
+
+
+def write_synthetic_storage(root: Path, num_tasks: int, templates_per_task: int, **corpus_args) -> None:
+    # Same file naming as the Loader: <prefix>-<target>.json, <prefix>-<target>-1.json, ...
+    def file_name(prefix: str, target: PublicTarget, number: int) -> str:
+        return f"{prefix}-{target}.json" if number == 0 else f"{prefix}-{target}-{number}.json"
+
+    root.joinpath("tasks").mkdir(parents=True, exist_ok=True)
+    root.joinpath("templates").mkdir(parents=True, exist_ok=True)
+    num_task_files, num_template_files = Counter(), Counter()
+
+    for target, task, templates in synthetic_corpus(num_tasks, templates_per_task, **corpus_args):
+        with root.joinpath("tasks", file_name("task", target, num_task_files[target])).open("w") as fp:
+            json.dump(task, fp)
+        num_task_files[target] += 1
+
+        for template in templates:
+            with root.joinpath("templates", file_name("prompt", target, num_template_files[target])).open("w") as fp:
+                json.dump(template, fp)
+            num_template_files[target] += 1
@@ -1,17 +1,26 @@
 #!../.venv/bin/python3
-import sys, string, datetime
+import sys, math, string, datetime, getpass
 import streamlit as st
 
-from uuid import uuid4
 from streamlit import runtime
 from streamlit.web.cli import main as strunner
 from streamlit.runtime.uploaded_file_manager import UploadedFile
 
 from resources import *
+from resources.search import SearchIndex
 
 
 TASK_FORM_KEY = "task_form_expander"
 PROPERTY_FORM_KEY = "property_form_expander"
+TEMPLATE_PAGE_SIZES = [5, 10, 20, 50]
+SESSION_DRAFTS_KEY = "template_drafts"
+SCHEMA_CHANGES_KEY = "schema_changes"
+REVIEWER_KEY = "reviewer"
+SCRIPT_RUNS_KEY = "script_runs" # of the session, so the reruns an edit costs can be told apart
+QUEUED_WRITES_KEY = "queued_writes"
+MAX_SESSION_WRITES = 32 # objects whose write status a session shows
+MAX_SESSION_DRAFTS = 32
+MAX_SESSION_DRAFT_BYTES = 1 << 20
 
 # Using cache resources to keep object references. cache data will create a copy...
 
@@ -26,9 +35,156 @@ def load_participant(target: PublicTarget) -> MedicalEndUser:
 def load_templates_from_fs(target: PublicTarget, task: MedicalTask) -> MedicalTemplate|set[MedicalTemplate]|None:
     return Loader.load_templates_from_fs(target, task)
 
-@st.cache_resource(hash_funcs={MedicalTask: MedicalTask.__hash__, UploadedFile: lambda f: f.file_id})
-def load_templates_from_file(task: MedicalTask, file: UploadedFile) -> MedicalTemplate|set[MedicalTemplate]|None:
-    return Loader.load_templates_from_file(task, file)
+@st.cache_resource
+def load_score_log() -> ScoreLog:
+    return ScoreLog()
+
+@st.cache_resource
+def load_search_index() -> SearchIndex:
+    return SearchIndex.build()
+
+@st.cache_resource
+def load_write_queue() -> WriteBehindQueue: # one worker per process, writes of every session
+    return WriteBehindQueue()
+
+@st.cache_resource(hash_funcs={MedicalTask: lambda t: t.id}) # kept across schema edits of the task
+def load_template_dependencies(task: MedicalTask, source: str, template_ids: tuple[str], _templates: set[MedicalTemplate]) -> TemplateDependencies:
+    return TemplateDependencies(task, _templates)
+
+
+
+def session_drafts() -> LRUCache:
+    if SESSION_DRAFTS_KEY not in st.session_state:
+        st.session_state[SESSION_DRAFTS_KEY] = LRUCache(
+            capacity=MAX_SESSION_DRAFTS,
+            max_bytes=MAX_SESSION_DRAFT_BYTES,
+            sizeof=lambda text: len(text.encode("utf-8"))
+        )
+    return st.session_state[SESSION_DRAFTS_KEY]
+
+
+def session_memory_panel():
+    def approximate_size(value: Any) -> int:
+        if isinstance(value, str):
+            return len(value.encode("utf-8"))
+        if isinstance(value, LRUCache):
+            return value.nbytes
+        return sys.getsizeof(value)
+
+    drafts = session_drafts()
+    usage = { str(key): approximate_size(value) for key, value in st.session_state.items() }
+
+    with st.sidebar.expander("🛠️ Session Memory"):
+        drafts_col, bytes_col = st.columns(2)
+        drafts_col.metric("Drafts", f"{len(drafts)}/{drafts.capacity}")
+        bytes_col.metric("Drafts Size", f"{drafts.nbytes / 1024:.1f} KiB")
+        state_col, runs_col = st.columns(2)
+        state_col.metric("Session State", f"{sum(usage.values()) / 1024:.1f} KiB")
+        runs_col.metric("Script Runs", st.session_state[SCRIPT_RUNS_KEY])
+        render_stats = MedicalTemplate.render_cache_stats()
+        st.caption(
+            f"Rendered prompts (process-wide): {render_stats['entries']} cached, "
+            f"{render_stats['hits']} hits / {render_stats['misses']} misses"
+        )
+        st.json(dict(sorted(usage.items(), key=lambda item: item[1], reverse=True)), expanded=False)
+
+
+def track_writes(keys: list[str]):
+    queued = [key for key in st.session_state.get(QUEUED_WRITES_KEY, []) if key not in keys] + keys
+    st.session_state[QUEUED_WRITES_KEY] = queued[-MAX_SESSION_WRITES:]
+
+
+def session_writes_panel():
+    # Saves are written behind, their status is the one of the last write of each object
+    queue = load_write_queue()
+    records = queue.status(reversed(st.session_state.get(QUEUED_WRITES_KEY, [])))
+    if not records:
+        return
+
+    stats = queue.stats()
+    icons = { "pending": "⏳", "done": "✅", "failed": "❌" }
+    with st.sidebar.expander(f"💾 Saves ({stats['pending']} pending, {stats['failed']} failed)", expanded=stats["failed"] > 0):
+        for record in records:
+            label_col, retry_col = st.columns((8, 2))
+            coalesced = f" *(+{record.coalesced} coalesced)*" if record.coalesced else ""
+            label_col.write(f"{icons[record.status]} {record.label}{coalesced}")
+            if record.status != "failed":
+                continue
+            label_col.caption(record.error)
+            if retry_col.button("Retry", key=f"retry_{record.key}", help="Writes what failed again, as it was queued"):
+                queue.retry(record.key)
+                st.rerun()
+
+
+def reviewer_name() -> str:
+    return st.sidebar.text_input("🧑‍⚕️ Reviewer", key=REVIEWER_KEY, value=getpass.getuser()).strip() or "anonymous"
+
+
+def library_search():
+    with st.sidebar:
+        query = st.text_input("🔎 Search Library", placeholder="Variable, phrase or guideline...")
+        if not query:
+            return
+
+        hits = load_search_index().search(query, limit=10)
+        if not hits:
+            st.caption("No tasks or templates found")
+        for hit in hits:
+            if hit.kind == "task":
+                st.write(f"📝 **{hit.task}** ({hit.target})")
+            else:
+                st.write(f"🧬 {hit.iteration} | {hit.name}  \n*{hit.task}* ({hit.target})")
+
+
+def template_uploads(target: PublicTarget, task: MedicalTask, files: list[UploadedFile]):
+    # Prompt logs are parsed once per content, and only prompts not stored yet are merged (as the next iterations)
+    logs = [file.getvalue() for file in files]
+    merged, counts = Loader.merge_prompt_logs(target, task, logs, dry_run=True)
+
+    summary_col, merge_col = st.columns((8, 2))
+    summary_col.write(
+        f"{counts['parsed']} prompts in {len(files)} files: **{len(merged)} new**, "
+        f"{counts['duplicates']} already stored or repeated"
+    )
+    if not merged or not merge_col.button(f"Merge {len(merged)} new", key=f"merge_{task.name}", type="primary"):
+        return
+
+    merged, _ = Loader.merge_prompt_logs(target, task, logs)
+    for template in merged:
+        load_search_index().add_template(target, template)
+    load_templates_from_fs.clear() # reloaded with the merged iterations
+    st.rerun()
+
+
+def record_schema_change(task: MedicalTask, prop: str):
+    st.session_state.setdefault(SCHEMA_CHANGES_KEY, {}).setdefault(task.id, set()).add(prop)
+
+
+def schema_impact(task: MedicalTask, dependencies: TemplateDependencies):
+    if not (changed_props := st.session_state.get(SCHEMA_CHANGES_KEY, {}).get(task.id)):
+        return
+
+    # Only the templates depending on the changed properties are validated again
+    diagnosis = dependencies.validate(dependencies.affected_by(changed_props))
+    broken = { t: d for t, d in diagnosis.items() if d[0] or d[2] }
+
+    with st.container(border=True):
+        info_col, dismiss_col = st.columns((9, 1))
+        info_col.write(
+            f"🧩 Changes to *{', '.join(map(from_canonical_prop, sorted(changed_props)))}* "
+            f"affect **{len(diagnosis)}** of {len(dependencies)} templates, **{len(broken)}** broken"
+        )
+        if dismiss_col.button("Dismiss", key=f"dismiss_{task.id}"):
+            del st.session_state[SCHEMA_CHANGES_KEY][task.id]
+            st.rerun()
+
+        for template, (missing_required, _, unknown) in sorted(broken.items(), key=lambda item: item[0]):
+            issues = []
+            if missing_required:
+                issues.append("misses required " + ", ".join(sorted(missing_required)))
+            if unknown:
+                issues.append("uses unknown " + ", ".join(sorted(unknown)))
+            st.error(f"{template.iteration} | {template.name}: {'; '.join(issues)}")
 
 
 def create_form(creator, key, button_name, **args):
@@ -113,57 +269,89 @@ def property_creator_form(task: MedicalTask) -> bool:
 
     task[canonical_prop(name)] = value
     task.to_detailed()
+    record_schema_change(task, canonical_prop(name))
     return True
 
 
-def template_viewer(template: Optional[MedicalTemplate]):
+def apply_template_edits(template: MedicalTemplate, dependencies: TemplateDependencies, reviewer: str, given_score: int):
+    drafts = session_drafts()
+    template_original = drafts.get(template.id, str(template)) # the text area keeps starting from it
+    template_changed = st.session_state[f"template_{template.id}"]
+    if template_changed and template_changed != str(template):
+        drafts.put(template.id, template_original)
+        template.change_template(template_changed, to_validate=False) # validated once, by the preview
+        dependencies.track(template)
+
+    score_value = st.session_state[f"score_{reviewer}_{template.id}"]
+    if score_value != given_score:
+        load_score_log().record(template, reviewer, score_value)
+
+
+def reset_template_edits(template: MedicalTemplate, dependencies: TemplateDependencies):
+    template.change_template(None, to_validate=False)
+    dependencies.track(template)
+    session_drafts().pop(template.id)
+    del st.session_state[f"template_{template.id}"] # the widget restarts from the original
+
+
+def template_viewer(template: Optional[MedicalTemplate], dependencies: TemplateDependencies, reviewer: str):
     if template is None:
         return
-    
-    if "template_id" not in st.session_state:
-        st.session_state["template_id"] = {}
 
-    if template.id not in st.session_state.get("template_id"):
-        st.session_state["template_id"][template.id] = str(template), uuid4().hex
+    # Only metadata is needed until the template is opened (its body is loaded on demand)
+    scores = load_score_log()
+    title_col, open_col = st.columns((9, 1))
+    title_col.write(f"#### {template.iteration} | {template.name} ({scores.score(template):.1f} ⭐ ; {scores.reviews(template)} reviews) ####")
+    if not open_col.toggle("Open", key=f"open_{template.id}"):
+        return
+    
+    # Only templates being edited keep the text they started from (frozen widget value)
+    drafts = session_drafts()
+    template_original = drafts.get(template.id, str(template))
 
-    st.write(f"#### {template.iteration} | {template.name} ####")
     template_col, display_col, tool_col = st.columns((4.35, 4.35, 1.35))
 
     template_col.write(f"##### 🧬 Template #####")
-    template_original, hash = st.session_state["template_id"][template.id]
-    template_changed = template_col.text_area(
+    # Text and score are edited together and applied at once, by callbacks run before the script (one run per edit)
+    edit_form = template_col.form(key=f"edit_{template.id}", border=False)
+    template_changed = edit_form.text_area(
         label="Template",
-        key=f"template_{template.id}_{hash}",
+        key=f"template_{template.id}",
         value=template_original,
         label_visibility="hidden",
         height= 24 * (get_rows(line_size=94, words=text2words(template_original)) + 1)
     )
+    if template_changed != template_original:
+        drafts.put(template.id, template_original)
+    else:
+        drafts.pop(template.id)
+
+    # Scores are appended as reviews of their own, the template file is left as is
+    given_score = scores.reviewer_score(template, reviewer)
+    given_score = template.score if given_score is None else given_score
+    score_key = f"score_{reviewer}_{template.id}"
+    st.session_state.setdefault(score_key, given_score) # seeded once, so the widget keeps its identity
+
+    score_col, apply_col, reset_col = edit_form.columns((4, 3, 3))
+    score_col.number_input("Score (1-5⭐)", key=score_key, min_value=0, max_value=5, step=1)
+    apply_col.form_submit_button("Apply", type="primary", on_click=apply_template_edits, args=(template, dependencies, reviewer, given_score))
+    reset_col.form_submit_button("Reset", on_click=reset_template_edits, args=(template, dependencies))
+
     display_col.write(f"##### 👁️ Display View #####")
 
     if not template_changed: return
 
-    tools = tool_col.container(height=150, border=True)
+    tools = tool_col.container(height=75, border=True)
     
     copy_btn, display_tgl = tools.columns((2.75, 7.25))
     
     with copy_btn:
         text_copy_button(template_changed)
 
-    to_display = display_tgl.toggle("Display", key=f"display_{template.id}", value=True)
+    to_display = display_tgl.toggle("Display", key=f"display_{template.id}", value=False) # preview on demand
 
-    score_btn, reset_btn = tools.columns((6, 4))
-
-    score_value = score_btn.number_input("Score (1-5⭐)", key=f"score_{template.id}", value=template.score)
-    if score_value != template.score:
-        template.change_score(new_score=score_value)
-    
-    if reset_btn.button("Reset", key=f"reset_{template.id}"):
-        template_changed = None
-        del st.session_state["template_id"][template.id]
-    
-    if template_changed != str(template):
-        template.change_template(template_changed, to_validate=False)  
-        st.rerun()
+    tokens, status = template.token_budget_status() # literal segments are counted once, only the values per render
+    draw_token_budget(tokens, status, template.token_budget, container=display_col)
 
     if to_display:
         try:
@@ -174,6 +362,30 @@ def template_viewer(template: Optional[MedicalTemplate]):
     st.divider()
 
 
+def template_matches(template: MedicalTemplate, query: str) -> bool:
+    query = query.strip()
+    if not query:
+        return True
+    if query.isdigit(): # by (aggregated) score
+        return round(load_score_log().score(template)) == int(query)
+    return query.lower() in template.name.lower()
+
+
+def templates_page(task: MedicalTask, templates: set[MedicalTemplate]) -> list[MedicalTemplate]:
+    search_col, size_col, page_col = st.columns((6, 2, 2))
+    query = search_col.text_input("Search", key=f"search_{task.name}", placeholder="Name or score (e.g., 'Persona' or '4')")
+    page_size = size_col.selectbox("Templates per page", options=TEMPLATE_PAGE_SIZES, key=f"page_size_{task.name}")
+
+    found = [t for t in sorted(templates) if template_matches(t, query)]
+    num_pages = max(1, math.ceil(len(found) / page_size))
+    page = page_col.number_input(f"Page (of {num_pages})", min_value=1, max_value=num_pages, value=1, step=1, key=f"page_{task.name}")
+
+    start = (min(page, num_pages) - 1) * page_size
+    shown = found[start:start + page_size]
+    st.caption(f"Showing {start + 1 if shown else 0}-{start + len(shown)} of {len(found)} templates")
+    return shown
+
+
 def streamlit_app():
 
     st.set_page_config(
@@ -185,6 +397,12 @@ def streamlit_app():
 
     st.title("[CREATING TASKS] Encapsulating the Prompt Engineering for Medical Users")
 
+    st.session_state[SCRIPT_RUNS_KEY] = st.session_state.get(SCRIPT_RUNS_KEY, 0) + 1
+
+    library_search()
+    session_memory_panel()
+    session_writes_panel()
+
     target_profile = st.selectbox(
         label="For whom your task is centered?", 
         options=list(PublicTarget)
@@ -216,18 +434,29 @@ def streamlit_app():
     with view_col:
         save_col, delete_col, _ = st.columns((1.5, 1, 7.5))
         if save_col.button("Save Task", type="primary"):
-            Loader.load_tasks_to_fs(target_profile, task)
-            st.success("Saved")
+            if (key := load_write_queue().save_task(target_profile, task)) is not None:
+                track_writes([key])
+                load_search_index().add_task(target_profile, task)
+                st.success("Saving...")
+            else:
+                st.info("No changes to save")
         if delete_col.button("Delete", type="secondary"):
-            try:
-                Loader.exclude_task(target_profile, task)
-            except FileNotFoundError:
+            if not load_write_queue().task_stored(target_profile, task): # a save still queued counts as saved
                 st.error("The task was not saved!")
                 return
+            track_writes([load_write_queue().exclude_task(target_profile, task)])
 
             participant.remove_task(task)
+            load_search_index().remove_task(target_profile, task)
             st.rerun()
 
+        budget = st.number_input(
+            "Token budget (0 for none)", key=f"budget_{task.id}", min_value=0, step=64,
+            value=task.token_budget or 0, help="Prompts of the task over it are not sent to the model"
+        )
+        if budget != (task.token_budget or 0):
+            task.change_budget(budget) # saved with the task
+
         st.json(task.to_json(), expanded=True)
 
     with edit_col:
@@ -262,12 +491,14 @@ def streamlit_app():
                     
                     task[prop] = new_value if new_value else task[prop]
                     task.to_mutable()
+                    record_schema_change(task, prop)
                     st.rerun()
 
             if st.button("Remove Property"):
                 assert prop in task
 
                 del task[prop]
+                record_schema_change(task, prop)
                 st.rerun()
 
             st.json(task.prop_to_json(prop))
@@ -277,32 +508,49 @@ def streamlit_app():
     #
 
     st.subheader("Templates")
-    template_file = st.file_uploader("Upload Template File", key=f"upload_{task.name}")
-    if template_file is not None:   # From submitted file
-        templates = load_templates_from_file(task, template_file)
-        if templates is None:
-            load_templates_from_file.clear()
-    else:                           # From FS loading
-        templates = load_templates_from_fs(target_profile, task)
-        if templates is None:
-            load_templates_from_fs.clear()
+    template_files = st.file_uploader("Upload Template Files", key=f"upload_{task.name}", accept_multiple_files=True)
+    if template_files:
+        template_uploads(target_profile, task, template_files)
+
+    templates = load_templates_from_fs(target_profile, task)
+    if templates is None:
+        load_templates_from_fs.clear()
     
     # There is no templates available, so nothing more to do here...
     if templates is None: return
     
     templates = settization(templates)
+    dependencies = load_template_dependencies(
+        task, 
+        source="fs",
+        template_ids=tuple(sorted(t.id for t in templates)),
+        _templates=templates
+    )
+    schema_impact(task, dependencies)
 
     save_col, delete_col, _ = st.columns((.5, .5, 9))
     if save_col.button("Save All", type="primary"):
-        Loader.load_templates_to_fs(target_profile, templates)
+        queue = load_write_queue()
+        queued = queue.save_templates(target_profile, templates) # only the changed ones
+        track_writes(list(queued))
+        for template in queued.values():
+            load_search_index().add_template(target_profile, template)
+        if queued:
+            st.success(f"Saving {len(queued)} of {len(templates)} templates...")
+        else:
+            st.info("No changes to save")
 
     if delete_col.button("Delete All", type="secondary"):
-        Loader.exclude_templates(target_profile, task)
+        track_writes([load_write_queue().exclude_templates(target_profile, task)])
+        load_search_index().remove_templates(target_profile, task)
         return
 
-    # Presents template one by one
-    for template in sorted(templates):
-        template_viewer(template)
+    reviewer = reviewer_name()
+    load_score_log().refresh() # only the reviews appended meanwhile
+
+    # Presents only the templates of the current page
+    for template in templates_page(task, templates):
+        template_viewer(template, dependencies, reviewer)
 
 
 
@@ -0,0 +1,43 @@
+#!../.venv/bin/python3
+import sys, time, argparse
+from pathlib import Path
+
+from resources import *
+
+def main():
+    parser = argparse.ArgumentParser(description="Move the prompt library between environments as a single bundle")
+    parser.add_argument("--storage", type=Path, default=None, help="Library root with tasks/ and templates/ (default: resources/storage)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Write tasks and templates into a .jsonl or .zip bundle")
+    export_parser.add_argument("bundle", type=Path)
+    export_parser.add_argument("--target", action="append", default=None, help="Public target to export (repeatable, default: all)")
+
+    import_parser = commands.add_parser("import", help="Apply a bundle to the library")
+    import_parser.add_argument("bundle", type=Path)
+    import_parser.add_argument("--overwrite", action="store_true", help="Replace tasks and template iterations that already exist")
+    import_parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    if args.storage is not None:
+        use_storage(args.storage)
+
+    start = time.perf_counter()
+    match args.command:
+        case "export":
+            targets = [PublicTarget[t.strip().upper().replace(" ", "_")] for t in args.target] if args.target else list(PublicTarget)
+            exported = Loader.export_bundle(args.bundle, targets)
+            print(f"Exported {exported} files to {args.bundle}", file=sys.stderr)
+        case "import":
+            counts = Loader.import_bundle(
+                args.bundle, 
+                overwrite=args.overwrite, 
+                batch_size=args.batch_size,
+                progress=lambda c: print(f"\r{c['read']} read | {c['written']} written | {c['duplicates']} duplicates", end="", file=sys.stderr)
+            )
+            print(file=sys.stderr)
+    print(f"Done in {time.perf_counter() - start:.2f} s", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
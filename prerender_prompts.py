@@ -0,0 +1,38 @@
+#!../.venv/bin/python3
+import sys, time, json, argparse
+from pathlib import Path
+
+from resources import *
+from resources.prerender import PRERENDER_DIR, PrerenderedPrompts
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-render the best template of every task with its default inputs")
+    parser.add_argument("--storage", type=Path, default=None, help="Library root with tasks/ and templates/ (default: resources/storage)")
+    parser.add_argument("--output", type=Path, default=PRERENDER_DIR, help=f"Artifacts folder (default: {PRERENDER_DIR})")
+    parser.add_argument("--format", choices=["json", "html"], action="append", default=None, help="Artifact format (repeatable, default: both)")
+    parser.add_argument("--grid", action="store_true", help="Also render every combination of list options")
+    parser.add_argument("--max-renders", type=int, default=64, help="Renders per task at most (with --grid)")
+    parser.add_argument("--target", action="append", default=None, help="Public target to render (repeatable)")
+    args = parser.parse_args()
+
+    if args.storage is not None:
+        use_storage(args.storage)
+    targets = [PublicTarget[t.strip().upper().replace(" ", "_")] for t in args.target] if args.target else list(PublicTarget)
+    formats = tuple(args.format) if args.format else ("json", "html") # json is what the app reads back
+
+    start = time.perf_counter()
+    prerendered, skipped = PrerenderedPrompts.build(args.output, targets, formats, args.grid, args.max_renders)
+    for reason in skipped:
+        print(f"[SKIPPED] {reason}", file=sys.stderr)
+
+    print(json.dumps({
+        "prompts": len(prerendered),
+        "skipped": len(skipped),
+        "generation": prerendered.generation,
+        "output": str(args.output),
+        "seconds": round(time.perf_counter() - start, 3)
+    }, indent=4))
+
+
+if __name__ == "__main__":
+    main()
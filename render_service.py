@@ -0,0 +1,208 @@
+#!../.venv/bin/python3
+import sys, json, argparse
+from threading import Lock
+from urllib.parse import unquote
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from resources import *
+
+####################################
+# Prompt rendering over local HTTP #
+####################################
+
+# GET  /targets                                      -> public targets
+# GET  /targets/<target>/tasks                       -> tasks of a target and their properties
+# GET  /targets/<target>/tasks/<task>/template       -> best template of a task
+# POST /targets/<target>/tasks/<task>/render         -> prompt built with the given { property: value }
+
+MAX_BODY_BYTES = 1 << 20
+
+
+class RenderService:
+
+    # Warm cache shared by every request thread (same loading as the Streamlit apps)
+
+    def __init__(self):
+        self._participants: dict[PublicTarget, MedicalEndUser] = {}
+        self._templates: dict[tuple[PublicTarget, str], Optional[set[MedicalTemplate]]] = {}
+        self._scores = ScoreLog()
+        self._lock = Lock()
+
+    def warm_up(self) -> None:
+        for target in PublicTarget:
+            for task in self.participant(target).tasks:
+                self.best_template(target, task)
+
+    def participant(self, target: PublicTarget) -> MedicalEndUser:
+        if (participant := self._participants.get(target)) is None:
+            with self._lock:
+                if (participant := self._participants.get(target)) is None:
+                    tasks = Loader.load_tasks_from_fs(target=target)
+                    participant = MedicalEndUser(type=target, tasks=settization(tasks) if tasks else set())
+                    self._participants[target] = participant
+        return participant
+
+    def best_template(self, target: PublicTarget, task: MedicalTask) -> Optional[MedicalTemplate]:
+        key = target, task.name
+        if key not in self._templates:
+            with self._lock:
+                if key not in self._templates:
+                    templates = Loader.load_templates_from_fs(target, task)
+                    self._templates[key] = None if templates is None else settization(templates)
+
+        if (templates := self._templates[key]) is None:
+            return None
+        self._scores.refresh() # only the reviews appended meanwhile
+        return max(templates, key=self._scores.rank) # (higher) score >> (last) iteration
+
+    def score(self, template: MedicalTemplate) -> float|int:
+        return self._scores.score(template)
+
+    def get_task(self, target: PublicTarget, task_name: str) -> MedicalTask:
+        if (task := self.participant(target).get_task(task_name)) is None:
+            print_message(f"Task '{task_name}' not found for {target}s", "error", KeyError)
+        return task
+
+    @staticmethod
+    def get_target(target_name: str) -> PublicTarget:
+        try:
+            return PublicTarget[target_name.strip().upper().replace(" ", "_")]
+        except KeyError:
+            print_message(f"Public target '{target_name}' not found", "error", KeyError)
+
+    @staticmethod
+    def typed_values(task: MedicalTask, values: dict[str, Any]) -> dict[str, Any]:
+        typed = {}
+        for prop, value in values.items():
+            if prop not in task:
+                print_message(f"Property '{prop}' not found for the task {task}", "error", LookupError)
+
+            prop_type = task.prop_type(prop)
+            if prop_type is list: # one of the options
+                if value not in task.prop_value(prop, default=True):
+                    print_message(f"'{value}' is not an option of the property '{prop}'", "error", ValueError)
+                typed[prop] = value
+                continue
+
+            typed[prop] = value if type(value) is prop_type else get_typed_value(value, prop_type)
+        return typed
+
+
+class RenderRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive connections
+    disable_nagle_algorithm = True # headers and body are written apart
+    service: RenderService = None
+    verbose: bool = False
+
+    def _send_json(self, status: HTTPStatus, data: Any) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: HTTPStatus, error: Exception|str) -> None:
+        self._send_json(status, { "error": str(error.args[0] if isinstance(error, Exception) and error.args else error) })
+
+    def _route(self) -> list[str]:
+        return [unquote(part) for part in self.path.split("?", 1)[0].strip("/").split("/") if part]
+
+    def _read_body(self) -> bytes: # before any lookup, so no reply leaves the body to be parsed as the next request
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if not 0 <= length <= MAX_BODY_BYTES:
+            self.close_connection = True # left unread
+            print_message("Request body too large" if length > 0 else "Invalid Content-Length", "error", ValueError)
+        return self.rfile.read(length)
+
+    @staticmethod
+    def _parse_json(body: bytes) -> dict:
+        data = json.loads(body or b"{}")
+        if not isinstance(data, dict):
+            print_message("Request body must be a JSON object of property values", "error", ValueError)
+        return data
+
+    def _template_json(self, target: PublicTarget, task: MedicalTask) -> dict:
+        if (template := self.service.best_template(target, task)) is None:
+            print_message(f"No available templates for the task {task}", "error", FileNotFoundError)
+        return { **template.to_json(), "variables": template.get_required_variables() }
+
+    def do_GET(self):
+        try:
+            match self._route():
+                case ["targets"]:
+                    self._send_json(HTTPStatus.OK, [{ "id": t.name, "name": str(t) } for t in PublicTarget])
+                case ["targets", target, "tasks"]:
+                    participant = self.service.participant(RenderService.get_target(target))
+                    self._send_json(HTTPStatus.OK, [task.to_json() for task in participant.tasks])
+                case ["targets", target, "tasks", task_name, "template"]:
+                    target = RenderService.get_target(target)
+                    task = self.service.get_task(target, task_name)
+                    self._send_json(HTTPStatus.OK, self._template_json(target, task))
+                case _:
+                    self._send_error(HTTPStatus.NOT_FOUND, f"Unknown resource '{self.path}'")
+        except (KeyError, FileNotFoundError) as e:
+            self._send_error(HTTPStatus.NOT_FOUND, e)
+
+    def do_POST(self):
+        try:
+            body = self._read_body()
+            match self._route():
+                case ["targets", target, "tasks", task_name, "render"]:
+                    target = RenderService.get_target(target)
+                    task = self.service.get_task(target, task_name)
+                    if (template := self.service.best_template(target, task)) is None:
+                        print_message(f"No available templates for the task {task}", "error", FileNotFoundError)
+
+                    values = RenderService.typed_values(task, self._parse_json(body))
+                    self._send_json(HTTPStatus.OK, {
+                        "task": task.name,
+                        "iteration": template.iteration,
+                        "name": template.name,
+                        "score": self.service.score(template),
+                        "prompt": template.build(**values)
+                    })
+                case _:
+                    self._send_error(HTTPStatus.NOT_FOUND, f"Unknown resource '{self.path}'")
+        except (KeyError, FileNotFoundError) as e:
+            self._send_error(HTTPStatus.NOT_FOUND, e)
+        except (LookupError, TypeError, ValueError) as e:
+            self._send_error(HTTPStatus.BAD_REQUEST, e)
+
+    def log_message(self, format: str, *args) -> None:
+        if self.verbose:
+            super().log_message(format, *args)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local HTTP API for rendering medical prompts")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--no-warm-up", action="store_true", help="Load tasks and templates on first request instead")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    RenderRequestHandler.service = RenderService()
+    RenderRequestHandler.verbose = args.verbose
+    if not args.no_warm_up:
+        RenderRequestHandler.service.warm_up()
+
+    server = ThreadingHTTPServer((args.host, args.port), RenderRequestHandler)
+    server.daemon_threads = True
+    print(f"Serving prompts on http://{args.host}:{args.port}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+from resources.cache import *
 from resources.domain import *
 from resources.storage import *
 from resources.utils import *
\ No newline at end of file
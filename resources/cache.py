@@ -0,0 +1,114 @@
+##################################
+# In-memory caches with eviction #
+##################################
+
+# - Least recently used entries are the first to leave
+# | The eviction callback lets the owner release whatever the entry holds
+# - Bounded by number of entries and, optionally, by their accounted size in bytes
+
+import sys
+from collections import OrderedDict
+from threading import RLock
+from typing import Any, Callable, Hashable, Iterator, Optional
+
+
+class LRUCache:
+
+    def __init__(self, 
+            capacity: int, 
+            on_evict: Optional[Callable[[Hashable, Any], None]]=None,
+            max_bytes: Optional[int]=None,
+            sizeof: Callable[[Any], int]=sys.getsizeof
+        ):
+        assert capacity > 0
+        self._capacity = capacity
+        self._on_evict = on_evict
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self._sizes: dict[Hashable, int] = {}
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._lock = RLock()
+
+    @property
+    def capacity(self) -> int:
+        return self._capacity
+
+    @property
+    def max_bytes(self) -> Optional[int]:
+        return self._max_bytes
+
+    @property
+    def nbytes(self) -> int:
+        return self._nbytes
+
+    @property
+    def hits(self) -> int:
+        return self._hits
+
+    @property
+    def misses(self) -> int:
+        return self._misses
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self),
+            "bytes": self._nbytes,
+            "hits": self._hits,
+            "misses": self._misses
+        }
+
+    def get(self, key: Hashable, default: Any=None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                self._misses += 1
+                return default
+            self._hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._nbytes -= self._sizes.get(key, 0)
+            self._sizes[key] = self._sizeof(value)
+            self._nbytes += self._sizes[key]
+
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._shrink()
+
+    def pop(self, key: Hashable, default: Any=None) -> Any:
+        with self._lock:
+            self._nbytes -= self._sizes.pop(key, 0)
+            return self._entries.pop(key, default)
+
+    def clear(self) -> None:
+        with self._lock:
+            while self._entries:
+                self._evict_oldest()
+
+    def _evict_oldest(self) -> None:
+        key, value = self._entries.popitem(last=False)
+        self._nbytes -= self._sizes.pop(key, 0)
+        if self._on_evict is not None:
+            self._on_evict(key, value)
+
+    def _exceeded(self) -> bool:
+        return len(self._entries) > self._capacity or \
+            self._max_bytes is not None and self._nbytes > self._max_bytes
+
+    def _shrink(self) -> None:
+        while self._entries and self._exceeded():
+            self._evict_oldest()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __iter__(self) -> Iterator[Hashable]: # from the least to the most recently used
+        with self._lock:
+            return iter(list(self._entries))
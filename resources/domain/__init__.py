@@ -1,3 +1,5 @@
 from resources.domain.target import MedicalEndUser, PublicTarget
 from resources.domain.task import MedicalTask, Property
+from resources.domain.vocabulary import Vocabulary
 from resources.domain.template import MedicalTemplate
+from resources.domain.dependency import TemplateDependencies
\ No newline at end of file
@@ -0,0 +1,71 @@
+############################################
+# Which templates rely on a task property? #
+############################################
+
+# - Each template is indexed by the variables of its compiled content
+# | A property change only concerns the templates using it (or those not using it, if required)
+# | Stored templates are indexed by the variables of their metadata, so opening a task fetches no body
+# - Validity is derived from the indexed variables, so no template body is read again
+
+from typing import Iterable
+
+from resources.domain.task import MedicalTask
+from resources.domain.template import MedicalTemplate
+
+
+class TemplateDependencies:
+
+    def __init__(self, task: MedicalTask, templates: Iterable[MedicalTemplate]=()):
+        self._task = task # the same reference the templates hold, so schema edits are seen
+        self._templates: dict[str, MedicalTemplate] = {}
+        self._variables: dict[str, frozenset[str]] = {} # template -> variables
+        self._dependents: dict[str, set[str]] = {} # variable -> templates
+
+        for template in templates:
+            self.track(template)
+
+    def track(self, template: MedicalTemplate) -> None: # (re)index its current content
+        self.untrack(template)
+
+        variables = template.variables
+        self._templates[template.id] = template
+        self._variables[template.id] = variables
+        for variable in variables:
+            self._dependents.setdefault(variable, set()).add(template.id)
+
+    def untrack(self, template: MedicalTemplate) -> None:
+        self._templates.pop(template.id, None)
+        for variable in self._variables.pop(template.id, ()):
+            self._dependents[variable].discard(template.id)
+            if not self._dependents[variable]:
+                del self._dependents[variable]
+
+    def dependents(self, prop: str) -> set[MedicalTemplate]:
+        return { self._templates[t] for t in self._dependents.get(prop, ()) }
+
+    def affected_by(self, props: Iterable[str]) -> set[MedicalTemplate]:
+        affected = set()
+        for prop in props:
+            if prop in self._task and self._task.is_required_property(prop):
+                # a required input breaks whoever does not use it
+                affected.update(t for t_id, t in self._templates.items() if t_id not in self._dependents.get(prop, ()))
+            affected.update(self.dependents(prop)) # an unknown variable breaks whoever uses it
+        return affected
+
+    def validate(self, templates: Iterable[MedicalTemplate]) -> dict[MedicalTemplate, tuple[set[str], set[str], set[str]]]:
+        # Same diagnosis as MedicalTemplate.check_variables: (missing required, ignored, unknown)
+        properties = set(self._task)
+        required_inputs = self._task.get_required_inputs()
+        diagnosis = {}
+        for template in templates:
+            variables = self._variables[template.id]
+            missing_variables = properties - variables
+            diagnosis[template] = (
+                missing_variables & required_inputs,
+                missing_variables - required_inputs,
+                variables - properties
+            )
+        return diagnosis
+
+    def __len__(self) -> int:
+        return len(self._templates)
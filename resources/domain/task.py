@@ -8,21 +8,47 @@
 # | However, the reached prompt might need more! (e.g., patient profile)
 # - Prompting aims to align the task definition to end user expectations
 
-import json
+import json, sys
 from collections.abc import MutableMapping
-from typing import Iterator, Optional, Type, Self
+from typing import Callable, Iterator, Optional, Type, Self
 
 from resources.domain.target import PublicTarget
+from resources.domain.vocabulary import Vocabulary
 from resources.utils import *
 
+def _date_from_json(value: str) -> datetime.date: # dd-mm-yyyy (DATE_FORMAT), without strptime
+    day, month, year = value.split("-")
+    return datetime.date(int(year), int(month), int(day))
+
+PROPERTY_FIELDS = { "name", "type", "required", "value" }
+
+# Type name -> (type, converter of its JSON value); compiled once per type, not per property
+_PROPERTY_CONVERTERS: dict[str, tuple[Type, Callable[[Any], Any]]] = {}
+
+def property_converter(type_name: str) -> tuple[Type, Callable[[Any], Any]]:
+    if (compiled := _PROPERTY_CONVERTERS.get(type_name)) is None:
+        prop_type = type_from_str(type_name)
+        if prop_type is list: # inline options or a side file
+            convert = Vocabulary.from_json
+        elif prop_type is datetime.date:
+            convert = _date_from_json
+        else:
+            convert = prop_type
+        compiled = _PROPERTY_CONVERTERS[type_name] = (prop_type, convert)
+    return compiled
+
+
 class Property:
+    __slots__ = ("_name", "_type", "_required", "_value", "_default_value", "_revision", "_saved_revision")
     
     def __init__(self, name: str, type: Type, required=False):
-        self._name = name
+        self._name = sys.intern(name)
         self._type = type
         self._required = required
         self._value = None
         self._default_value = None
+        self._revision = 0 # bumped on every effective change
+        self._saved_revision = None # never saved
 
     @property
     def info(self) -> tuple[str, Type]:
@@ -34,68 +60,96 @@ class Property:
     
     @property
     def value(self):
-        return self._value[0] if self._type is list else self._value
+        if self._type is list and self._value is None and self._default_value is not None:
+            return self._default_value.first() # until another option is selected
+        return self._value
     
     @property
-    def default_value(self):
+    def default_value(self): # the options (vocabulary) of a list
         return self._default_value
     
     def defined(self) -> bool:
-        return self._value is not None
+        return (self._default_value if self._type is list else self._value) is not None
+
+    @property
+    def dirty(self) -> bool:
+        return self._revision != self._saved_revision
+
+    def mark_clean(self) -> None:
+        self._saved_revision = self._revision
+
+    def _state(self) -> tuple:
+        return self._required, self._value, self._default_value
 
     def set_value(self, value, required: bool|None=None):
+        previous = self._state()
+        self._set_value(value, required)
+        if self._state() != previous:
+            self._revision += 1
+
+    def _set_value(self, value, required: bool|None=None):
         if required is not None:
             self._required = required
 
-        if type(value) != self._type:
-            if self._type is list:
-                self._value.remove(value)
-                self._value.insert(0, value)
-                return
+        if self._type is list:
+            self._set_option(value)
+            return
 
+        if type(value) != self._type:
             print_message(f"The type of the given value differs from the property type", "error", TypeError)
 
         self._value = value
 
         if self._default_value is not None:
             return
-        
-        if type(value) is list:
-            value = value.copy()
         self._default_value = value
+
+    def _set_option(self, value):
+        if isinstance(value, (list, Vocabulary)): # the options themselves
+            self._default_value = value if isinstance(value, Vocabulary) else Vocabulary(options=value)
+            self._value = None
+            return
+
+        if self._default_value is None or value not in self._default_value: # O(1), without reordering
+            print_message(f"'{value}' is not an option of the property '{self._name}'", "error", ValueError)
+        self._value = value
         
     def _value_repr(self) -> Any:
         if not self.defined():
             return "UNDEFINED"
         
+        if self._type is list:
+            return self._default_value.to_json()
+
         if type(self._value) is datetime.date:
             return self._value.strftime("%d-%m-%Y")
         
         return self._value
 
     def to_json(self) -> dict:
-        return {
+        json_dict = {
             "name": f"{self:can}",
             "value": self._value_repr(),
             "type": type_to_str(self._type),
             "required": self._required
         }
+        if self._type is list and self._value is not None:
+            json_dict["selected"] = self._value
+        return json_dict
     
     @classmethod
     def from_json(cls, json_dict: dict) -> 'Property':
-        assert all(attr in json_dict for attr in [
-            "name", 
-            "type",
-            "required",
-            "value"
-        ])
-
-        dummy = cls(
-            name=json_dict["name"],
-            type=type_from_str(json_dict["type"]),
-            required=json_dict["required"]
-        )
-        dummy.set_value(get_typed_value(json_dict["value"], dummy.info[1]))
+        assert json_dict.keys() >= PROPERTY_FIELDS
+
+        prop_type, convert = property_converter(json_dict["type"])
+        dummy = cls(name=json_dict["name"], type=prop_type, required=json_dict["required"])
+        # Already of its type once converted, so set as is (no type check nor revision per value)
+        if prop_type is list:
+            dummy._default_value = convert(json_dict["value"])
+            if json_dict.get("selected") is not None:
+                dummy._set_option(json_dict["selected"])
+        else:
+            dummy._value = dummy._default_value = convert(json_dict["value"]) # the stored value is the default one
         return dummy
     
     def __hash__(self) -> int:
@@ -122,7 +176,10 @@ class MedicalTask(MutableMapping):
         self._target = target
 
         self._req = False
-        self._properties: set[Property] = set()
+        self._properties: dict[str, Property] = {} # by name
+        self._revision = 0 # properties added/removed (their values are tracked by each one)
+        self._saved_revision = None
+        self._token_budget: Optional[int] = None # tokens its prompts may take up (None for no limit)
 
         if required_inputs is not None:
             self.to_mutable()
@@ -141,8 +198,29 @@ class MedicalTask(MutableMapping):
     def target(this) -> PublicTarget:
         return this._target
 
+    @property
+    def token_budget(this) -> Optional[int]:
+        return this._token_budget
+
+    def change_budget(self, new_budget: Optional[int]) -> None: # 0 (or None) for no limit
+        if new_budget is not None and new_budget < 0:
+            print_message(f"Token budget of the task {self} cannot be negative", "error", exception=ValueError)
+        new_budget = new_budget or None
+        if new_budget != self._token_budget:
+            self._revision += 1
+        self._token_budget = new_budget
+
     def _find_property(self, name: str) -> Optional[Property]:
-        return next((p for p in self._properties if p.info[0] == name), None) # why is python using 'next' for sets???
+        return self._properties.get(name)
+
+    @property
+    def dirty(self) -> bool:
+        return self._revision != self._saved_revision or any(p.dirty for p in self._properties.values())
+
+    def mark_clean(self) -> None:
+        self._saved_revision = self._revision
+        for prop in self._properties.values():
+            prop.mark_clean()
 
     def is_required_property(self, name: str) -> bool:
         if not (prop := self._find_property(name=name)): 
@@ -152,7 +230,7 @@ class MedicalTask(MutableMapping):
 
     
     def get_required_inputs(self) -> set[str]:
-        return set(p for p in dict(**self) if self.is_required_property(p))
+        return { name for name, p in self._properties.items() if p.required }
 
     def to_mutable(self): # required input
         self._req = True
@@ -171,20 +249,22 @@ class MedicalTask(MutableMapping):
             prop.set_value(value, required=self._req)
             return
 
-        new_prop = Property(name=key, type=type(value), required=self._req)
+        new_prop = Property(name=key, type=list if isinstance(value, Vocabulary) else type(value), required=self._req)
         new_prop.set_value(value)
-        self._properties.add(new_prop)
+        self._properties[new_prop.info[0]] = new_prop
+        self._revision += 1
 
     def __delitem__(self, key) -> None:
-        if not (prop := self._find_property(name=key), None):
+        if key not in self._properties:
             print_message(
                 msg=f"Property '{key}' cannot be deleted from the task {self} because it does not exist", 
                 type="error", exception=KeyError
             )
-        self._properties.remove(prop)
+        del self._properties[key]
+        self._revision += 1
 
     def __iter__(self) -> Iterator:
-        return iter({ p.info[0] : p.value for p in self._properties })
+        return iter(self._properties)
     
     def __len__(self) -> int:
         return len(self._properties)
@@ -199,7 +279,7 @@ class MedicalTask(MutableMapping):
         return type(other) is MedicalTask and self.name == other.name
 
     def __hash__(self) -> int:
-        return hash(self._name) + sum(hash(p) for p in self._properties)
+        return hash(self._name) + sum(hash(p) for p in self._properties.values())
 
     def prop_to_json(self, prop_name: str) -> dict:
         if not (prop := self._find_property(name=prop_name)): 
@@ -221,29 +301,38 @@ class MedicalTask(MutableMapping):
         return prop.to_json()["value"]
 
     def to_json(self) -> dict:
-        return {
+        json_data = {
             "name": self._name,
-            "properties": list(map(lambda p: p.to_json(), self._properties))                     
+            "properties": [p.to_json() for p in self._properties.values()]                     
         }
+        if self._token_budget is not None: # tasks without one are stored as before
+            json_data["token_budget"] = self._token_budget
+        return json_data
 
     def save(self, save_file: str):
         with open(f"{save_file}", 'w') as fp:
             json.dump(self.to_json(), fp, indent=4, sort_keys=False)
+        self.mark_clean()
     
     @classmethod
     def load(cls, target: PublicTarget, saved_file: str) -> 'MedicalTask':
         with open(f"{saved_file}", 'r') as fp:
             json_data: dict = json.load(fp)
+        task = cls.from_json(target, json_data)
+        task.mark_clean() # as stored
+        return task
+
+    @classmethod
+    def from_json(cls, target: PublicTarget, json_data: dict) -> 'MedicalTask':
         assert all(attr in json_data for attr in ["name", "properties"])
         
+        # One pass: each property is converted once and indexed as is
         dummy = cls(name=json_data["name"], target=target)
-        properties = list(Property.from_json(prop_data) for prop_data in json_data["properties"])
-        for prop in properties:
-            if prop.required:
-                dummy.to_mutable()
-            dummy[prop.info[0]] = prop.to_json()["value"]
-            dummy.to_detailed()
-            continue
+        for prop_data in json_data["properties"]:
+            prop = Property.from_json(prop_data)
+            dummy._properties[prop.info[0]] = prop
+        dummy._revision += len(dummy._properties)
+        dummy._token_budget = json_data.get("token_budget")
 
         return dummy
         
\ No newline at end of file
@@ -8,21 +8,37 @@
 # | Not all defined variables are required for a task! Some are details.
 # - Task can have multiple prompts assigned to (ones more detailed than others)
 
-import json
+import json, sys, hashlib, threading, weakref
+from functools import lru_cache
 from pathlib import Path
-from typing import Self
+from typing import Any, Callable, Self
 from langchain_core.prompts import PromptTemplate
+from langchain_core.prompts.string import get_template_variables
 
+from resources.cache import LRUCache
 from resources.domain.task import MedicalTask
+from resources.tokens import BudgetStatus, budget_status, prompt_tokens, template_variables
 from resources.utils import print_message
 
+MAX_LOADED_BODIES = 256 # template bodies kept in memory by lazy templates
+MAX_RENDERED_PROMPTS = 4096
+MAX_RENDERED_BYTES = 32 << 20
+
+# Same content, same compiled template (parsing is the costly part of a build)
+_compile_template = lru_cache(maxsize=1024)(PromptTemplate.from_template)
+
+def content_fingerprint(content: str) -> bytes:
+    return hashlib.blake2b(content.encode("utf-8"), digest_size=16).digest()
+
 class MedicalPrompt(str):
+    __slots__ = ("score", "name", "iteration")
+
     def __new__(cls, content: str, **_):
         return super(MedicalPrompt, cls).__new__(cls, content)
 
     def __init__(self, _, score: int, name: str, iteration: int):
         self.score = score
-        self.name = name
+        self.name = sys.intern(name) # the same few names repeat across iterations
         self.iteration = iteration
 
     def __repr__(self):
@@ -38,6 +54,10 @@ class MedicalPrompt(str):
 
 
 class MedicalTemplate:
+    __slots__ = ("_prompt", "_task", "_content", "_revision", "_saved_revision")
+
+    # Process-wide: (content fingerprint, task inputs) -> built prompt
+    _rendered_prompts = LRUCache(capacity=MAX_RENDERED_PROMPTS, max_bytes=MAX_RENDERED_BYTES)
 
     def __init__(self, 
             prompt: MedicalPrompt, 
@@ -48,7 +68,9 @@ class MedicalTemplate:
         self._prompt = prompt
         
         self._task = task # unchanged reference with required variables
-        self._content: str = str(prompt)
+        self._content: str|None = None # None while sharing the storage of the original prompt
+        self._revision = 0 # bumped on every effective change
+        self._saved_revision = None # never saved
 
         if to_validate:
             self._check_prompt_validity()
@@ -76,41 +98,106 @@ class MedicalTemplate:
     
     @property
     def content(this) -> str:
-        return this._content
+        return this._prompt if this._content is None else this._content
     
+    @property
+    def variables(this) -> frozenset[str]: # used by the content, even if it is not a valid template yet
+        return template_variables(this.content)
+
     def _get_prompt_template(self) -> PromptTemplate:
-        return PromptTemplate.from_template(self.content)
+        return _compile_template(self.content)
 
-    def _check_prompt_validity(self):
-        template = self._get_prompt_template()
-        missing_variables = set(self._task) - set(template.input_variables)
+    def check_variables(self) -> tuple[set[str], set[str], set[str]]: # (missing required, ignored, unknown)
+        variables = set(get_template_variables(self.content, "f-string")) # no need to compile it
+        missing_variables = set(self._task) - variables
         required_inputs = self._task.get_required_inputs()
         
+        return (
+            missing_variables & required_inputs,
+            missing_variables - required_inputs,
+            variables - set(self._task)
+        )
+
+    def _check_prompt_validity(self):
+        missing_required, ignored, _ = self.check_variables()
+        
         # Is prompt not aligned to the task? [ERROR]
-        if any(i in required_inputs for i in missing_variables):
+        if missing_required:
             print_message(
                 msg="Wrong prompt-task assign! Template missing required variables: " + \
-                    ", ".join(missing_variables.intersection(required_inputs)),
+                    ", ".join(missing_required),
                 type="error", exception=LookupError
             )
 
         # Which properties are ignored in my Prompt Engineering process? [WARNING]
-        if any(i not in required_inputs for i in missing_variables):
+        if ignored:
             print_message(
                 msg=f"Prompt Engineering ignores the variables: " + \
-                    ", ".join(missing_variables - required_inputs),
+                    ", ".join(ignored),
                 type="warning"
             )
 
+    @property
+    def dirty(self) -> bool:
+        return self._revision != self._saved_revision
+
+    def mark_clean(self) -> None:
+        self._saved_revision = self._revision
+
     def change_score(self, new_score: int) -> None:
+        if new_score != self._prompt.score:
+            self._revision += 1
         self._prompt.score = new_score
 
+    def _set_content(self, new_template: str|None) -> None:
+        self._content = new_template if new_template and new_template != self._prompt else None
+
     def change_template(self, new_template: str|None=None, to_validate: bool=True) -> None:
-        self._content = new_template if new_template else str(self._prompt)
+        previous = self.content
+        self._set_content(new_template)
+        if self.content != previous:
+            self._revision += 1
         if to_validate:
             self._check_prompt_validity()
 
-    def build(self) -> str:
+    def build(self, **values) -> str: # values override the task ones for this build only
+        # Are there given values that the task does not define? [ERROR]
+        if any(v not in self._task for v in values):
+            print_message(
+                msg=f"Cannot build prompt with variables unknown to the task: " + \
+                    ", ".join(set(values) - set(self._task)),
+                type="error", exception=LookupError
+            )
+
+        inputs = { **self._task, **values }
+        required_inputs = self._task.get_required_inputs()
+        render_key = (
+            content_fingerprint(self.content),
+            tuple(sorted((name, name in required_inputs, repr(value)) for name, value in inputs.items()))
+        )
+        if (prompt := MedicalTemplate._rendered_prompts.get(render_key)) is not None:
+            return prompt
+
+        prompt = self._build(inputs)
+        MedicalTemplate._rendered_prompts.put(render_key, prompt)
+        return prompt
+
+    @property
+    def token_budget(this) -> int|None:
+        return this._task.token_budget
+
+    def count_tokens(self, **values) -> int: # (estimated) of what build() returns, without building it
+        return prompt_tokens(self.content, { **self._task, **values })
+
+    def token_budget_status(self, **values) -> tuple[int, BudgetStatus]:
+        tokens = self.count_tokens(**values)
+        return tokens, budget_status(tokens, self.token_budget)
+
+    @staticmethod
+    def render_cache_stats() -> dict[str, int]:
+        return MedicalTemplate._rendered_prompts.stats()
+
+    def _build(self, inputs: dict[str, Any]) -> str:
         self._check_prompt_validity()
 
         template = self._get_prompt_template()
@@ -123,10 +210,10 @@ class MedicalTemplate:
                 type="error", exception=LookupError
             )
 
-        return template.format(**self._task)
+        return template.format(**inputs)
     
     def get_required_variables(self) -> list[str]:
-        return self._get_prompt_template().input_variables
+        return list(self._get_prompt_template().input_variables) # the compiled template is shared
 
     def __eq__(self, other: Self) -> bool:
         return self.id == other.id
@@ -135,10 +222,10 @@ class MedicalTemplate:
         return self.iteration < other.iteration
 
     def __hash__(self) -> int:
-        return hash(str(self))
+        return hash(self.id) # aligned to __eq__ and stable while editing
 
     def __str__(self) -> str:
-        return self.content
+        return str(self.content)
 
     def __repr__(self) -> str:
         return str(self)
@@ -156,11 +243,18 @@ class MedicalTemplate:
     def save(self, save_file: Path):
         with save_file.open('w') as fp:
             json.dump(self.to_json(), fp, indent=4, sort_keys=False)
+        self.mark_clean()
 
     @classmethod
     def load(cls, task: MedicalTask, saved_file: Path) -> 'MedicalTemplate':
         with saved_file.open('r') as fp:
             json_data: dict = json.load(fp)
+        template = cls.from_json(task, json_data)
+        template.mark_clean() # as stored
+        return template
+
+    @classmethod
+    def from_json(cls, task: MedicalTask, json_data: dict) -> 'MedicalTemplate':
         assert all(attr in json_data for attr in ["task", "iteration", "name", "score", "prompt"])
         
         assert json_data["task"] == task.name
@@ -176,6 +270,115 @@ class MedicalTemplate:
             to_validate=False
         )
 
-        dummy.change_template(json_data.get("template", None), to_validate=False)
+        dummy._set_content(json_data.get("template", None))
 
         return dummy
+
+
+class LazyMedicalTemplate(MedicalTemplate):
+    __slots__ = ("_name", "_iteration", "_score", "_variables", "_fetch", "_edited", "__weakref__")
+
+    # Bodies not touched recently are dropped (unless edited) and fetched again when needed
+    _loaded_bodies = LRUCache(
+        capacity=MAX_LOADED_BODIES,
+        on_evict=lambda _, ref: (template := ref()) is not None and template._evict()
+    )
+    # Templates are shared by the sessions, so a body is read and evicted under it (taken before the LRU lock)
+    _bodies_lock = threading.RLock()
+
+    def __init__(self, 
+            metadata: dict, 
+            task: MedicalTask, 
+            fetch: Callable[[], dict]
+        ):
+        assert all(attr in metadata for attr in ["task", "iteration", "name", "score"])
+        assert metadata["task"] == task.name
+
+        self._prompt = None
+        self._task = task
+        self._content = None
+        self._revision = 0
+        self._saved_revision = 0 # handles are made from what is stored
+
+        self._name = sys.intern(metadata["name"])
+        self._iteration = metadata["iteration"]
+        self._score = metadata["score"]
+        self._variables = frozenset(metadata["variables"]) if "variables" in metadata else None # of the stored content
+        self._fetch = fetch # json data of the whole template
+        self._edited = False
+
+    @property
+    def name(this) -> str:
+        return this._name
+    
+    @property
+    def iteration(this) -> int:
+        return this._iteration
+    
+    @property
+    def score(this) -> int:
+        return this._score
+
+    @property
+    def variables(this) -> frozenset[str]: # without fetching the body, unless indexed before variables were
+        if this._variables is not None and not this._edited:
+            return this._variables
+        return super().variables
+
+    @property
+    def loaded(this) -> bool:
+        return this._prompt is not None
+
+    @property
+    def content(this) -> str:
+        prompt, content = this._load()
+        return prompt if content is None else content
+
+    def _load(self) -> tuple[MedicalPrompt, str|None]: # (prompt, edited content) as loaded, even if evicted right after
+        with LazyMedicalTemplate._bodies_lock:
+            LazyMedicalTemplate._loaded_bodies.put(id(self), weakref.ref(self))
+            if self.loaded:
+                return self._prompt, self._content
+
+        json_data = self._fetch() # read without holding the other sessions back
+        with LazyMedicalTemplate._bodies_lock:
+            if not self.loaded: # or by another session meanwhile
+                self._prompt = MedicalPrompt(
+                    json_data["prompt"],
+                    score=self._score, # may have been changed meanwhile
+                    name=self._name,
+                    iteration=self._iteration
+                )
+                self._set_content(json_data.get("template", None))
+            return self._prompt, self._content
+
+    def _evict(self) -> None:
+        with LazyMedicalTemplate._bodies_lock:
+            if self._edited: # there is nothing to fetch the changes back from
+                return
+            self._prompt = None
+            self._content = None
+
+    def change_score(self, new_score: int) -> None:
+        if new_score != self._score:
+            self._revision += 1
+        self._score = new_score
+        if (prompt := self._prompt) is not None: # loaded
+            prompt.score = new_score
+
+    def change_template(self, new_template: str|None=None, to_validate: bool=True) -> None:
+        with LazyMedicalTemplate._bodies_lock: # never evicted once edited
+            self._load()
+            self._edited = True
+        super().change_template(new_template, to_validate)
+
+    def to_json(self) -> dict:
+        prompt, content = self._load()
+        return {
+            "task": self.task,
+            "iteration": self.iteration,
+            "name": self.name,
+            "score": self.score,
+            "prompt": prompt,
+            "template": prompt if content is None else content
+        }
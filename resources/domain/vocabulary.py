@@ -0,0 +1,132 @@
+###########################################
+# Which options can a list property take? #
+###########################################
+
+# - Options are kept apart from the selected one, so selecting never reorders (nor copies) them
+# | Membership is a dict lookup and prefix search a bisection over the sorted options
+# - Large vocabularies (e.g., drugs, conditions) live in a side file, one option per line
+# | They are only read when their options are needed, not when the task is loaded
+
+import bisect
+from pathlib import Path
+from typing import Iterable, Iterator, Optional
+
+from resources.utils import print_message
+
+
+class Vocabulary:
+    __slots__ = ("_name", "_options", "_positions", "_keys", "_first")
+
+    root: Optional[Path] = None # side files folder, set by the storage in use
+
+    def __init__(self, options: Optional[Iterable[str]]=None, name: Optional[str]=None):
+        assert (options is None) != (name is None), "A vocabulary is either inline or from a side file"
+
+        if name is not None:
+            Vocabulary.check_name(name)
+        self._name = name
+        self._options: Optional[tuple[str, ...]] = None
+        self._positions: Optional[dict[str, int]] = None
+        self._keys: Optional[list[tuple[str, int]]] = None # (folded option, position), sorted on first search
+        self._first: Optional[str] = None
+        if options is not None:
+            self._index(options)
+
+    @staticmethod
+    def check_name(name: str) -> None: # a file right in the side files folder, never a path out of it
+        if not name or Path(name).name != name or name.startswith("."):
+            print_message(f"'{name}' is not a valid vocabulary name (a plain file name)", "error", ValueError)
+
+    @property
+    def name(self) -> Optional[str]:
+        return self._name
+
+    @property
+    def loaded(self) -> bool:
+        return self._options is not None
+
+    def _path(self) -> Path:
+        if Vocabulary.root is None:
+            print_message(f"Cannot read the vocabulary '{self._name}' without a storage", "error", FileNotFoundError)
+        return Vocabulary.root.joinpath(self._name)
+
+    def _index(self, options: Iterable[str]) -> None:
+        positions: dict[str, int] = {}
+        for option in options:
+            positions.setdefault(option, len(positions)) # first occurrence wins
+        self._options = tuple(positions)
+        self._positions = positions
+
+    def _load(self) -> None:
+        if self.loaded:
+            return
+        with self._path().open(encoding="utf-8") as fp:
+            self._index(line for line in map(str.strip, fp) if line)
+
+    def first(self) -> Optional[str]: # without reading the whole side file
+        if self.loaded:
+            return self._options[0] if self._options else None
+        if self._first is None:
+            with self._path().open(encoding="utf-8") as fp:
+                self._first = next((line for line in map(str.strip, fp) if line), None)
+        return self._first
+
+    def index(self, option: str) -> int:
+        self._load()
+        if (position := self._positions.get(option)) is None:
+            print_message(f"'{option}' is not an option of the vocabulary", "error", ValueError)
+        return position
+
+    def search(self, prefix: str, limit: int=50) -> list[str]: # case-insensitive, alphabetically
+        self._load()
+        if self._keys is None:
+            self._keys = sorted((option.casefold(), i) for i, option in enumerate(self._options))
+
+        prefix = prefix.strip().casefold()
+        found = []
+        for key, position in self._keys[bisect.bisect_left(self._keys, (prefix, -1)):]:
+            if not key.startswith(prefix) or len(found) >= limit:
+                break
+            found.append(self._options[position])
+        return found
+
+    def __contains__(self, option: str) -> bool:
+        self._load()
+        return option in self._positions
+
+    def __getitem__(self, position: int) -> str:
+        self._load()
+        return self._options[position]
+
+    def __iter__(self) -> Iterator[str]:
+        self._load()
+        return iter(self._options)
+
+    def __len__(self) -> int:
+        self._load()
+        return len(self._options)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, Vocabulary):
+            return NotImplemented
+        if self is other:
+            return True
+        if self._name is not None or other._name is not None:
+            return self._name == other._name
+        return self._options == other._options
+
+    def __hash__(self) -> int:
+        return hash(self._name) if self._name is not None else hash(self._options)
+
+    def __repr__(self) -> str:
+        return f"Vocabulary: {self._name or f'{len(self)} inline options'}"
+
+    def to_json(self) -> list[str]|dict[str, str]:
+        return { "vocabulary": self._name } if self._name is not None else list(self._options)
+
+    @classmethod
+    def from_json(cls, json_value: list[str]|dict[str, str]) -> 'Vocabulary':
+        if isinstance(json_value, dict):
+            assert "vocabulary" in json_value
+            return cls(name=json_value["vocabulary"])
+        return cls(options=json_value)
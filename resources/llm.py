@@ -0,0 +1,218 @@
+###############################################
+# Sending prompts to an OpenAI-compatible LLM #
+###############################################
+
+# - Connections are kept alive and reused by every session of the process (a small pool)
+# | At most max_concurrency requests at once per process, the others wait up to the timeout for a slot
+# - Responses are streamed (server-sent events), so tokens are shown as they arrive
+
+import os, json, queue, threading, time
+from collections import deque
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from typing import Iterator, NamedTuple, Optional
+from urllib.parse import urlparse
+
+from resources.utils import print_message
+
+LLM_ENV_PREFIX = "MEDICAL_LLM_" # e.g., MEDICAL_LLM_BASE_URL=http://127.0.0.1:8503/v1
+
+
+class LLMConfig(NamedTuple):
+    base_url: str
+    model: str = "gpt-3.5-turbo"
+    api_key: Optional[str] = None
+    timeout: float = 60. # seconds to connect, to wait for a slot and between streamed tokens
+    max_concurrency: int = 8 # requests in flight per process
+
+    @classmethod
+    def from_env(cls) -> Optional['LLMConfig']: # None while no endpoint is configured
+        if not (base_url := os.environ.get(f"{LLM_ENV_PREFIX}BASE_URL")):
+            return None
+        return cls(
+            base_url=base_url.rstrip("/"),
+            model=os.environ.get(f"{LLM_ENV_PREFIX}MODEL", cls._field_defaults["model"]),
+            api_key=os.environ.get(f"{LLM_ENV_PREFIX}API_KEY"),
+            timeout=float(os.environ.get(f"{LLM_ENV_PREFIX}TIMEOUT", cls._field_defaults["timeout"])),
+            max_concurrency=int(os.environ.get(f"{LLM_ENV_PREFIX}MAX_CONCURRENCY", cls._field_defaults["max_concurrency"]))
+        )
+
+
+class FairSlots:
+
+    # A semaphore whose released slots go to the longest waiting session (no barging by the releasing thread)
+
+    def __init__(self, size: int):
+        self._free = size
+        self._waiters: deque[threading.Lock] = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: Optional[float]=None) -> bool:
+        with self._lock:
+            if self._free and not self._waiters:
+                self._free -= 1
+                return True
+            waiter = threading.Lock()
+            waiter.acquire()
+            self._waiters.append(waiter)
+
+        if waiter.acquire(timeout=-1 if timeout is None else timeout):
+            return True
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+                return False
+            except ValueError: # handed over right after timing out
+                return True
+
+    def release(self) -> None:
+        with self._lock:
+            if self._waiters:
+                self._waiters.popleft().release()
+            else:
+                self._free += 1
+
+
+class LLMClient:
+
+    def __init__(self, config: LLMConfig):
+        url = urlparse(config.base_url)
+        self._config = config
+        self._connection_type = HTTPSConnection if url.scheme == "https" else HTTPConnection
+        self._host, self._port = url.hostname, url.port
+        self._path = f"{url.path.rstrip('/')}/chat/completions"
+
+        self._idle: queue.LifoQueue[HTTPConnection] = queue.LifoQueue() # most recently used first (still open)
+        self._slots = FairSlots(config.max_concurrency)
+        self._lock = threading.Lock()
+        self._stats = { "requests": 0, "failures": 0, "connections": 0, "tokens": 0 }
+
+    @property
+    def config(self) -> LLMConfig:
+        return self._config
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return { **self._stats, "idle": self._idle.qsize() }
+
+    def _count(self, **counts: int) -> None:
+        with self._lock:
+            for key, count in counts.items():
+                self._stats[key] += count
+
+    # CONNECTIONS ------------------------------------------------------------------------------------------------ #
+
+    def _acquire(self) -> tuple[HTTPConnection, bool]: # (connection, reused?)
+        try:
+            return self._idle.get_nowait(), True
+        except queue.Empty:
+            self._count(connections=1)
+            return self._connection_type(self._host, self._port, timeout=self._config.timeout), False
+
+    def _release(self, conn: HTTPConnection, response) -> None:
+        if response.will_close:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+    # REQUESTS --------------------------------------------------------------------------------------------------- #
+
+    def _request(self, prompt: str):
+        body = json.dumps({
+            "model": self._config.model,
+            "messages": [{ "role": "user", "content": prompt }],
+            "stream": True
+        }).encode("utf-8")
+        headers = { "Content-Type": "application/json", "Accept": "text/event-stream" }
+        if self._config.api_key:
+            headers["Authorization"] = f"Bearer {self._config.api_key}"
+
+        while True:
+            conn, reused = self._acquire()
+            try:
+                conn.request("POST", self._path, body=body, headers=headers)
+                return conn, conn.getresponse()
+            except (HTTPException, OSError) as e: # e.g., refused, reset or an unknown host
+                conn.close()
+                if not reused: # an idle connection may have been closed by the server meanwhile
+                    print_message(f"LLM endpoint unreachable: {e}", "error", ConnectionError)
+            except Exception:
+                conn.close()
+                raise
+
+    @staticmethod
+    def _event_delta(data: bytes) -> Optional[str]: # content of a streamed event, malformed ones fail the answer
+        try:
+            event = json.loads(data)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            print_message(f"LLM endpoint sent a malformed event: {data[:200]!r}", "error", ConnectionError)
+        if isinstance(event, dict) and "error" in event:
+            print_message(f"LLM endpoint failed while answering: {event['error']}", "error", ConnectionError)
+        try:
+            return event["choices"][0].get("delta", {}).get("content")
+        except (KeyError, IndexError, TypeError, AttributeError):
+            print_message(f"LLM endpoint sent an event without choices: {data[:200]!r}", "error", ConnectionError)
+
+    def stream_chat(self, prompt: str) -> Iterator[str]:
+        if not self._slots.acquire(timeout=self._config.timeout):
+            print_message(f"Too many LLM requests in progress ({self._config.max_concurrency})", "error", TimeoutError)
+
+        self._count(requests=1)
+        conn = response = None
+        try:
+            conn, response = self._request(prompt)
+            if response.status != 200:
+                detail = response.read().decode("utf-8", "replace")[:500]
+                self._release(conn, response)
+                conn = None
+                print_message(f"LLM endpoint answered {response.status}: {detail}", "error", ConnectionError)
+
+            for line in response: # data: {...} per event, data: [DONE] at the end
+                if not line.startswith(b"data:"):
+                    continue
+                data = line[5:].strip()
+                if data == b"[DONE]":
+                    break
+                if (delta := self._event_delta(data)):
+                    self._count(tokens=1)
+                    yield delta
+            else: # closed before [DONE], so the answer is cut short (and never cached)
+                print_message("LLM stream ended before the answer was complete", "error", ConnectionError)
+
+            response.read() # drained, so the connection can be reused
+            self._release(conn, response)
+            conn = None
+        except GeneratorExit:
+            raise
+        except (ConnectionError, TimeoutError):
+            self._count(failures=1)
+            raise
+        except (HTTPException, OSError) as e: # e.g., the stream cut short (IncompleteRead)
+            self._count(failures=1)
+            print_message(f"LLM stream interrupted: {e!r}", "error", ConnectionError)
+        except BaseException:
+            self._count(failures=1)
+            raise
+        finally:
+            if conn is not None: # interrupted (e.g., the session stopped reading)
+                conn.close()
+            self._slots.release()
+
+    def complete(self, prompt: str) -> str:
+        return "".join(self.stream_chat(prompt))
+
+    def timed_complete(self, prompt: str) -> tuple[str, float, float]: # (response, first token, total) seconds
+        start = time.perf_counter()
+        first, tokens = None, []
+        for token in self.stream_chat(prompt):
+            if first is None:
+                first = time.perf_counter() - start
+            tokens.append(token)
+        total = time.perf_counter() - start
+        return "".join(tokens), total if first is None else first, total
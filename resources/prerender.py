@@ -0,0 +1,144 @@
+#############################################
+# Prompts rendered ahead of any visit (CDN) #
+#############################################
+
+# - The best template of every task is built with its default inputs (and optionally their list options)
+# | Each prompt becomes a static JSON/HTML file named after its content hash, so it can be cached forever
+# - A manifest maps (target, task, template, inputs) to the files, for the library generation it was built from
+# | A visit whose inputs match one of them is served the file, instead of building the prompt again
+
+import html, json, hashlib, itertools, datetime
+from pathlib import Path
+from typing import Any, Iterator, Literal, Optional
+
+from resources.domain.target import PublicTarget
+from resources.domain.task import MedicalTask
+from resources.domain.template import MedicalTemplate
+from resources.storage.load import Loader, library_generation
+from resources.storage.scores import ScoreLog
+from resources.utils import DATE_FORMAT, related_to_project_path, settization
+
+PRERENDER_DIR = related_to_project_path(__file__, ["static", "prompts"])
+MANIFEST_FILE = "manifest.json"
+
+ArtifactFormat = Literal["json", "html"]
+
+
+def _json_value(value: Any) -> Any:
+    return value.strftime(DATE_FORMAT) if isinstance(value, datetime.date) else value
+
+def inputs_key(inputs: dict[str, Any]) -> str: # same inputs, same key (whatever their order)
+    return json.dumps(sorted((name, _json_value(value)) for name, value in inputs.items()))
+
+def template_key(target: PublicTarget, task: MedicalTask) -> str:
+    return f"{target.name}/{task.name}"
+
+
+def default_inputs(task: MedicalTask, variables: list[str], grid: bool=False, max_renders: int=64) -> Iterator[dict[str, Any]]:
+    # The default value of every variable, or every combination of list options (up to max_renders)
+    choices = []
+    for variable in variables:
+        default = task.prop_value(variable, default=True)
+        if task.prop_type(variable) is list:
+            choices.append(list(itertools.islice(default, max_renders)) if grid else [default.first()])
+        else:
+            choices.append([default])
+    for values in itertools.islice(itertools.product(*choices), max_renders):
+        yield dict(zip(variables, values))
+
+
+class PrerenderedPrompts:
+
+    def __init__(self, root: Path=PRERENDER_DIR, manifest: Optional[dict]=None):
+        self._root = Path(root)
+        self._manifest = manifest if manifest is not None else { "generation": None, "templates": {} }
+
+    @property
+    def generation(self) -> Optional[int]:
+        return self._manifest["generation"]
+
+    def __len__(self) -> int:
+        return sum(len(entry["renders"]) for entry in self._manifest["templates"].values())
+
+    # BUILD ------------------------------------------------------------------------------------------------------ #
+
+    @classmethod
+    def build(cls,
+            root: Path=PRERENDER_DIR,
+            targets: list[PublicTarget]=list(PublicTarget),
+            formats: tuple[ArtifactFormat, ...]=("json", "html"),
+            grid: bool=False,
+            max_renders: int=64
+        ) -> tuple['PrerenderedPrompts', list[str]]:
+
+        prerendered = cls(root, { "generation": library_generation(), "templates": {} })
+        prerendered._root.mkdir(parents=True, exist_ok=True)
+        scores = ScoreLog()
+        scores.refresh()
+        skipped = []
+
+        for target in targets:
+            for task in settization(Loader.load_tasks_from_fs(target) or set()):
+                if (templates := Loader.load_templates_from_fs(target, task)) is None:
+                    continue
+                template = max(settization(templates), key=scores.rank) # as chosen by the app
+                try:
+                    prerendered._render_template(target, task, template, formats, grid, max_renders)
+                except (LookupError, TypeError, ValueError) as e: # not buildable with its defaults
+                    skipped.append(f"{template_key(target, task)}: {e}")
+
+        with prerendered._root.joinpath(MANIFEST_FILE).open("w") as fp:
+            json.dump(prerendered._manifest, fp, indent=4)
+        return prerendered, skipped
+
+    def _render_template(self, target: PublicTarget, task: MedicalTask, template: MedicalTemplate,
+                         formats: tuple[ArtifactFormat, ...], grid: bool, max_renders: int) -> None:
+        variables = sorted(v for v in template.get_required_variables() if v in task)
+        entry = { "iteration": template.iteration, "name": template.name, "renders": {} }
+        for inputs in default_inputs(task, variables, grid, max_renders):
+            prompt = template.build(**inputs)
+            digest = hashlib.blake2b(prompt.encode("utf-8"), digest_size=16).hexdigest()
+            artifact = {
+                "target": target.name, "task": task.name, "iteration": template.iteration, "name": template.name,
+                "inputs": { name: _json_value(value) for name, value in inputs.items() }, "prompt": prompt, "hash": digest
+            }
+            for fmt in formats:
+                self._root.joinpath(f"{digest}.{fmt}").write_text(
+                    json.dumps(artifact, indent=4) if fmt == "json" else _artifact_html(artifact), encoding="utf-8"
+                )
+            entry["renders"][inputs_key(inputs)] = digest
+        self._manifest["templates"][template_key(target, task)] = entry
+
+    # SERVE ------------------------------------------------------------------------------------------------------ #
+
+    @classmethod
+    def open(cls, root: Path=PRERENDER_DIR) -> Optional['PrerenderedPrompts']:
+        try:
+            with Path(root).joinpath(MANIFEST_FILE).open() as fp:
+                return cls(root, json.load(fp))
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def lookup(self, target: PublicTarget, task: MedicalTask, template: MedicalTemplate) -> Optional[str]:
+        # The pre-rendered prompt for the current inputs of the task, if any (and still the chosen template)
+        if (entry := self._manifest["templates"].get(template_key(target, task))) is None:
+            return None
+        if entry["iteration"] != template.iteration:
+            return None
+
+        variables = sorted(v for v in template.get_required_variables() if v in task)
+        if (digest := entry["renders"].get(inputs_key({ v: task[v] for v in variables }))) is None:
+            return None
+        try:
+            with self._root.joinpath(f"{digest}.json").open() as fp:
+                return json.load(fp)["prompt"]
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+def _artifact_html(artifact: dict) -> str:
+    return (
+        "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+        f"<title>{html.escape(artifact['task'])} - {html.escape(artifact['name'])}</title></head>\n"
+        f"<body><pre>{html.escape(artifact['prompt'])}</pre></body></html>\n"
+    )
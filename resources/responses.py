@@ -0,0 +1,167 @@
+#################################################
+# Answers already given to the very same prompt #
+#################################################
+
+# - Keyed by the model configuration and the fingerprint of the built prompt
+# | Recent answers in memory (LRU, bounded in bytes), every answer on disk (SQLite), both expiring after a TTL
+# - Answers are kept as their streamed chunks, so a hit is replayed as a stream as well
+# | Only complete answers are cached, an interrupted stream leaves nothing behind
+
+import os, json, sqlite3, threading, time, hashlib
+from pathlib import Path
+from typing import Iterator, NamedTuple, Optional
+
+from resources.cache import LRUCache
+from resources.domain.template import content_fingerprint
+from resources.llm import LLMClient, LLMConfig, LLM_ENV_PREFIX
+from resources.storage.load import storage_root
+
+RESPONSES_FILE = "responses.sqlite"
+PRUNE_EVERY = 64 # disk writes between expiry/size pruning
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY, chunks TEXT NOT NULL, latency REAL NOT NULL,
+    created REAL NOT NULL, used REAL NOT NULL, size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS responses_used ON responses (used);
+"""
+
+
+class CachedResponse(NamedTuple):
+    chunks: tuple[str, ...]
+    latency: float # seconds the model took to answer
+    created: float
+
+
+def response_key(config: LLMConfig, prompt: str) -> str:
+    model = json.dumps([config.base_url, config.model]).encode("utf-8")
+    return hashlib.blake2b(model + content_fingerprint(prompt), digest_size=16).hexdigest()
+
+
+class ResponseCache:
+
+    def __init__(self,
+            path: Optional[Path]=None,
+            ttl: float=24 * 3600.,
+            capacity: int=256,
+            max_bytes: int=16 << 20,
+            max_disk_bytes: int=256 << 20
+        ):
+        self._path = Path(path) if path is not None else None # memory only without it
+        self._ttl = ttl
+        self._max_disk_bytes = max_disk_bytes
+        self._memory = LRUCache(capacity=capacity, max_bytes=max_bytes, sizeof=lambda r: sum(map(len, r.chunks)))
+        self._local = threading.local() # sqlite connections are not shared between threads
+        self._lock = threading.Lock()
+        self._stats = { "memory_hits": 0, "disk_hits": 0, "misses": 0, "saved_seconds": 0., "writes": 0 }
+
+    @classmethod
+    def from_env(cls) -> 'ResponseCache':
+        path = os.environ.get(f"{LLM_ENV_PREFIX}CACHE_PATH", str(storage_root().joinpath(RESPONSES_FILE)))
+        return cls(
+            path=Path(path) if path else None, # empty to keep answers in memory only
+            ttl=float(os.environ.get(f"{LLM_ENV_PREFIX}CACHE_TTL", 24 * 3600))
+        )
+
+    def stats(self) -> dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_ratio"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.
+        stats["memory_entries"] = len(self._memory)
+        return stats
+
+    def _count(self, key: str, increment: float=1) -> None:
+        with self._lock:
+            self._stats[key] += increment
+
+    # DISK ------------------------------------------------------------------------------------------------------- #
+
+    def _connection(self) -> sqlite3.Connection:
+        if (conn := getattr(self._local, "conn", None)) is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=30, isolation_level=None)
+            if conn.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+                conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _disk_get(self, key: str) -> Optional[CachedResponse]:
+        conn = self._connection()
+        row = conn.execute("SELECT chunks, latency, created FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        response = CachedResponse(tuple(json.loads(row[0])), row[1], row[2])
+        if self._expired(response):
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+        conn.execute("UPDATE responses SET used = ? WHERE key = ?", (time.time(), key))
+        return response
+
+    def _disk_put(self, key: str, response: CachedResponse) -> None:
+        conn = self._connection()
+        chunks = json.dumps(response.chunks)
+        conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)",
+            (key, chunks, response.latency, response.created, response.created, len(chunks))
+        )
+        self._count("writes")
+        if self._stats["writes"] % PRUNE_EVERY == 0:
+            self.prune()
+
+    def prune(self) -> None: # expired answers, then the least recently used ones beyond the size budget
+        if self._path is None:
+            return
+        conn = self._connection()
+        conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self._ttl,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self._max_disk_bytes:
+            return
+        excess, evicted = total - self._max_disk_bytes, []
+        for key, size in conn.execute("SELECT key, size FROM responses ORDER BY used"):
+            if excess <= 0:
+                break
+            evicted.append((key,))
+            excess -= size
+        conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    # LOOKUPS ---------------------------------------------------------------------------------------------------- #
+
+    def _expired(self, response: CachedResponse) -> bool:
+        return time.time() - response.created > self._ttl
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        if (response := self._memory.get(key)) is not None:
+            if not self._expired(response):
+                self._count("memory_hits")
+                return response
+            self._memory.pop(key)
+
+        if self._path is not None and (response := self._disk_get(key)) is not None:
+            self._memory.put(key, response)
+            self._count("disk_hits")
+            return response
+
+        self._count("misses")
+        return None
+
+    def put(self, key: str, chunks: list[str], latency: float) -> None:
+        response = CachedResponse(tuple(chunks), latency, time.time())
+        self._memory.put(key, response)
+        if self._path is not None:
+            self._disk_put(key, response)
+
+    def stream(self, client: LLMClient, prompt: str) -> Iterator[str]: # replayed when cached, dispatched otherwise
+        key = response_key(client.config, prompt)
+        if (response := self.get(key)) is not None:
+            self._count("saved_seconds", response.latency)
+            yield from response.chunks
+            return
+
+        start, chunks = time.perf_counter(), []
+        for chunk in client.stream_chat(prompt):
+            chunks.append(chunk)
+            yield chunk
+        self.put(key, chunks, time.perf_counter() - start) # complete answers only
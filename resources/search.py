@@ -0,0 +1,150 @@
+#######################################
+# Where is that variable/phrase used? #
+#######################################
+
+# - Inverted index over task names, property names and template bodies
+# | Ranked by BM25, favoring documents that match every term of the query
+# - Documents are replaced one at a time, so saving a task/template keeps it up to date
+
+import re, math, heapq
+from collections import Counter
+from threading import RLock
+from typing import Iterable, Literal, NamedTuple, Optional
+
+from resources.domain.target import PublicTarget
+from resources.domain.task import MedicalTask
+from resources.domain.template import MedicalTemplate
+from resources.storage.load import Loader
+from resources.utils import from_canonical_prop, settization
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+DocumentKind = Literal["task", "template"]
+
+
+class SearchHit(NamedTuple):
+    kind: DocumentKind
+    target: PublicTarget
+    task: str
+    iteration: Optional[int]
+    name: str
+    score: float
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower()) # canonical names split by their underscores
+
+
+class SearchIndex:
+
+    def __init__(self):
+        self._postings: dict[str, dict[str, int]] = {} # term -> document -> frequency
+        self._documents: dict[str, tuple[SearchHit, tuple[str, ...]]] = {} # document -> (metadata, terms)
+        self._lengths: dict[str, int] = {} # document -> number of tokens
+        self._total_length = 0
+        self._lock = RLock() # shared by every editor session
+
+    @classmethod
+    def build(cls, targets: Iterable[PublicTarget]=PublicTarget) -> 'SearchIndex':
+        index = cls()
+        for target in targets:
+            if (tasks := Loader.load_tasks_from_fs(target)) is None:
+                continue
+            for task in settization(tasks):
+                index.add_task(target, task)
+                if (templates := Loader.load_templates_from_fs(target, task)) is None:
+                    continue
+                for template in settization(templates):
+                    index.add_template(target, template)
+        return index
+
+    # DOCUMENTS -------------------------------------------------------------------------------------------------- #
+
+    @staticmethod
+    def _task_id(target: PublicTarget, task: str) -> str:
+        return f"task:{target.name}/{task}"
+
+    @staticmethod
+    def _template_id(target: PublicTarget, task: str, iteration: int) -> str:
+        return f"template:{target.name}/{task}/{iteration}"
+
+    def _add(self, doc_id: str, hit: SearchHit, text: str) -> None:
+        frequencies = Counter(tokenize(text))
+        length = sum(frequencies.values())
+
+        with self._lock:
+            self._remove(doc_id)
+            for term, frequency in frequencies.items():
+                self._postings.setdefault(term, {})[doc_id] = frequency
+            self._documents[doc_id] = hit, tuple(frequencies)
+            self._lengths[doc_id] = length
+            self._total_length += length
+
+    def _remove(self, doc_id: str) -> None:
+        if (document := self._documents.pop(doc_id, None)) is None:
+            return
+
+        _, terms = document
+        self._total_length -= self._lengths.pop(doc_id)
+        for term in terms:
+            postings = self._postings[term]
+            del postings[doc_id]
+            if not postings:
+                del self._postings[term]
+
+    def add_task(self, target: PublicTarget, task: MedicalTask) -> None:
+        text = " ".join([task.name, *task.keys(), *map(from_canonical_prop, task.keys())])
+        hit = SearchHit(kind="task", target=target, task=task.name, iteration=None, name=task.name, score=0.)
+        self._add(SearchIndex._task_id(target, task.name), hit, text)
+
+    def add_template(self, target: PublicTarget, template: MedicalTemplate) -> None:
+        hit = SearchHit(kind="template", target=target, task=template.task, iteration=template.iteration, name=template.name, score=0.)
+        self._add(SearchIndex._template_id(target, template.task, template.iteration), hit, f"{template.name}\n{template.content}")
+
+    def remove_templates(self, target: PublicTarget, task: MedicalTask) -> None:
+        prefix = SearchIndex._template_id(target, task.name, "")
+        with self._lock:
+            for doc_id in [d for d in self._documents if d.startswith(prefix)]:
+                self._remove(doc_id)
+
+    def remove_task(self, target: PublicTarget, task: MedicalTask) -> None:
+        with self._lock:
+            self._remove(SearchIndex._task_id(target, task.name))
+            self.remove_templates(target, task)
+
+    # QUERIES ---------------------------------------------------------------------------------------------------- #
+
+    def search(self, query: str, limit: int=20, kind: Optional[DocumentKind]=None) -> list[SearchHit]:
+        terms = set(tokenize(query))
+        with self._lock:
+            if not terms or not self._documents:
+                return []
+            return self._search(terms, limit, kind)
+
+    def _search(self, terms: set[str], limit: int, kind: Optional[DocumentKind]) -> list[SearchHit]:
+        num_documents = len(self._documents)
+        lengths = self._lengths
+        # BM25 denominator as (frequency + base + slope * length)
+        base = BM25_K1 * (1 - BM25_B)
+        slope = BM25_K1 * BM25_B * num_documents / self._total_length
+        scores: dict[str, float] = {}
+        matches: dict[str, int] = {}
+
+        for term in terms:
+            if (postings := self._postings.get(term)) is None:
+                continue
+            weight = (BM25_K1 + 1) * math.log(1 + (num_documents - len(postings) + .5) / (len(postings) + .5))
+            for doc_id, frequency in postings.items():
+                scores[doc_id] = scores.get(doc_id, 0.) + weight * frequency / (frequency + base + slope * lengths[doc_id])
+                matches[doc_id] = matches.get(doc_id, 0) + 1
+
+        ranked = heapq.nlargest(limit, (
+            (score * matches[doc_id] / len(terms), doc_id) for doc_id, score in scores.items() # coordination factor
+            if kind is None or self._documents[doc_id][0].kind == kind
+        ))
+        return [self._documents[doc_id][0]._replace(score=round(score, 4)) for score, doc_id in ranked]
+
+    def __len__(self) -> int:
+        return len(self._documents)
@@ -1 +1,5 @@
-from resources.storage.load import Loader
\ No newline at end of file
+from resources.storage.load import Loader, LoadMode, use_storage, library_generation
+from resources.storage.history import TemplateHistory
+from resources.storage.scores import ScoreLog, ScoreEvent
+from resources.storage.shared import SharedLibrary
+from resources.storage.writeback import WriteBehindQueue, WriteRecord
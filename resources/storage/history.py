@@ -0,0 +1,241 @@
+##############################################
+# Iterations of a task's templates as deltas #
+##############################################
+
+# - One append-only history per task: every saved iteration is a line of differences to the one saved before
+# | Every CHECKPOINT_EVERY saves (or when the delta is not worth it), the full bodies are stored instead
+# - An index next to it keeps the metadata, the variables and where each body is, so listing never decodes a body
+# | Rebuilding an iteration reads one contiguous range (its checkpoint up to it) and applies its deltas
+# - Saving an iteration again appends it again, its last save is the one read
+
+import os, re, json, fcntl, difflib, hashlib
+from contextlib import contextmanager
+from pathlib import Path
+from threading import RLock
+from typing import Iterator, NamedTuple, Optional
+
+from resources.tokens import template_variables
+from resources.utils import print_message
+
+HISTORY_BODY_FIELDS = ("prompt", "template") # the rest is metadata (in the index)
+CHECKPOINT_EVERY = 16 # records between full bodies, at most
+CHECKPOINT_RATIO = .5 # a delta larger than this share of the full bodies is stored as a checkpoint
+INDEX_SUFFIX = ".index.jsonl"
+BODIES_SUFFIX = ".jsonl"
+
+Delta = list[list[int]|str] # [start, end] lines copied from the previous body, or new text
+
+
+class HistoryEntry(NamedTuple):
+    metadata: dict
+    offset: int # of its bodies line
+    length: int
+    checkpoint: int # record with the full bodies its chain starts from
+    variables: Optional[list[str]] # used by its bodies (None if indexed before they were)
+
+
+def history_name(task_name: str) -> str: # readable, and unique whatever the task name
+    digest = hashlib.blake2b(task_name.encode("utf-8"), digest_size=4).hexdigest()
+    readable = re.sub(r"[^\w-]+", "_", task_name).strip("_")[:64]
+    return f"{readable}-{digest}"
+
+
+# DELTAS ----------------------------------------------------------------------------------------------------------- #
+
+def diff(previous: str, current: str) -> Delta:
+    previous_lines, current_lines = previous.splitlines(keepends=True), current.splitlines(keepends=True)
+    delta = []
+    matcher = difflib.SequenceMatcher(None, previous_lines, current_lines, autojunk=False)
+    for op, i1, i2, j1, j2 in matcher.get_opcodes():
+        if op == "equal":
+            delta.append([i1, i2])
+        elif op in ("replace", "insert"):
+            delta.append("".join(current_lines[j1:j2]))
+    return delta
+
+def patch(previous: str, delta: Delta) -> str:
+    previous_lines = previous.splitlines(keepends=True)
+    return "".join("".join(previous_lines[op[0]:op[1]]) if isinstance(op, list) else op for op in delta)
+
+
+def _full_bodies(data: dict) -> dict[str, str]:
+    bodies = { field: data.get(field) for field in HISTORY_BODY_FIELDS }
+    if bodies["template"] is None: # unedited
+        bodies["template"] = bodies["prompt"]
+    return bodies
+
+
+class TemplateHistory:
+
+    def __init__(self, folder: Path, name: str):
+        self._index_path = Path(folder).joinpath(f"{name}{INDEX_SUFFIX}")
+        self._bodies_path = Path(folder).joinpath(f"{name}{BODIES_SUFFIX}")
+        self._lock = RLock() # shared by every session of the process
+        self._reset()
+
+    def _reset(self) -> None:
+        self._inode: Optional[int] = None
+        self._offset = 0 # index bytes already read
+        self._entries: list[HistoryEntry] = []
+        self._latest: dict[str, int] = {} # iteration -> its last record
+        self._decoded: Optional[tuple[int, dict[str, str]]] = None # last rebuilt record, to go on from
+
+    @classmethod
+    def of_task(cls, folder: Path, task_name: str) -> 'TemplateHistory':
+        return cls(folder, history_name(task_name))
+
+    @classmethod
+    def in_folder(cls, folder: Path) -> list['TemplateHistory']:
+        if not Path(folder).is_dir():
+            return []
+        return [cls(folder, path.name[:-len(INDEX_SUFFIX)]) for path in sorted(Path(folder).glob(f"*{INDEX_SUFFIX}"))]
+
+    @property
+    def paths(self) -> tuple[Path, Path]:
+        return self._index_path, self._bodies_path
+
+    # INDEX ------------------------------------------------------------------------------------------------------ #
+
+    def refresh(self) -> None: # reads whatever was indexed since the last call (by any process)
+        with self._lock:
+            try:
+                stat = self._index_path.stat()
+            except FileNotFoundError:
+                if self._inode is not None:
+                    self._reset()
+                return
+
+            if stat.st_ino != self._inode or stat.st_size < self._offset: # removed and started over
+                self._reset()
+                self._inode = stat.st_ino
+            if stat.st_size == self._offset:
+                return
+
+            with self._index_path.open("rb") as fp:
+                fp.seek(self._offset)
+                data = fp.read()
+
+            complete = data.rfind(b"\n") + 1 # a line being written is left for later
+            for line in data[:complete].splitlines():
+                record = json.loads(line)
+                offset, length, is_checkpoint = record.pop("offset"), record.pop("length"), record.pop("checkpoint")
+                variables = record.pop("variables", None)
+                checkpoint = len(self._entries) if is_checkpoint else self._entries[-1].checkpoint
+                self._latest[str(record["iteration"])] = len(self._entries)
+                self._entries.append(HistoryEntry(record, offset, length, checkpoint, variables))
+            self._offset += complete
+
+    def entries(self) -> list[dict]: # metadata (and variables) of the last save of every iteration, oldest first
+        with self._lock:
+            self.refresh()
+            return [
+                { **entry.metadata, "variables": entry.variables } if entry.variables is not None else entry.metadata
+                for entry in (self._entries[record] for record in sorted(self._latest.values()))
+            ]
+
+    def __contains__(self, iteration: int|str) -> bool:
+        with self._lock:
+            self.refresh()
+            return str(iteration) in self._latest
+
+    def __len__(self) -> int: # records, saves of the same iteration included
+        with self._lock:
+            self.refresh()
+            return len(self._entries)
+
+    # BODIES ----------------------------------------------------------------------------------------------------- #
+
+    def _bodies(self, record: int) -> dict[str, str]:
+        entry = self._entries[record]
+        start = entry.checkpoint
+        if self._decoded is not None and start <= self._decoded[0] <= record: # on the way already
+            start, bodies = self._decoded[0] + 1, self._decoded[1]
+        else:
+            bodies = None
+
+        if start <= record:
+            first = self._entries[start].offset
+            with self._bodies_path.open("rb") as fp: # one read for the whole chain
+                fp.seek(first)
+                data = fp.read(entry.offset + entry.length - first)
+            for chained in self._entries[start:record + 1]:
+                stored = json.loads(data[chained.offset - first:chained.offset - first + chained.length])
+                prompt = stored["prompt"] if isinstance(stored["prompt"], str) else patch(bodies["prompt"], stored["prompt"])
+                template = stored["template"]
+                if template is None: # unedited
+                    template = prompt
+                elif not isinstance(template, str):
+                    template = patch(bodies["template"], template)
+                bodies = { "prompt": prompt, "template": template }
+        self._decoded = record, bodies
+        return bodies
+
+    def read(self, iteration: int|str) -> dict: # as saved: metadata and bodies
+        with self._lock:
+            self.refresh()
+            if (record := self._latest.get(str(iteration))) is None:
+                print_message(f"Iteration {iteration} is not in the history of '{self._index_path.name}'", "error", FileNotFoundError)
+            return { **self._entries[record].metadata, **self._bodies(record) }
+
+    def iter_templates(self) -> Iterator[dict]: # every iteration (last save), in one pass over the bodies
+        with self._lock:
+            self.refresh()
+            live = set(self._latest.values())
+            for record in range(len(self._entries)):
+                bodies = self._bodies(record)
+                if record in live:
+                    yield { **self._entries[record].metadata, **bodies }
+
+    # SAVES ------------------------------------------------------------------------------------------------------ #
+
+    @contextmanager
+    def _locked_index(self) -> Iterator[int]: # exclusive between processes as well
+        self._index_path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            fd = os.open(self._index_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.path.exists(self._index_path) and os.fstat(fd).st_ino == os.stat(self._index_path).st_ino:
+                break
+            os.close(fd) # removed while waiting, so append to a new history
+        try:
+            yield fd
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def append(self, data: dict) -> None:
+        full = _full_bodies(data)
+        metadata = { key: value for key, value in data.items() if key not in HISTORY_BODY_FIELDS }
+
+        with self._lock, self._locked_index() as index_fd:
+            self.refresh() # appended by others meanwhile
+            checkpoint = not self._entries or len(self._entries) - self._entries[-1].checkpoint >= CHECKPOINT_EVERY
+            stored = { "prompt": full["prompt"], "template": None if full["template"] == full["prompt"] else full["template"] }
+            if not checkpoint:
+                previous = self._bodies(len(self._entries) - 1)
+                delta = { field: diff(previous[field], full[field]) for field in HISTORY_BODY_FIELDS }
+                if full["template"] == full["prompt"] and previous["template"] == previous["prompt"]:
+                    delta["template"] = None
+                encoded = json.dumps(delta)
+                checkpoint = len(encoded) > CHECKPOINT_RATIO * len(json.dumps(stored))
+            line = (encoded if not checkpoint else json.dumps(stored)).encode("utf-8") + b"\n"
+
+            bodies_fd = os.open(self._bodies_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                offset = os.lseek(bodies_fd, 0, os.SEEK_END)
+                os.write(bodies_fd, line)
+            finally:
+                os.close(bodies_fd)
+            # Indexed once its bodies are written, so readers never find an index line without them
+            variables = sorted(template_variables(full["template"] or full["prompt"]))
+            os.write(index_fd, (json.dumps({
+                **metadata, "variables": variables, "offset": offset, "length": len(line), "checkpoint": checkpoint
+            }) + "\n").encode("utf-8"))
+            self.refresh()
+            self._decoded = len(self._entries) - 1, full
+
+    def remove(self) -> None:
+        with self._lock:
+            for path in self.paths:
+                path.unlink(missing_ok=True)
+            self._reset()
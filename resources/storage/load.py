@@ -2,13 +2,20 @@
 # Load Instances from local FS #
 ################################
 
-import re, json, io
+import os, re, json, io, time, zipfile, hashlib, multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from enum import Enum
-from typing import Union, Optional, Any
+from functools import partial
+from typing import Union, Optional, Any, Callable, Iterable, Iterator, IO
 from pathlib import Path
 from resources.domain.target import PublicTarget
 from resources.domain.task import MedicalTask
-from resources.domain.template import MedicalTemplate, MedicalPrompt
+from resources.cache import LRUCache
+from resources.domain.template import MedicalTemplate, MedicalPrompt, LazyMedicalTemplate, content_fingerprint
+from resources.domain.vocabulary import Vocabulary
+from resources.storage.history import TemplateHistory
+from resources.tokens import template_variables
 
 from resources.utils import *
 
@@ -22,11 +29,73 @@ MODE_SOURCE_PATHS: dict[LoadMode, Path] = \
     LoadMode.TEMPLATE: related_to_project_path(__file__, "templates")
 }
 
+VOCABULARIES_DIR = "vocabularies" # side files of list options, one per line
+Vocabulary.root = related_to_project_path(__file__, VOCABULARIES_DIR)
+
+def use_storage(root: Path) -> None: # e.g., another environment's library
+    MODE_SOURCE_PATHS[LoadMode.TASK] = Path(root).joinpath("tasks")
+    MODE_SOURCE_PATHS[LoadMode.TEMPLATE] = Path(root).joinpath("templates")
+    Vocabulary.root = Path(root).joinpath(VOCABULARIES_DIR)
+
+def storage_root() -> Path:
+    return MODE_SOURCE_PATHS[LoadMode.TEMPLATE].parent
+
+GENERATION_FILE = ".generation"
+
+def library_generation() -> int: # a new number after every write through the Loader (by any process)
+    try:
+        return int(storage_root().joinpath(GENERATION_FILE).read_text())
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def _bump_generation() -> None:
+    generation_file = storage_root().joinpath(GENERATION_FILE)
+    pending_file = generation_file.with_name(f"{GENERATION_FILE}.{os.getpid()}")
+    pending_file.write_text(str(time.time_ns()))
+    os.replace(pending_file, generation_file) # readers never see a partial number
+
 MODE_BASEFILES: dict[LoadMode, dict[PublicTarget, Path]] = {
     LoadMode.TASK : { p: Path(f"task-{p}.json") for p in PublicTarget },
     LoadMode.TEMPLATE: { p: Path(f"prompt-{p}.json") for p in PublicTarget }
 }
 
+BODY_FIELDS = { "properties", "prompt", "template" } # left out of the metadata index
+
+HISTORY_DIR = "history" # per task, iterations saved as deltas (history/<target>/<task>.*)
+
+BUNDLE_VERSION = 2 # 2: vocabulary side files
+BUNDLE_ZIP_MEMBER = "library.jsonl"
+BUNDLE_KINDS: dict[str, LoadMode] = { "task": LoadMode.TASK, "template": LoadMode.TEMPLATE }
+
+# file -> (file version, metadata); only re-read when the file changes
+_METADATA_INDEX: dict[Path, tuple[tuple[int, int], dict]] = {}
+
+# index file -> history; its index is only read again from where it was left
+_HISTORIES: dict[Path, TemplateHistory] = {}
+
+PROMPT_LOG_PATTERN = re.compile(r'Prompt (\d+): *(\w+[ \-\w]*)\r?\n(.+?)\r?\n===\r?\n', re.DOTALL)
+PARALLEL_PARSE_BYTES = 4 << 20 # uploads larger than this are parsed by a pool of processes
+
+# prompt log content hash -> its prompts; the same log uploaded again (any name, any session) is not parsed again
+_PARSED_LOGS = LRUCache(capacity=256)
+# (target, task) -> (library generation, fingerprints of the stored prompts, last stored iteration)
+_STORED_PROMPTS: dict[tuple[PublicTarget, str], tuple[int, set[bytes], int]] = {}
+
+
+def _parse_prompt_log(data: bytes) -> list[tuple[str, str, str]]: # (iteration, name, content), in a worker if large
+    return [
+        (prompt_id, prompt_name, prompt_content.replace("\r", "").replace("{", "{{").replace("}", "}}"))
+        for prompt_id, prompt_name, prompt_content in PROMPT_LOG_PATTERN.findall(data.decode("utf-8"))
+    ]
+
+def _prompt_fingerprint(content: str) -> bytes:
+    return content_fingerprint(content.strip())
+
+def template_metadata(data: dict) -> dict: # without the bodies, but with the variables they use (indexed without them)
+    metadata = { key: value for key, value in data.items() if key not in BODY_FIELDS }
+    metadata["variables"] = sorted(template_variables(data.get("template") or data["prompt"]))
+    return metadata
+
 
 class Loader:
 
@@ -59,6 +128,13 @@ class Loader:
         
         return guess
 
+    def _iter_new_target_files(target: PublicTarget, mode: LoadMode) -> Iterator[Path]: # one directory walk for many files
+        guess = Loader._get_first_file(target, mode)
+        while True:
+            if not Loader._file_exists(guess, mode):
+                yield guess
+            guess = Loader._get_next_file(guess)
+
     def _get_all_target_files(target: PublicTarget, mode: LoadMode) -> set[Path]:
         current_file = Loader._get_first_file(target, mode)
         target_files = set()
@@ -67,29 +143,67 @@ class Loader:
             current_file = Loader._get_next_file(current_file)
         
         return target_files
+
+    def _read_json(path: Path) -> dict:
+        with path.open() as f:
+            return json.load(f)
+
+    def _read_metadata(file: Path, mode: LoadMode) -> dict:
+        path = Loader._get_related_file_path(file, mode)
+        stat = path.stat()
+        version = (stat.st_mtime_ns, stat.st_size)
+        
+        if (indexed := _METADATA_INDEX.get(path)) is not None and indexed[0] == version:
+            return indexed[1]
+
+        data = Loader._read_json(path)
+        if mode is LoadMode.TEMPLATE:
+            metadata = template_metadata(data)
+        else:
+            metadata = { key: value for key, value in data.items() if key not in BODY_FIELDS }
+        _METADATA_INDEX[path] = version, metadata
+        return metadata
     
     def _get_specified_target_files(target: PublicTarget, mode: LoadMode, **specified_cond: dict[str, Any]) -> Union[Path, set[Path]]:
         current_files = Loader._get_all_target_files(target, mode)
         specified_files = set()
         for file in current_files:
-            with Loader._get_related_file_path(file, mode).open() as f:
-                data: dict = json.load(f)
-                if any(key not in data for key in specified_cond): continue
-                
-                if all(data[key] == value for key, value in specified_cond.items()):
-                    specified_files.add(file)
+            data = Loader._read_metadata(file, mode)
+            if any(key not in data for key in specified_cond): continue
+            
+            if all(data[key] == value for key, value in specified_cond.items()):
+                specified_files.add(file)
 
         return set_optional_return(specified_files)
 
+    @staticmethod
+    def list_files(target: PublicTarget, mode: LoadMode) -> list[Path]: # in file sequence order
+        files, current_file = [], Loader._get_first_file(target, mode)
+        while Loader._file_exists(current_file, mode):
+            files.append(Loader._get_related_file_path(current_file, mode))
+            current_file = Loader._get_next_file(current_file)
+        return files
+
     # TASKS ------------------------------------------------------------------------------------------------------ #
     
     @staticmethod
-    def load_tasks_to_fs(target: PublicTarget, tasks: Union[MedicalTask, set[MedicalTask]]) -> None:
+    def task_exists(target: PublicTarget, task_name: str) -> bool: # from the metadata index
+        return Loader._get_specified_target_files(target, name=task_name, mode=LoadMode.TASK) is not None
+
+    @staticmethod
+    def load_tasks_to_fs(target: PublicTarget, tasks: Union[MedicalTask, set[MedicalTask]]) -> list[MedicalTask]:
+        written = []
         for task in settization(tasks):
             task_file = Loader._get_specified_target_files(target, name=task.name, mode=LoadMode.TASK)
             if task_file is None:
                 task_file = Loader._get_new_target_file(target, mode=LoadMode.TASK)
+            elif not task.dirty: # unchanged since loaded/saved
+                continue
             task.save(Loader._get_related_file_path(task_file, mode=LoadMode.TASK))
+            written.append(task)
+        if written:
+            _bump_generation()
+        return written
 
     @staticmethod
     def load_tasks_from_fs(target: PublicTarget) -> Optional[Union[MedicalTask, set[MedicalTask]]]:
@@ -103,58 +217,288 @@ class Loader:
         if (task_file := Loader._get_specified_target_files(target, name=task.name, mode=LoadMode.TASK)) is None:
             print_message(f"Cannot delete the task '{task.name}' as it lost its source file", "error", FileNotFoundError)
         Loader._get_related_file_path(task_file, mode=LoadMode.TASK).unlink()
+        _bump_generation()
 
     # TEMPLATES -------------------------------------------------------------------------------------------------- #
     
     @staticmethod
-    def load_templates_to_fs(target: PublicTarget, templates: Union[MedicalTemplate, set[MedicalTemplate]]) -> None:
+    def load_templates_to_fs(target: PublicTarget, templates: Union[MedicalTemplate, set[MedicalTemplate]]) -> list[MedicalTemplate]:
+        written = []
         for template in settization(templates):
             template_file = Loader._get_specified_target_files(target, task=template.task, iteration=template.iteration, mode=LoadMode.TEMPLATE)
-            if template_file is None:
-                template_file = Loader._get_new_target_file(target, mode=LoadMode.TEMPLATE)
-            template.save(Loader._get_related_file_path(template_file, mode=LoadMode.TEMPLATE))
+            if template_file is None: # new ones go to the history of their task (as a delta)
+                history = Loader.template_history(target, template.task)
+                if template.iteration in history and not template.dirty:
+                    continue
+                history.append(template.to_json())
+                template.mark_clean()
+            elif not template.dirty: # unchanged since loaded/saved
+                continue
+            else:
+                template.save(Loader._get_related_file_path(template_file, mode=LoadMode.TEMPLATE))
+            written.append(template)
+        if written:
+            _bump_generation()
+        return written
 
     @staticmethod
     def load_templates_from_fs(target: PublicTarget, task: MedicalTask) -> Optional[Union[MedicalTemplate, set[MedicalTemplate]]]:
         if Loader._get_specified_target_files(target, name=task.name, mode=LoadMode.TASK) is None:
             return None
-        if (template_files := Loader._get_specified_target_files(target, task=task.name, mode=LoadMode.TEMPLATE)) is None:
-            return None
+        template_files = Loader._get_specified_target_files(target, task=task.name, mode=LoadMode.TEMPLATE)
 
-        load_templates = { MedicalTemplate.load(task, Loader._get_related_file_path(f, mode=LoadMode.TEMPLATE)) 
-                            for f in settization(template_files) }
+        # Only metadata is loaded for now, the bodies come on first use
+        load_templates = { 
+            LazyMedicalTemplate(
+                metadata=Loader._read_metadata(f, mode=LoadMode.TEMPLATE),
+                task=task,
+                fetch=partial(Loader._read_json, Loader._get_related_file_path(f, mode=LoadMode.TEMPLATE))
+            ) for f in settization(template_files or set())
+        }
+        # Then the iterations kept in the task history (listed from its index, without their bodies)
+        in_files = { str(template.iteration) for template in load_templates }
+        history = Loader.template_history(target, task.name)
+        load_templates.update(
+            LazyMedicalTemplate(metadata=metadata, task=task, fetch=partial(history.read, metadata["iteration"]))
+            for metadata in history.entries() if str(metadata["iteration"]) not in in_files
+        )
         return set_optional_return(load_templates)
     
-    @staticmethod
-    def load_templates_from_file(task: MedicalTask, file: io.BytesIO) -> Optional[Union[MedicalTemplate, set[MedicalTemplate]]]:
-        if file is None: return None
-
-        prompt_pattern = re.compile(r'Prompt (\d+): *(\w+[ \-\w]*)\r?\n(.+?)\r?\n===\r?\n', re.DOTALL)
-    
-        file_data = file.read().decode("utf-8")
-        template_data = prompt_pattern.findall(file_data)
-        
-        return set_optional_return({ 
-                MedicalTemplate(
-                    prompt=MedicalPrompt(
-                        prompt_content.replace("\r", "").replace("{", "{{").replace("}", "}}"),
-                        name=prompt_name,
-                        iteration=prompt_id,
-                        score=0,
-                    ),
-                    task=task,
-                    to_validate=False,
-                ) for prompt_id, prompt_name, prompt_content in template_data
-            })
-    
     @staticmethod
     def exclude_templates(target: PublicTarget, task: MedicalTask) -> None:
         if Loader._get_specified_target_files(target, name=task.name, mode=LoadMode.TASK) is None:
             print_message(f"Cannot delete templates of a task ('{task.name}') that does not exist", "error", FileNotFoundError)
         
-        if (template_files := Loader._get_specified_target_files(target, task=task.name, mode=LoadMode.TEMPLATE)) is None:
+        template_files = Loader._get_specified_target_files(target, task=task.name, mode=LoadMode.TEMPLATE)
+        history = Loader.template_history(target, task.name)
+        if template_files is None and not len(history):
             print_message(f"Task ('{task.name}') does not have any template to delete", "error", FileNotFoundError)
 
-        for template_file in settization(template_files):
+        for template_file in settization(template_files or set()):
             Loader._get_related_file_path(template_file, mode=LoadMode.TEMPLATE).unlink()
+        history.remove()
+        _bump_generation()
+
+    # UPLOADS -------------------------------------------------------------------------------------------------- #
+
+    @staticmethod
+    def parse_prompt_logs(logs: list[bytes]) -> list[list[tuple[str, str, str]]]: # the prompts of every log, in order
+        digests = [hashlib.blake2b(data, digest_size=16).digest() for data in logs]
+        parsed = { digest: prompts for digest in digests if (prompts := _PARSED_LOGS.get(digest)) is not None }
+        missing = { digest: data for digest, data in zip(digests, logs) if digest not in parsed }
+
+        workers = min(len(missing), os.cpu_count() or 1)
+        if workers > 1 and sum(map(len, missing.values())) > PARALLEL_PARSE_BYTES:
+            # Spawned, not forked: the server process runs threads (write-behind, telemetry) whose locks a fork would copy
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                parsed.update(zip(missing, pool.map(_parse_prompt_log, missing.values())))
+        else:
+            parsed.update(zip(missing, map(_parse_prompt_log, missing.values())))
+        for digest in missing:
+            _PARSED_LOGS.put(digest, parsed[digest])
+        return [parsed[digest] for digest in digests]
+
+    def _stored_prompts(target: PublicTarget, task: MedicalTask) -> tuple[set[bytes], int]:
+        # Fingerprints of every stored template (original prompt and edited content) and the last iteration number
+        generation = library_generation()
+        if (stored := _STORED_PROMPTS.get((target, task.name))) is not None and stored[0] == generation:
+            return stored[1], stored[2]
+
+        fingerprints, last_iteration = set(), 0
+        for template in settization(Loader.load_templates_from_fs(target, task) or set()):
+            data = template.to_json()
+            fingerprints.update((_prompt_fingerprint(data["prompt"]), _prompt_fingerprint(data["template"])))
+            if str(template.iteration).isdigit():
+                last_iteration = max(last_iteration, int(template.iteration))
+        _STORED_PROMPTS[target, task.name] = generation, fingerprints, last_iteration
+        return fingerprints, last_iteration
+
+    @staticmethod
+    def merge_prompt_logs(
+            target: PublicTarget,
+            task: MedicalTask,
+            logs: list[bytes],
+            dry_run: bool=False
+        ) -> tuple[list[MedicalTemplate], dict[str, int]]:
+
+        # Prompts not stored yet (nor repeated in the logs) become the next iterations of the task, in upload order
+        stored, last_iteration = Loader._stored_prompts(target, task)
+        seen, merged = set(stored), []
+        counts = { "parsed": 0, "duplicates": 0 }
+        for prompts in Loader.parse_prompt_logs(logs):
+            for _, prompt_name, prompt_content in prompts:
+                counts["parsed"] += 1
+                if (fingerprint := _prompt_fingerprint(prompt_content)) in seen:
+                    counts["duplicates"] += 1
+                    continue
+                seen.add(fingerprint)
+                merged.append(MedicalTemplate(
+                    prompt=MedicalPrompt(prompt_content, name=prompt_name, iteration=last_iteration + len(merged) + 1, score=0),
+                    task=task,
+                    to_validate=False
+                ))
+
+        if not dry_run and merged:
+            Loader.load_templates_to_fs(target, set(merged))
+        return merged, counts
+
+    # HISTORIES -------------------------------------------------------------------------------------------------- #
+
+    def _history_folder(target: PublicTarget) -> Path:
+        return storage_root().joinpath(HISTORY_DIR, target.name)
+
+    @staticmethod
+    def template_history(target: PublicTarget, task_name: str) -> TemplateHistory:
+        history = TemplateHistory.of_task(Loader._history_folder(target), task_name)
+        return _HISTORIES.setdefault(history.paths[0], history)
+
+    @staticmethod
+    def template_histories(target: PublicTarget) -> list[TemplateHistory]:
+        return [_HISTORIES.setdefault(h.paths[0], h) for h in TemplateHistory.in_folder(Loader._history_folder(target))]
+
+    def _iteration_order(iteration: int|str) -> tuple[int, int|str]: # numbers first, numerically
+        return (0, int(iteration)) if str(iteration).isdigit() else (1, str(iteration))
+
+    @staticmethod
+    def archive_templates(target: PublicTarget) -> dict[str, int]:
+        # Template files into the history of their task (oldest iteration first), then removed
+        files_by_task: dict[str, list[tuple[Path, dict]]] = {}
+        for file in Loader.list_files(target, LoadMode.TEMPLATE):
+            data = Loader._read_json(file)
+            files_by_task.setdefault(data["task"], []).append((file, data))
+
+        counts = { "archived": 0, "file_bytes": 0 }
+        for task_name, files in files_by_task.items():
+            history = Loader.template_history(target, task_name)
+            for file, data in sorted(files, key=lambda item: Loader._iteration_order(item[1]["iteration"])):
+                history.append(data)
+                counts["file_bytes"] += file.stat().st_size
+                file.unlink()
+                counts["archived"] += 1
+        if counts["archived"]:
+            _bump_generation()
+        return counts
+
+
+    # BUNDLES ---------------------------------------------------------------------------------------------------- #
+
+    # A bundle is a JSON line per task/template ({ kind, target, data }), optionally zipped.
+    # Templates of the task histories are exported as plain ones, and imported back into the histories.
+    # Vocabulary side files go last, as { kind: "vocabulary", name, data: [options] }.
+    # Both ways stream one file at a time, so memory does not grow with the library.
+
+    @contextmanager
+    def _open_bundle(bundle: Path, mode: str) -> Iterator[IO[str]]:
+        if bundle.suffix != ".zip":
+            with bundle.open(mode, encoding="utf-8") as fp:
+                yield fp
+            return
+
+        with zipfile.ZipFile(bundle, mode, compression=zipfile.ZIP_DEFLATED) as zf:
+            with zf.open(BUNDLE_ZIP_MEMBER, mode) as member:
+                with io.TextIOWrapper(member, encoding="utf-8") as fp:
+                    yield fp
+
+    def _template_key(data: dict) -> tuple[str, str]:
+        return data["task"], str(data["iteration"]) # iterations were saved either as numbers or strings
+
+    @staticmethod
+    def export_bundle(bundle: Path, targets: Iterable[PublicTarget]=PublicTarget) -> int:
+        targets = list(targets)
+        exported = 0
+        with Loader._open_bundle(bundle, "w") as fp:
+            fp.write(json.dumps({ "kind": "bundle", "version": BUNDLE_VERSION, "targets": [t.name for t in targets] }) + "\n")
+            for target in targets:
+                for kind, mode in BUNDLE_KINDS.items():
+                    for file in Loader.list_files(target, mode):
+                        fp.write(json.dumps({ "kind": kind, "target": target.name, "data": Loader._read_json(file) }) + "\n")
+                        exported += 1
+                for history in Loader.template_histories(target): # as plain templates, in their order of saving
+                    for data in history.iter_templates():
+                        fp.write(json.dumps({ "kind": "template", "target": target.name, "data": data }) + "\n")
+                        exported += 1
+            for file in sorted(Vocabulary.root.glob("*")) if Vocabulary.root.is_dir() else []:
+                fp.write(json.dumps({ "kind": "vocabulary", "name": file.name, "data": list(Vocabulary(name=file.name)) }) + "\n")
+                exported += 1
+        return exported
+
+    @staticmethod
+    def import_bundle(
+            bundle: Path, 
+            overwrite: bool=False, 
+            batch_size: int=500, 
+            progress: Optional[Callable[[dict[str, int]], None]]=None
+        ) -> dict[str, int]:
+
+        # Stored files by their identity: task name or (task name, iteration)
+        existing: dict[tuple[PublicTarget, LoadMode], dict[Any, Path]] = {}
+        def existing_files(target: PublicTarget, mode: LoadMode) -> dict[Any, Path]:
+            if (target, mode) not in existing:
+                files = existing[target, mode] = {}
+                for file in Loader._get_all_target_files(target, mode):
+                    metadata = Loader._read_metadata(file, mode)
+                    files[metadata["name"] if mode is LoadMode.TASK else Loader._template_key(metadata)] = file
+            return existing[target, mode]
+
+        new_files: dict[tuple[PublicTarget, LoadMode], Iterator[Path]] = {}
+        counts = { "read": 0, "written": 0, "duplicates": 0 }
+        batch: list[tuple[Path, dict]] = []
+
+        def flush() -> None:
+            for path, data in batch:
+                path.parent.mkdir(parents=True, exist_ok=True) # e.g., into an empty library
+                with path.open("w") as fp:
+                    json.dump(data, fp, indent=4, sort_keys=False)
+            counts["written"] += len(batch)
+            batch.clear()
+            if progress is not None:
+                progress(dict(counts))
+
+        with Loader._open_bundle(bundle, "r") as fp:
+            for line in fp:
+                record: dict = json.loads(line)
+                if record["kind"] == "bundle":
+                    if record["version"] > BUNDLE_VERSION:
+                        print_message(f"Bundle version {record['version']} is not supported", "error", ValueError)
+                    continue
+
+                counts["read"] += 1
+                if record["kind"] == "vocabulary":
+                    Vocabulary.check_name(record["name"]) # written from bundle data, so never out of its folder
+                    vocabulary_file = Vocabulary.root.joinpath(record["name"])
+                    if vocabulary_file.exists() and not overwrite:
+                        counts["duplicates"] += 1
+                        continue
+                    vocabulary_file.parent.mkdir(parents=True, exist_ok=True)
+                    vocabulary_file.write_text("".join(f"{option}\n" for option in record["data"]), encoding="utf-8")
+                    counts["written"] += 1
+                    continue
+
+                target, mode, data = PublicTarget[record["target"]], BUNDLE_KINDS[record["kind"]], record["data"]
+                key = data["name"] if mode is LoadMode.TASK else Loader._template_key(data)
+
+                stored = existing_files(target, mode)
+                if mode is LoadMode.TEMPLATE and key not in stored: # new iterations go to the task history
+                    history = Loader.template_history(target, data["task"])
+                    if data["iteration"] in history and not overwrite:
+                        counts["duplicates"] += 1
+                    else:
+                        history.append(data)
+                        counts["written"] += 1
+                    continue
+                if key in stored and not overwrite:
+                    counts["duplicates"] += 1
+                    continue
+                if key not in stored:
+                    if (target, mode) not in new_files:
+                        new_files[target, mode] = Loader._iter_new_target_files(target, mode)
+                    stored[key] = next(new_files[target, mode])
+
+                batch.append((Loader._get_related_file_path(stored[key], mode), data))
+                if len(batch) >= batch_size:
+                    flush()
+        flush()
+        if counts["written"]:
+            _bump_generation()
 
+        return counts
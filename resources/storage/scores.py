@@ -0,0 +1,160 @@
+#########################################
+# Reviewer scores as an append-only log #
+#########################################
+
+# - Every score given is one appended line (template, reviewer, score, time), no template file is rewritten
+# | Reviewers scoring at the same time never overwrite each other
+# - Aggregates (mean of the latest score of each reviewer) are updated from the new lines only
+# - Once most lines are outdated, the log is compacted to the latest score of each reviewer
+
+import os, json, time, fcntl
+from contextlib import contextmanager
+from pathlib import Path
+from threading import RLock
+from typing import Iterator, NamedTuple, Optional
+
+from resources.domain.template import MedicalTemplate
+from resources.storage.load import storage_root
+
+SCORE_LOG_FILE = "scores.log"
+COMPACT_MIN_EVENTS = 1024
+COMPACT_RATIO = 4 # events per live score before compacting
+
+
+class ScoreEvent(NamedTuple):
+    template: str
+    reviewer: str
+    score: int
+    time: float
+
+
+def default_score_log_path() -> Path: # next to tasks/ and templates/ of the storage in use
+    return storage_root().joinpath(SCORE_LOG_FILE)
+
+
+class ScoreLog:
+
+    def __init__(self, path: Optional[Path]=None):
+        self._path = Path(path) if path is not None else default_score_log_path()
+        self._lock = RLock() # shared by every session of the process
+        self._reset()
+
+    def _reset(self) -> None:
+        self._inode: Optional[int] = None # replaced on compaction (by any process)
+        self._offset = 0 # bytes already aggregated
+        self._events = 0
+        self._latest: dict[str, dict[str, ScoreEvent]] = {} # template -> reviewer -> last event
+        self._sums: dict[str, int] = {} # template -> sum of the latest scores
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    # AGGREGATION ------------------------------------------------------------------------------------------------ #
+
+    def _apply(self, event: ScoreEvent) -> None:
+        reviewers = self._latest.setdefault(event.template, {})
+        previous = reviewers.get(event.reviewer)
+        if previous is not None and previous.time > event.time:
+            return
+        self._sums[event.template] = self._sums.get(event.template, 0) + event.score - (previous.score if previous else 0)
+        reviewers[event.reviewer] = event
+
+    def refresh(self) -> None: # aggregates whatever was appended since the last call
+        with self._lock:
+            try:
+                stat = self._path.stat()
+            except FileNotFoundError:
+                if self._inode is not None:
+                    self._reset()
+                return
+
+            if stat.st_ino != self._inode or stat.st_size < self._offset: # compacted meanwhile
+                self._reset()
+                self._inode = stat.st_ino
+            if stat.st_size == self._offset:
+                return
+
+            with self._path.open("rb") as fp:
+                fp.seek(self._offset)
+                data = fp.read()
+
+            complete = data.rfind(b"\n") + 1 # a line being written is left for later
+            for line in data[:complete].splitlines():
+                try:
+                    self._apply(ScoreEvent(**json.loads(line)))
+                except (ValueError, TypeError): # corrupted line
+                    continue
+                self._events += 1
+            self._offset += complete
+
+    # Read under the lock as well: a refresh of another session may be aggregating (or resetting) meanwhile
+
+    def score(self, template: MedicalTemplate) -> float|int: # the stored one until reviewed
+        with self._lock:
+            if not (reviewers := self._latest.get(template.id)):
+                return template.score
+            return self._sums[template.id] / len(reviewers)
+
+    def reviews(self, template: MedicalTemplate) -> int:
+        with self._lock:
+            return len(self._latest.get(template.id, ()))
+
+    def reviewer_score(self, template: MedicalTemplate, reviewer: str) -> Optional[int]:
+        with self._lock:
+            event = self._latest.get(template.id, {}).get(reviewer)
+        return event.score if event else None
+
+    def rank(self, template: MedicalTemplate) -> tuple[float|int, int]:
+        return self.score(template), template.iteration # (higher) score >> (last) iteration
+
+    # EVENTS ----------------------------------------------------------------------------------------------------- #
+
+    @contextmanager
+    def _locked_log(self) -> Iterator[int]: # exclusive between processes as well
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        while True:
+            fd = os.open(self._path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            if os.fstat(fd).st_ino == os.stat(self._path).st_ino:
+                break
+            os.close(fd) # compacted while waiting, so append to the new log
+        try:
+            yield fd
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def record(self, template: MedicalTemplate, reviewer: str, score: int) -> None:
+        event = ScoreEvent(template=template.id, reviewer=reviewer, score=int(score), time=time.time())
+        line = (json.dumps(event._asdict()) + "\n").encode("utf-8")
+        with self._locked_log() as fd:
+            os.write(fd, line)
+
+        self.refresh()
+        with self._lock:
+            to_compact = self._events >= COMPACT_MIN_EVENTS and self._events >= COMPACT_RATIO * self._live_scores()
+        if to_compact:
+            self.compact()
+
+    def _live_scores(self) -> int:
+        with self._lock:
+            return sum(len(reviewers) for reviewers in self._latest.values())
+
+    def compact(self) -> None:
+        with self._lock, self._locked_log():
+            self.refresh() # nobody appends while the lock is held
+            compacted = self._path.with_suffix(".compacting")
+            with compacted.open("w") as fp:
+                for reviewers in self._latest.values():
+                    for event in reviewers.values():
+                        fp.write(json.dumps(event._asdict()) + "\n")
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(compacted, self._path)
+
+            self._reset()
+            self.refresh()
+
+    def __len__(self) -> int: # events aggregated (not yet compacted)
+        return self._events
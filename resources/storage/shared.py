@@ -0,0 +1,128 @@
+###################################################
+# One library snapshot for every worker of a host #
+###################################################
+
+# - The first worker to need it copies tasks and templates into a SQLite file, the others wait and reuse it
+# | Template bodies stay in the file until used, so processes only hold metadata (and recent bodies)
+# - Every write through the Loader bumps the library generation, and a stale snapshot is rebuilt once
+
+import json, sqlite3, threading, itertools
+from functools import partial
+from pathlib import Path
+from typing import Optional
+
+from resources.domain.target import PublicTarget
+from resources.domain.task import MedicalTask
+from resources.domain.template import LazyMedicalTemplate
+from resources.storage.load import Loader, LoadMode, library_generation, template_metadata
+from resources.utils import print_message, set_optional_return
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS tasks (
+    target TEXT NOT NULL, name TEXT NOT NULL, data TEXT NOT NULL,
+    PRIMARY KEY (target, name)
+);
+CREATE TABLE IF NOT EXISTS templates (
+    target TEXT NOT NULL, task TEXT NOT NULL, iteration TEXT NOT NULL, metadata TEXT NOT NULL, data TEXT NOT NULL,
+    PRIMARY KEY (target, task, iteration)
+);
+"""
+
+
+class SharedLibrary:
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._local = threading.local() # sqlite connections are not shared between threads
+        self._checked_generation: Optional[int] = None
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    def _connection(self) -> sqlite3.Connection:
+        if (conn := getattr(self._local, "conn", None)) is None:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self._path, timeout=300, isolation_level=None) # transactions by hand
+            if conn.execute("PRAGMA journal_mode").fetchone()[0] != "wal": # switching is slow, even to the same mode
+                conn.execute("PRAGMA journal_mode=WAL") # readers keep the old snapshot during a rebuild
+            conn.executescript(SCHEMA)
+            self._local.conn = conn
+        return conn
+
+    def _snapshot_generation(self, conn: sqlite3.Connection) -> Optional[int]:
+        row = conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()
+        return row[0] if row else None
+
+    def generation(self) -> int: # of the library being served, rebuilding the snapshot if it is stale
+        current = library_generation()
+        if current == self._checked_generation:
+            return current
+
+        conn = self._connection()
+        if self._snapshot_generation(conn) != current:
+            conn.execute("BEGIN IMMEDIATE") # one worker rebuilds, the others wait for it
+            try:
+                if self._snapshot_generation(conn) != current:
+                    self._rebuild(conn, current)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+
+        self._checked_generation = current
+        return current
+
+    def _rebuild(self, conn: sqlite3.Connection, generation: int) -> None:
+        conn.execute("DELETE FROM tasks")
+        conn.execute("DELETE FROM templates")
+        for target in PublicTarget:
+            conn.executemany("INSERT OR REPLACE INTO tasks VALUES (?, ?, ?)", (
+                (target.name, data["name"], json.dumps(data))
+                for data in map(Loader._read_json, Loader.list_files(target, LoadMode.TASK))
+            ))
+            # Task histories first, so a template file of the same iteration replaces it (as the Loader reads them)
+            histories = (data for history in Loader.template_histories(target) for data in history.iter_templates())
+            files = map(Loader._read_json, Loader.list_files(target, LoadMode.TEMPLATE))
+            conn.executemany("INSERT OR REPLACE INTO templates VALUES (?, ?, ?, ?, ?)", (
+                (
+                    target.name, data["task"], str(data["iteration"]),
+                    json.dumps(template_metadata(data)),
+                    json.dumps(data)
+                ) for data in itertools.chain(histories, files)
+            ))
+        conn.execute("INSERT OR REPLACE INTO meta VALUES ('generation', ?)", (generation,))
+
+    # LOADING ---------------------------------------------------------------------------------------------------- #
+
+    def load_tasks(self, target: PublicTarget) -> Optional[MedicalTask|set[MedicalTask]]:
+        self.generation()
+        tasks = set()
+        for (data,) in self._connection().execute("SELECT data FROM tasks WHERE target = ?", (target.name,)):
+            task = MedicalTask.from_json(target, json.loads(data))
+            task.mark_clean() # as stored
+            tasks.add(task)
+        return set_optional_return(tasks)
+
+    def load_templates(self, target: PublicTarget, task: MedicalTask) -> Optional[LazyMedicalTemplate|set[LazyMedicalTemplate]]:
+        self.generation()
+        rows = self._connection().execute(
+            "SELECT iteration, metadata FROM templates WHERE target = ? AND task = ?", (target.name, task.name)
+        )
+        # Only metadata is loaded for now, the bodies come from the snapshot on first use
+        return set_optional_return({
+            LazyMedicalTemplate(
+                metadata=json.loads(metadata),
+                task=task,
+                fetch=partial(self._template_data, target, task.name, iteration)
+            ) for iteration, metadata in rows
+        })
+
+    def _template_data(self, target: PublicTarget, task_name: str, iteration: str) -> dict:
+        row = self._connection().execute(
+            "SELECT data FROM templates WHERE target = ? AND task = ? AND iteration = ?", (target.name, task_name, iteration)
+        ).fetchone()
+        if row is None:
+            print_message(f"Template {iteration} of the task '{task_name}' is no longer in the library", "error", FileNotFoundError)
+        return json.loads(row[0])
@@ -0,0 +1,292 @@
+#############################################
+# Saves written behind, off the script runs #
+#############################################
+
+# - Saves and deletions are queued as snapshots (json) of what they write, and a worker thread writes them
+# | The script run goes on right away, and later edits of the same objects never race the write
+# - Every queued write is journaled first and marked there once written (one journal per process)
+# | Journals left behind by a process that did not write everything (killed, crashed) are replayed by the next one
+# - Writes of the same object queued within COALESCE_SECONDS replace each other, only the last one is written
+# - Each object written is pending, done or failed (with the error, to be retried) ; flush() waits for the queue
+# | to be written, and so does the exit of the process
+# | A retry writes the snapshot that failed again, as it was queued (a newer write of the object replaces it)
+
+import os, json, time, fcntl, atexit, threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Iterable, Literal, NamedTuple, Optional
+
+from resources.domain.target import PublicTarget
+from resources.domain.task import MedicalTask
+from resources.domain.template import MedicalTemplate
+from resources.storage.load import Loader, storage_root
+from resources.utils import print_message, settization
+
+WRITEBACK_DIR = ".writeback" # journals of the processes writing behind
+COALESCE_SECONDS = .5 # a write waits this long for a newer one of the same object
+MAX_TRACKED_WRITES = 256 # objects whose last write status is kept (for the UI)
+EXIT_FLUSH_SECONDS = 30.
+
+WriteKind = Literal["save_task", "exclude_task", "save_template", "exclude_templates"]
+WriteStatus = Literal["pending", "done", "failed"]
+
+
+class QueuedWrite(NamedTuple):
+    seq: int
+    kind: WriteKind
+    target: PublicTarget
+    key: str # of the written object: its writes replace each other
+    payload: dict
+    queued: float # monotonic
+
+
+class WriteRecord(NamedTuple):
+    key: str
+    label: str
+    status: WriteStatus
+    error: Optional[str]
+    coalesced: int # earlier writes of the object it replaced
+
+
+# WRITES ----------------------------------------------------------------------------------------------------------- #
+
+def _save_task(target: PublicTarget, payload: dict) -> None:
+    Loader.load_tasks_to_fs(target, MedicalTask.from_json(target, payload))
+
+def _exclude_task(target: PublicTarget, payload: dict) -> None:
+    Loader.exclude_task(target, MedicalTask(payload["name"], target))
+
+def _save_template(target: PublicTarget, payload: dict) -> None:
+    Loader.load_templates_to_fs(target, MedicalTemplate.from_json(MedicalTask(payload["task"], target), payload))
+
+def _exclude_templates(target: PublicTarget, payload: dict) -> None:
+    Loader.exclude_templates(target, MedicalTask(payload["name"], target))
+
+WRITERS: dict[WriteKind, Callable[[PublicTarget, dict], None]] = {
+    "save_task": _save_task,
+    "exclude_task": _exclude_task,
+    "save_template": _save_template,
+    "exclude_templates": _exclude_templates
+}
+
+def _label(write: QueuedWrite) -> str:
+    match write.kind:
+        case "save_task":
+            return f"Save task '{write.payload['name']}' ({write.target})"
+        case "exclude_task":
+            return f"Delete task '{write.payload['name']}' ({write.target})"
+        case "save_template":
+            return f"Save template {write.payload['iteration']} of '{write.payload['task']}' ({write.target})"
+        case _:
+            return f"Delete templates of '{write.payload['name']}' ({write.target})"
+
+
+class WriteBehindQueue:
+
+    def __init__(self, folder: Optional[Path]=None, coalesce: float=COALESCE_SECONDS):
+        self._folder = Path(folder) if folder is not None else storage_root().joinpath(WRITEBACK_DIR)
+        self._coalesce = coalesce
+        self._cond = threading.Condition()
+        self._pending: OrderedDict[str, QueuedWrite] = OrderedDict() # by object, in queue order
+        self._writing = 0 # taken by the worker, not written yet
+        self._in_flight: dict[str, QueuedWrite] = {} # the same, by object
+        self._flushing = 0 # callers waiting for everything to be written
+        self._records: OrderedDict[str, WriteRecord] = OrderedDict() # last write of every object
+        self._failed: dict[str, QueuedWrite] = {} # to be retried
+        self._seq = 0
+        self._closed = False
+
+        self._folder.mkdir(parents=True, exist_ok=True)
+        self._journal_path = self._folder.joinpath(f"{os.getpid()}-{time.time_ns()}.jsonl")
+        self._journal_fd = os.open(self._journal_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        fcntl.flock(self._journal_fd, fcntl.LOCK_EX) # held while alive, so others never replay it
+        self._recover()
+
+        self._worker = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    # JOURNAL ---------------------------------------------------------------------------------------------------- #
+
+    def _journal(self, *records: dict) -> None:
+        os.write(self._journal_fd, "".join(json.dumps(record) + "\n" for record in records).encode("utf-8"))
+
+    def _recover(self) -> None: # writes journaled by processes gone before writing them
+        for path in sorted(self._folder.glob("*.jsonl")):
+            if path == self._journal_path:
+                continue
+            try:
+                fp = path.open("rb")
+            except FileNotFoundError: # replayed by another process meanwhile
+                continue
+            with fp:
+                try:
+                    fcntl.flock(fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError: # its process is alive
+                    continue
+                writes, done = {}, set()
+                for line in fp.read().splitlines():
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError: # a line cut short by the crash
+                        continue
+                    if "done" in record:
+                        done.add(record["done"])
+                    else:
+                        writes[record["seq"]] = record
+                for seq in sorted(writes.keys() - done):
+                    record = writes[seq]
+                    self._enqueue(record["kind"], PublicTarget[record["target"]], record["key"], record["payload"])
+                path.unlink(missing_ok=True)
+
+    # QUEUE ------------------------------------------------------------------------------------------------------ #
+
+    def _track(self, write: QueuedWrite, status: WriteStatus, error: Optional[str]=None, coalesced: int=0) -> None:
+        self._records.pop(write.key, None)
+        self._records[write.key] = WriteRecord(write.key, _label(write), status, error, coalesced)
+        while len(self._records) > MAX_TRACKED_WRITES:
+            self._records.popitem(last=False)
+
+    def _enqueue(self, kind: WriteKind, target: PublicTarget, key: str, payload: dict) -> str:
+        with self._cond:
+            if self._closed:
+                print_message(f"Cannot queue '{key}' as writes are shut down", "error", RuntimeError)
+            self._seq += 1
+            write = QueuedWrite(self._seq, kind, target, key, payload, time.monotonic())
+            records = [{ "seq": write.seq, "kind": kind, "target": target.name, "key": key, "payload": payload }]
+
+            coalesced = 0
+            if (replaced := self._pending.pop(key, None)) is not None: # goes after, in the place of the newer one
+                records.append({ "done": replaced.seq })
+                coalesced = self._records[key].coalesced + 1 if key in self._records else 1
+            self._failed.pop(key, None)
+            self._journal(*records)
+
+            self._pending[key] = write
+            self._track(write, "pending", coalesced=coalesced)
+            self._cond.notify_all()
+            return key
+
+    def _take_ready(self) -> Optional[list[QueuedWrite]]: # None once closed and written
+        with self._cond:
+            while True:
+                if self._pending:
+                    first = next(iter(self._pending.values()))
+                    wait = first.queued + self._coalesce - time.monotonic()
+                    if wait <= 0 or self._closed or self._flushing:
+                        break
+                    self._cond.wait(wait)
+                elif self._closed:
+                    return None
+                else:
+                    self._cond.wait()
+
+            now, ready = time.monotonic(), []
+            for key, write in list(self._pending.items()): # queued in order, so the ready ones come first
+                if not (self._closed or self._flushing) and write.queued + self._coalesce > now:
+                    break
+                ready.append(self._pending.pop(key))
+            self._writing = len(ready)
+            self._in_flight = { write.key: write for write in ready }
+            return ready
+
+    def _run(self) -> None:
+        while (ready := self._take_ready()) is not None:
+            outcomes = []
+            for write in ready:
+                try:
+                    WRITERS[write.kind](write.target, write.payload)
+                    outcomes.append((write, None))
+                except Exception as e: # kept for the UI, and for a retry
+                    outcomes.append((write, f"{type(e).__name__}: {e}"))
+
+            with self._cond:
+                self._journal(*({ "done": write.seq } for write, _ in outcomes))
+                for write, error in outcomes:
+                    if self._pending.get(write.key) is not None: # queued again meanwhile
+                        continue
+                    coalesced = self._records[write.key].coalesced if write.key in self._records else 0
+                    self._track(write, "done" if error is None else "failed", error, coalesced)
+                    if error is not None:
+                        self._failed[write.key] = write
+                self._writing = 0
+                self._in_flight = {}
+                if not self._pending: # nothing left to replay
+                    os.ftruncate(self._journal_fd, 0)
+                self._cond.notify_all()
+
+    def flush(self, timeout: Optional[float]=None) -> bool: # False if still writing after the timeout
+        with self._cond:
+            self._flushing += 1
+            self._cond.notify_all()
+            try:
+                return self._cond.wait_for(lambda: not self._pending and not self._writing, timeout)
+            finally:
+                self._flushing -= 1
+
+    def close(self, timeout: float=EXIT_FLUSH_SECONDS) -> None:
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._worker.join(timeout)
+        if not self._worker.is_alive():
+            os.close(self._journal_fd)
+            if self._journal_path.stat().st_size == 0:
+                self._journal_path.unlink()
+
+    # OBJECTS ---------------------------------------------------------------------------------------------------- #
+    # Only changed objects are queued, and they count as saved from then on (their last status tells otherwise)
+
+    def save_task(self, target: PublicTarget, task: MedicalTask) -> Optional[str]:
+        if not task.dirty:
+            return None
+        key = self._enqueue("save_task", target, f"{target.name}/task/{task.name}", task.to_json())
+        task.mark_clean()
+        return key
+
+    def task_stored(self, target: PublicTarget, task: MedicalTask) -> bool: # saved, or queued to be (not to be deleted)
+        key = f"{target.name}/task/{task.name}"
+        with self._cond:
+            if (write := self._pending.get(key) or self._in_flight.get(key)) is not None: # the newer one first
+                return write.kind == "save_task"
+        return Loader.task_exists(target, task.name) # written (or failed) by now
+
+    def exclude_task(self, target: PublicTarget, task: MedicalTask) -> str:
+        return self._enqueue("exclude_task", target, f"{target.name}/task/{task.name}", { "name": task.name })
+
+    def save_templates(self, target: PublicTarget, templates: MedicalTemplate|set[MedicalTemplate]) -> dict[str, MedicalTemplate]:
+        queued = {}
+        for template in sorted(settization(templates)):
+            if not template.dirty:
+                continue
+            key = self._enqueue("save_template", target, f"{target.name}/template/{template.task}/{template.iteration}", template.to_json())
+            template.mark_clean()
+            queued[key] = template
+        return queued
+
+    def exclude_templates(self, target: PublicTarget, task: MedicalTask) -> str:
+        return self._enqueue("exclude_templates", target, f"{target.name}/templates/{task.name}", { "name": task.name })
+
+    def retry(self, key: str) -> bool: # the failed snapshot, unless the object was queued again since
+        with self._cond:
+            if (write := self._failed.get(key)) is None:
+                return False
+        self._enqueue(write.kind, write.target, write.key, write.payload)
+        return True
+
+    # STATUS ----------------------------------------------------------------------------------------------------- #
+
+    def status(self, keys: Iterable[str]) -> list[WriteRecord]: # of the objects still tracked
+        with self._cond:
+            return [self._records[key] for key in keys if key in self._records]
+
+    def stats(self) -> dict[str, int]:
+        with self._cond:
+            counts = { "pending": len(self._pending) + self._writing, "done": 0, "failed": 0 }
+            for record in self._records.values():
+                if record.status != "pending":
+                    counts[record.status] += 1
+            counts["coalesced"] = sum(record.coalesced for record in self._records.values())
+            return counts
@@ -0,0 +1,220 @@
+#########################################################
+# Which tasks and templates are rendered, and how fast? #
+#########################################################
+
+# - Every render of app.py is an event (target, task, template, render time, default or custom inputs)
+# | Recording one only appends it to a ring buffer in memory: the script run never waits for the disk
+# | A full buffer drops its oldest events (counted), it never blocks
+# - A background thread writes the buffer in batches (every FLUSH_SECONDS, or sooner once BATCH_SIZE events are in)
+# | to a JSONL file that is rotated past MAX_FILE_BYTES (BACKUP_FILES kept), shared by every process of the host
+# | A batch that cannot be written (folder not writable, disk full) goes back to the buffer, for the next flush
+# - What is left is written when the process exits (or counted as dropped)
+
+import os, json, math, time, fcntl, atexit, threading
+from collections import Counter, defaultdict, deque
+from pathlib import Path
+from typing import Any, Iterable, Iterator, NamedTuple, Optional
+
+from resources.domain.target import PublicTarget
+from resources.domain.task import MedicalTask
+from resources.domain.template import MedicalTemplate
+from resources.storage.load import storage_root
+
+TELEMETRY_ENV = "MEDICAL_TELEMETRY_DIR" # empty to record nothing
+TELEMETRY_DIR = "telemetry"
+EVENTS_FILE = "renders.jsonl"
+LOCK_FILE = ".lock"
+BUFFER_CAPACITY = 4096 # events
+BATCH_SIZE = 256
+FLUSH_SECONDS = 2.
+MAX_FILE_BYTES = 8 << 20
+BACKUP_FILES = 4 # renders.1.jsonl (newest) ... renders.4.jsonl (oldest)
+
+
+class RenderEvent(NamedTuple):
+    time: float
+    target: str
+    task: str
+    template: str # id
+    render_ms: float
+    custom_inputs: bool # any input changed from its default
+    prerendered: bool
+
+
+def _default_input(task: MedicalTask, name: str) -> Any:
+    default = task.prop_value(name, default=True)
+    return default.first() if task.prop_type(name) is list else default # a list defaults to its first option
+
+def has_custom_inputs(task: MedicalTask, variables: Optional[Iterable[str]]=None) -> bool: # every property by default
+    return any(task[name] != _default_input(task, name) for name in (task if variables is None else variables) if name in task)
+
+
+class UsageTelemetry:
+
+    def __init__(self,
+            folder: Optional[Path]=None,
+            capacity: int=BUFFER_CAPACITY,
+            batch_size: int=BATCH_SIZE,
+            flush_seconds: float=FLUSH_SECONDS
+        ):
+        self._folder = Path(folder) if folder is not None else None # nothing is recorded without it
+        self._buffer: deque[RenderEvent] = deque(maxlen=capacity) # appends and pops are thread-safe
+        self._batch_size = batch_size
+        self._flush_seconds = flush_seconds
+        self._wake = threading.Event()
+        self._stopped = False
+        self._stats = { "recorded": 0, "dropped": 0, "written": 0, "batches": 0, "failed": 0 }
+
+        if self._folder is not None:
+            self._flusher = threading.Thread(target=self._run, name="telemetry", daemon=True)
+            self._flusher.start()
+            atexit.register(self.close)
+
+    @classmethod
+    def from_env(cls) -> 'UsageTelemetry':
+        folder = os.environ.get(TELEMETRY_ENV, str(storage_root().joinpath(TELEMETRY_DIR)))
+        return cls(Path(folder) if folder else None)
+
+    @property
+    def path(self) -> Optional[Path]:
+        return self._folder.joinpath(EVENTS_FILE) if self._folder is not None else None
+
+    def stats(self) -> dict[str, int]:
+        return { **self._stats, "buffered": len(self._buffer) }
+
+    # RECORDING -------------------------------------------------------------------------------------------------- #
+
+    def record(self,
+            target: PublicTarget,
+            task: MedicalTask,
+            template: MedicalTemplate,
+            render_seconds: float,
+            custom_inputs: bool,
+            prerendered: bool
+        ) -> None:
+        if self._folder is None:
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self._stats["dropped"] += 1 # the oldest one, by the append below
+        self._buffer.append(RenderEvent(
+            time.time(), str(target), task.name, template.id, round(render_seconds * 1e3, 3), custom_inputs, prerendered
+        ))
+        self._stats["recorded"] += 1
+        if len(self._buffer) >= self._batch_size and not self._wake.is_set():
+            self._wake.set()
+
+    # FLUSHING --------------------------------------------------------------------------------------------------- #
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wake.wait(self._flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def _rotate(self) -> None:
+        oldest = self._folder.joinpath(f"{Path(EVENTS_FILE).stem}.{BACKUP_FILES}.jsonl")
+        oldest.unlink(missing_ok=True)
+        for number in range(BACKUP_FILES - 1, 0, -1):
+            backup = self._folder.joinpath(f"{Path(EVENTS_FILE).stem}.{number}.jsonl")
+            if backup.exists():
+                os.replace(backup, self._folder.joinpath(f"{Path(EVENTS_FILE).stem}.{number + 1}.jsonl"))
+        os.replace(self.path, self._folder.joinpath(f"{Path(EVENTS_FILE).stem}.1.jsonl"))
+
+    def flush(self) -> int: # events written
+        if self._folder is None or not self._buffer:
+            return 0
+        batch = [self._buffer.popleft() for _ in range(len(self._buffer))]
+        data = "".join(json.dumps(event._asdict()) + "\n" for event in batch).encode("utf-8")
+
+        try:
+            self._write(data)
+        except OSError: # kept for the next flush, before what was recorded meanwhile (dropped if it does not fit)
+            self._stats["failed"] += 1
+            self._stats["dropped"] += max(0, len(self._buffer) + len(batch) - self._buffer.maxlen)
+            self._buffer.extendleft(reversed(batch))
+            return 0
+
+        self._stats["written"] += len(batch)
+        self._stats["batches"] += 1
+        return len(batch)
+
+    def _write(self, data: bytes) -> None:
+        self._folder.mkdir(parents=True, exist_ok=True)
+        with self._folder.joinpath(LOCK_FILE).open("a") as lock: # rotations and appends of every process
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if self.path.exists() and self.path.stat().st_size + len(data) > MAX_FILE_BYTES:
+                self._rotate()
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+
+    def close(self) -> None:
+        if self._folder is None or self._stopped:
+            return
+        self._stopped = True
+        self._wake.set()
+        self._flusher.join()
+        self.flush() # recorded meanwhile
+        self._stats["dropped"] += len(self._buffer) # not written, and nothing left to write them
+        self._buffer.clear()
+
+
+# SUMMARY ---------------------------------------------------------------------------------------------------------- #
+
+def event_files(folder: Path) -> list[Path]: # oldest first
+    stem = Path(EVENTS_FILE).stem
+    backups = [folder.joinpath(f"{stem}.{number}.jsonl") for number in range(BACKUP_FILES, 0, -1)]
+    return [path for path in (*backups, folder.joinpath(EVENTS_FILE)) if path.exists()]
+
+def read_events(folder: Path, since: Optional[float]=None) -> Iterator[RenderEvent]:
+    for path in event_files(folder):
+        with path.open("rb") as fp:
+            for line in fp:
+                try:
+                    event = RenderEvent(**json.loads(line))
+                except (json.JSONDecodeError, TypeError): # cut short, or of another version
+                    continue
+                if since is None or event.time >= since:
+                    yield event
+
+def latency_summary(values: list[float]) -> dict[str, float]:
+    if not values:
+        return {}
+    ordered = sorted(values)
+    percentile = lambda p: ordered[min(len(ordered) - 1, math.ceil(p * len(ordered)) - 1)] # nearest rank
+    return {
+        "mean": round(sum(ordered) / len(ordered), 3),
+        "p50": percentile(.5),
+        "p90": percentile(.9),
+        "p99": percentile(.99),
+        "max": ordered[-1]
+    }
+
+def summarize(events: Iterable[RenderEvent], top: int=10) -> dict:
+    renders: dict[tuple[str, str], list[RenderEvent]] = defaultdict(list)
+    templates, targets, latencies = Counter(), Counter(), []
+    for event in events:
+        renders[(event.target, event.task)].append(event)
+        templates[event.template] += 1
+        targets[event.target] += 1
+        latencies.append(event.render_ms)
+
+    top_tasks = sorted(renders.items(), key=lambda item: len(item[1]), reverse=True)[:top]
+    return {
+        "events": len(latencies),
+        "targets": dict(targets.most_common()),
+        "render_ms": latency_summary(latencies),
+        "top_tasks": [
+            {
+                "target": target,
+                "task": task,
+                "renders": len(task_events),
+                "custom_inputs": round(sum(e.custom_inputs for e in task_events) / len(task_events), 3),
+                "prerendered": round(sum(e.prerendered for e in task_events) / len(task_events), 3),
+                "render_ms": latency_summary([e.render_ms for e in task_events])
+            } for (target, task), task_events in top_tasks
+        ],
+        "top_templates": [{ "template": template, "renders": count } for template, count in templates.most_common(top)]
+    }
@@ -0,0 +1,97 @@
+##########################################
+# How many tokens does a prompt take up? #
+##########################################
+
+# - Estimated offline, without a tokenizer: text is pre-split as BPE tokenizers do (words, numbers, symbols, spaces)
+# | and each piece is charged by its length; close to the counts of GPT tokenizers for prose, never exact
+# - A template is a sequence of literal segments and variables (as compiled by the f-string formatter)
+# | Literals are counted once (cached by their text, so iterations sharing them share the counts)
+# | Only the substituted values are counted on each render
+# - A task may set a budget: prompts near it are warned about, and prompts over it are not sent
+
+import math, re, string
+from functools import lru_cache
+from typing import Any, Literal, Optional
+
+WARN_RATIO = .9 # of the budget, from where a prompt is warned about
+
+BudgetStatus = Literal["unbounded", "within", "near", "over"]
+
+_PIECES = re.compile(
+    r"(?P<contraction>'(?:[sdmtSDMT]|ll|ve|re)(?![^\W\d_]))"
+    r"|(?P<word>[^\W\d_]+)"
+    r"|(?P<number>\d{1,3})" # numbers are split in groups of 3 digits
+    r"|(?P<space>\s+)"
+    r"|(?P<symbol>[^\w\s]+|_+)"
+)
+_FORMATTER = string.Formatter() # the one f-string templates are formatted with
+
+CHARS_PER_WORD_TOKEN = 6 # longer (or rarer, non-ASCII) words are split in subwords
+CHARS_PER_SYMBOL_TOKEN = 2
+CHARS_PER_SPACE_TOKEN = 8
+
+
+def _piece_tokens(kind: str, piece: str) -> int:
+    match kind:
+        case "word":
+            return math.ceil(len(piece.encode("utf-8")) / CHARS_PER_WORD_TOKEN)
+        case "space": # a single space is merged into the piece after it
+            return 0 if piece == " " else math.ceil(len(piece) / CHARS_PER_SPACE_TOKEN)
+        case "symbol":
+            return math.ceil(len(piece) / CHARS_PER_SYMBOL_TOKEN)
+        case _:
+            return 1
+
+def estimate_tokens(text: str) -> int:
+    return sum(_piece_tokens(match.lastgroup, match.group()) for match in _PIECES.finditer(text))
+
+
+# TEMPLATES -------------------------------------------------------------------------------------------------------- #
+
+@lru_cache(maxsize=8192)
+def literal_tokens(literal: str) -> int:
+    return estimate_tokens(literal)
+
+@lru_cache(maxsize=1024) # same content, same segments (as _compile_template)
+def template_segments(content: str) -> tuple[tuple[int, Optional[str], str, Optional[str]], ...]:
+    # (tokens of the literal, field, format spec, conversion) ; field is None for a trailing literal
+    return tuple(
+        (literal_tokens(literal), field, spec or "", conversion)
+        for literal, field, spec, conversion in _FORMATTER.parse(content)
+    )
+
+def template_variables(content: str) -> frozenset[str]: # as get_template_variables (f-string), from the same segments
+    try:
+        return frozenset(field for _, field, _, _ in template_segments(content) if field is not None)
+    except ValueError: # not a valid template (e.g., a stray brace while editing), so it uses nothing yet
+        return frozenset()
+
+def _value_text(field: str, spec: str, conversion: Optional[str], inputs: dict[str, Any]) -> str:
+    try:
+        value, _ = _FORMATTER.get_field(field, (), inputs)
+    except (KeyError, AttributeError, IndexError): # not substituted, so left as written
+        return f"{{{field}}}"
+    value = _FORMATTER.convert_field(value, conversion)
+    try:
+        return _FORMATTER.format_field(value, spec)
+    except (ValueError, TypeError):
+        return str(value)
+
+def prompt_tokens(content: str, inputs: dict[str, Any]) -> int: # of the prompt the content renders with the inputs
+    try:
+        return sum(
+            tokens + (estimate_tokens(_value_text(field, spec, conversion, inputs)) if field is not None else 0)
+            for tokens, field, spec, conversion in template_segments(content)
+        )
+    except ValueError: # not a valid template (e.g., a stray brace while editing), so counted as written
+        return estimate_tokens(content)
+
+
+# BUDGETS ---------------------------------------------------------------------------------------------------------- #
+
+def budget_status(tokens: int, budget: Optional[int]) -> BudgetStatus:
+    if not budget:
+        return "unbounded"
+    if tokens > budget:
+        return "over"
+    return "near" if tokens >= WARN_RATIO * budget else "within"
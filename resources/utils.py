@@ -10,6 +10,7 @@ from pathlib import Path
 
 PROJECT_ROOT_PATH = Path(__name__).absolute().parent # running app.py path
 DATE_FORMAT = "%d-%m-%Y"
+MAX_LISTED_OPTIONS = 50 # by a selectbox, more are searched by prefix
 
 #---------#
 # Classes #
@@ -183,11 +184,22 @@ def create_input_for_type(value_type: Type, **args) -> Any:
     return value_config[0](**value_config[1], **args)
 
 def draw_user_input_for_type(value_type: Type, **args):
+    selected = args.pop("selected", None) # option of a list property selected so far
     
-    def list_handler(value: Optional[list], **args):
-        if value is None or not isinstance(value, list):
+    def list_handler(value: Optional[list], **args): # a list of options or a Vocabulary
+        if value is None:
             value = []
-        return st.selectbox(options=value, **args)
+        if len(value) <= MAX_LISTED_OPTIONS or not hasattr(value, "search"):
+            return st.selectbox(options=list(value), **args)
+
+        # Too many options to list, so they are narrowed by a prefix first (the selected one is kept listed)
+        prefix = st.text_input(label=f"🔎 {args['label']}", placeholder=f"Search {len(value)} options...")
+        options = value.search(prefix, limit=MAX_LISTED_OPTIONS)
+        if selected is not None and selected not in options:
+            options.insert(0, selected)
+        if not options: # nothing found, so the selection stays as it was
+            return selected if selected is not None else value.first()
+        return st.selectbox(options=options, index=options.index(selected) if selected in options else 0, **args)
     
     type_config = {
         int: (st.number_input, { "step": 1 }),
@@ -233,3 +245,13 @@ def text_copy_button(text: str):
         height=38.5
     )
 
+
+def draw_token_budget(tokens: int, status: str, budget: Optional[int], container=st) -> bool: # False when over it
+    match status:
+        case "over":
+            container.error(f"~{tokens} tokens: over the budget of the task ({budget} tokens)")
+        case "near":
+            container.warning(f"~{tokens} tokens: near the budget of the task ({budget} tokens)")
+        case _:
+            container.caption(f"~{tokens} tokens" + (f" of {budget}" if budget else "") + " (estimated)")
+    return status != "over"
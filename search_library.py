@@ -0,0 +1,36 @@
+#!../.venv/bin/python3
+import sys, time, json, argparse
+
+from resources import *
+from resources.search import SearchIndex
+
+def main():
+    parser = argparse.ArgumentParser(description="Search tasks and templates of the prompt library")
+    parser.add_argument("query", help="Words to look for (e.g., a variable, a phrase or a guideline)")
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--kind", choices=["task", "template"], default=None)
+    parser.add_argument("--target", action="append", default=None, help="Public target to search in (repeatable)")
+    parser.add_argument("--json", action="store_true", help="Print the hits as JSON")
+    args = parser.parse_args()
+
+    targets = [PublicTarget[t.strip().upper().replace(" ", "_")] for t in args.target] if args.target else list(PublicTarget)
+
+    start = time.perf_counter()
+    index = SearchIndex.build(targets)
+    built = time.perf_counter()
+    hits = index.search(args.query, limit=args.limit, kind=args.kind)
+    searched = time.perf_counter()
+
+    if args.json:
+        print(json.dumps([{ **hit._asdict(), "target": str(hit.target) } for hit in hits], indent=4))
+    else:
+        for hit in hits:
+            where = f"{hit.target} > {hit.task}" + (f" > {hit.iteration} | {hit.name}" if hit.kind == "template" else "")
+            print(f"{hit.score:8.3f}  [{hit.kind}] {where}")
+
+    print(f"{len(index)} documents indexed in {(built - start) * 1e3:.0f} ms, "
+          f"searched in {(searched - built) * 1e3:.2f} ms", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+#!../.venv/bin/python3
+import time, json, argparse
+from pathlib import Path
+
+from resources import *
+from resources.storage.load import storage_root
+from resources.telemetry import TELEMETRY_DIR, read_events, summarize
+
+def main():
+    parser = argparse.ArgumentParser(description="Most rendered tasks and templates of app.py, and their render times")
+    parser.add_argument("--storage", type=Path, default=None, help="Library root the telemetry was recorded in (default: resources/storage)")
+    parser.add_argument("--dir", type=Path, default=None, help="Telemetry folder (default: <storage>/telemetry)")
+    parser.add_argument("--top", type=int, default=10, help="Tasks and templates listed")
+    parser.add_argument("--hours", type=float, default=None, help="Only the renders of the last hours")
+    args = parser.parse_args()
+
+    if args.storage is not None:
+        use_storage(args.storage)
+    folder = args.dir if args.dir is not None else storage_root().joinpath(TELEMETRY_DIR)
+    since = time.time() - args.hours * 3600 if args.hours is not None else None
+
+    print(json.dumps(summarize(read_events(folder, since), top=args.top), indent=4))
+
+
+if __name__ == "__main__":
+    main()
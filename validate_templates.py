@@ -0,0 +1,116 @@
+#!../.venv/bin/python3
+import os, sys, json, time, argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from resources import *
+from resources.storage.load import MODE_SOURCE_PATHS
+
+CHUNK_SIZE = 256 # template files per worker job
+
+# Tasks loaded once per worker process and target
+_worker_tasks: dict[PublicTarget, dict[str, MedicalTask]] = {}
+
+
+def _target_tasks(target: PublicTarget) -> dict[str, MedicalTask]:
+    if target not in _worker_tasks:
+        tasks = Loader.load_tasks_from_fs(target)
+        _worker_tasks[target] = { t.name: t for t in settization(tasks) } if tasks else {}
+    return _worker_tasks[target]
+
+
+def validate_template_file(target: PublicTarget, template_file: Path) -> dict:
+    issue = { "target": str(target), "file": template_file.name }
+    try:
+        with template_file.open() as fp:
+            data: dict = json.load(fp)
+    except (OSError, ValueError) as e: # unreadable or malformed
+        return { **issue, "error": f"{type(e).__name__}: {e}" }
+    return validate_template_data(target, data, issue)
+
+
+def validate_template_data(target: PublicTarget, data: dict, issue: dict) -> dict:
+    try:
+        issue.update(task=data.get("task"), iteration=data.get("iteration"))
+
+        if (task := _target_tasks(target).get(data.get("task"))) is None:
+            return { **issue, "error": "Template assigned to a task that does not exist" }
+
+        missing_required, ignored, unknown = MedicalTemplate.from_json(task, data).check_variables()
+    except (ValueError, AssertionError, KeyError) as e: # not parseable
+        return { **issue, "error": f"{type(e).__name__}: {e}" }
+
+    if missing_required or unknown:
+        issue["error"] = "Template does not match its task"
+    issue.update(
+        missing_required=sorted(missing_required),
+        unknown=sorted(unknown),
+        ignored=sorted(ignored)
+    )
+    return issue
+
+
+def validate_chunk(storage: Path, target_name: str, template_files: list[Path]) -> list[dict]:
+    use_storage(storage)
+    target = PublicTarget[target_name]
+    return [validate_template_file(target, f) for f in template_files]
+
+
+def validate_histories(storage: Path, target_name: str) -> list[dict]: # every iteration kept as a delta
+    use_storage(storage)
+    target = PublicTarget[target_name]
+    return [
+        validate_template_data(target, data, { "target": str(target), "file": history.paths[0].name })
+        for history in Loader.template_histories(target) for data in history.iter_templates()
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate every stored template against its task")
+    parser.add_argument("--storage", type=Path, default=None, help="Library root with tasks/ and templates/ (default: resources/storage)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--strict", action="store_true", help="Fail on ignored-variable warnings as well")
+    parser.add_argument("--output", type=Path, default=None, help="Write the JSON report to a file instead of stdout")
+    args = parser.parse_args()
+
+    if args.storage is not None:
+        use_storage(args.storage)
+    storage = MODE_SOURCE_PATHS[LoadMode.TEMPLATE].parent.absolute()
+
+    start = time.perf_counter()
+    jobs = []
+    for target in PublicTarget:
+        files = [f.absolute() for f in Loader.list_files(target, LoadMode.TEMPLATE)]
+        jobs += [(target.name, files[i:i + CHUNK_SIZE]) for i in range(0, len(files), CHUNK_SIZE)]
+
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = [pool.submit(validate_chunk, storage, target_name, files) for target_name, files in jobs]
+        futures += [pool.submit(validate_histories, storage, target.name) for target in PublicTarget]
+        results = [issue for future in futures for issue in future.result()]
+
+    errors = [r for r in results if "error" in r]
+    warnings = [r for r in results if "error" not in r and r["ignored"]]
+    report = {
+        "summary": {
+            "templates": len(results),
+            "errors": len(errors),
+            "warnings": len(warnings),
+            "seconds": round(time.perf_counter() - start, 3)
+        },
+        "errors": errors,
+        "warnings": warnings
+    }
+
+    if args.output is None:
+        json.dump(report, sys.stdout, indent=4)
+        print()
+    else:
+        with args.output.open("w") as fp:
+            json.dump(report, fp, indent=4)
+        print(json.dumps(report["summary"]), file=sys.stderr)
+
+    sys.exit(1 if errors or args.strict and warnings else 0)
+
+
+if __name__ == "__main__":
+    main()